@@ -0,0 +1,200 @@
+"""
+Archival of closed orders out of the Order table.
+
+`archive_orders` moves closed orders created before a cutoff, or below an
+order id for orders older than their `created` column, in batches, either
+to the ArchivedOrder table or to compressed columnar files on local disk
+indexed by ArchiveFile. Every batch adds the net executed quantity and the
+booked cost of its orders to OrderSummary in the same transaction, so
+aggregates over the order history stay correct. Open limit orders are never archived, the
+matching engine replays them.
+"""
+import contextlib
+import gzip
+import json
+import os
+import time
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils.dateparse import parse_datetime
+
+from core.models import ArchivedOrder, ArchiveFile, Order, OrderSummary
+from core.serializer import OrderValuesSerializer
+
+ARCHIVE_FIELDS = ('id', 'owner_id', 'stock_id', 'type', 'quantity', 'limit_price', 'filled_quantity', 'created')
+
+
+def get_archivable(cutoff=None, before_id=None):
+    """
+    Returns the orders created before the cutoff and with an id below
+    `before_id`, when given, that are not open limit orders
+    """
+    queryset = Order.objects.exclude(limit_price__isnull=False, filled_quantity__lt=F('quantity'))
+    if cutoff is not None:
+        queryset = queryset.filter(created__lt=cutoff)
+    if before_id is not None:
+        queryset = queryset.filter(id__lt=before_id)
+    return queryset
+
+
+class TableStore:
+    """
+    Archives orders to the ArchivedOrder table
+    """
+
+    def write(self, rows):
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**row) for row in rows])
+
+    def discard(self):
+        pass
+
+    def find(self, pk):
+        return ArchivedOrder.objects.filter(pk=pk).values(*OrderValuesSerializer.fields).first()
+
+
+class FileStore:
+    """
+    Archives every batch of orders to a gzip compressed JSON file holding one
+    array per column, indexed by ArchiveFile. A file is written under a
+    temporary name and renamed once its batch commits.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = set()
+
+    def write(self, rows):
+        os.makedirs(self.path, exist_ok=True)
+        min_id, max_id = rows[0]['id'], rows[-1]['id']
+        path = os.path.join(self.path, f'orders-{min_id}-{max_id}.json.gz')
+        columns = {field: [row[field] for row in rows] for field in ARCHIVE_FIELDS}
+        content = gzip.compress(json.dumps(columns, default=str).encode())
+
+        self.pending.add(f'{path}.tmp')
+        with open(f'{path}.tmp', 'wb') as archive_file:
+            archive_file.write(content)
+        ArchiveFile.objects.create(path=path, min_id=min_id, max_id=max_id, count=len(rows))
+        transaction.on_commit(lambda: self.commit(path))
+
+    def commit(self, path):
+        os.replace(f'{path}.tmp', path)
+        self.pending.discard(f'{path}.tmp')
+
+    def discard(self):
+        """
+        Removes the temporary files of rolled back batches
+        """
+        for path in self.pending:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        self.pending.clear()
+
+    @staticmethod
+    def find(pk):
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return None
+        for path in ArchiveFile.objects.filter(min_id__lte=pk, max_id__gte=pk).values_list('path', flat=True):
+            try:
+                archive_file = gzip.open(path)
+            except FileNotFoundError:
+                # Committed but not renamed yet
+                archive_file = gzip.open(f'{path}.tmp')
+            with archive_file:
+                columns = json.load(archive_file)
+            if pk in columns['id']:
+                index = columns['id'].index(pk)
+                limit_price = columns['limit_price'][index]
+                return {
+                    'id': pk,
+                    'owner': columns['owner_id'][index],
+                    'stock': columns['stock_id'][index],
+                    'type': columns['type'][index],
+                    'quantity': columns['quantity'][index],
+                    'limit_price': None if limit_price is None else Decimal(limit_price),
+                    'filled_quantity': columns['filled_quantity'][index],
+                    'created': parse_datetime(columns['created'][index]),
+                }
+        return None
+
+
+def archive_batch(cutoff, batch_size, store, before_id=None):
+    """
+    Moves at most `batch_size` archivable orders, oldest first, to the store
+    in one transaction. Returns the number of archived orders.
+    """
+    try:
+        with transaction.atomic():
+            rows = list(
+                get_archivable(cutoff, before_id)
+                .select_for_update(skip_locked=True)
+                .order_by('id')
+                .values(*ARCHIVE_FIELDS)[:batch_size]
+            )
+            if not rows:
+                return 0
+
+            ids = [row['id'] for row in rows]
+            summaries = (
+                Order.objects
+                .filter(id__in=ids)
+                .values('owner_id', 'stock_id')
+                .annotate(net_quantity=Sum(Order.signed_quantity()), cost=Sum('booked_cost'), count=Count('id'))
+                .order_by()
+            )
+            store.write(rows)
+            OrderSummary.add([
+                {
+                    'owner_id': summary['owner_id'],
+                    'stock_id': summary['stock_id'],
+                    'quantity': summary['net_quantity'],
+                    'cost': summary['cost'],
+                    'orders': summary['count'],
+                }
+                for summary in summaries
+            ])
+            # Archived orders stay booked in the positions, so the deletion
+            # skips the signal reverting deleted orders
+            Order.objects.filter(id__in=ids)._raw_delete(Order.objects.db)
+    except Exception:
+        store.discard()
+        raise
+    return len(rows)
+
+
+def archive_orders(cutoff, store, batch_size=None, max_batches=None, before_id=None):
+    """
+    Archives the archivable orders created before the cutoff and below
+    `before_id`, one batch per transaction, and returns a report of the
+    throughput
+    """
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    started = time.perf_counter()
+    report = {'archived': 0, 'batches': 0}
+    while max_batches is None or report['batches'] < max_batches:
+        archived = archive_batch(cutoff, batch_size, store, before_id)
+        if not archived:
+            break
+        report['archived'] += archived
+        report['batches'] += 1
+
+    seconds = time.perf_counter() - started
+    report['seconds'] = round(seconds, 3)
+    report['rows_per_second'] = round(report['archived'] / seconds) if seconds else None
+    return report
+
+
+def find_archived_order(pk):
+    """
+    Returns the archived order as a `OrderValuesSerializer` row, or None
+    """
+    try:
+        row = TableStore().find(pk)
+    except (TypeError, ValueError):
+        return None
+    return row or FileStore.find(pk)
@@ -0,0 +1,162 @@
+"""
+Async read endpoints served through the ASGI application.
+
+Django 3.2 has no async ORM, so the queries of these views run in a thread
+pool through `database_sync_to_async` and the event loop keeps serving other
+requests meanwhile. Responses match the corresponding viewset actions.
+"""
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from core.archive import find_archived_order
+from core.models import Order, Stock
+from core.pagination import OrderCursorPagination
+from core.renderers import FastJSONRenderer
+from core.serializer import OrderValuesSerializer, StockSearchSerializer, StockValuesSerializer, TotalInvestedSerializer
+from core.views import OrderViewSet
+
+
+def database_sync_to_async(func):
+    """
+    Runs a function using the ORM in a worker thread, closing the thread's
+    connection when it is no longer usable like Django does per request.
+    """
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(inner, thread_sensitive=False)
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(FastJSONRenderer().render(data), content_type='application/json', status=status)
+
+
+def render_api_exception(exc):
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(detail, status=exc.status_code)
+
+
+def async_api_view(methods):
+    """
+    Restricts an async view to the given methods and renders API exceptions,
+    Http404 and PermissionDenied like the REST framework views
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return json_response(
+                    {'detail': f'Method "{request.method}" not allowed.'},
+                    status=status.HTTP_405_METHOD_NOT_ALLOWED
+                )
+            try:
+                return await view(request, *args, **kwargs)
+            except Http404:
+                return render_api_exception(exceptions.NotFound())
+            except PermissionDenied:
+                return render_api_exception(exceptions.PermissionDenied())
+            except exceptions.APIException as exc:
+                return render_api_exception(exc)
+
+        wrapper.csrf_exempt = True
+        return wrapper
+
+    return decorator
+
+
+def authenticate(request):
+    """
+    Authenticates the request with the REST framework authentication classes
+    """
+    api_request = Request(
+        request,
+        authenticators=[authentication() for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    if not api_request.user or not api_request.user.is_authenticated:
+        raise exceptions.NotAuthenticated()
+    return api_request
+
+
+@database_sync_to_async
+def list_stocks(params):
+    if params.get('search'):
+        search_serializer = StockSearchSerializer(data=params)
+        search_serializer.is_valid(raise_exception=True)
+        queryset = Stock.objects.search(**search_serializer.validated_data)
+    else:
+        queryset = Stock.objects.all()
+    return StockValuesSerializer(StockValuesSerializer.values(queryset)).data
+
+
+@database_sync_to_async
+def retrieve_stock(pk):
+    stock = get_object_or_404(StockValuesSerializer.values(Stock.objects.all()), pk=pk)
+    return StockValuesSerializer.to_representation(stock)
+
+
+@database_sync_to_async
+def list_orders(request):
+    api_request = authenticate(request)
+    queryset = OrderViewSet().filter_queryset(api_request)
+    paginator = OrderCursorPagination()
+    page = paginator.paginate_queryset(OrderValuesSerializer.values(queryset), api_request)
+    return paginator.get_paginated_response(OrderValuesSerializer(page).data).data
+
+
+@database_sync_to_async
+def retrieve_order(request, pk):
+    authenticate(request)
+    order = OrderValuesSerializer.values(Order.objects.filter(pk=pk)).first() or find_archived_order(pk)
+    if order is None:
+        raise Http404
+    return OrderValuesSerializer.to_representation(order)
+
+
+@database_sync_to_async
+def compute_total_invested(data):
+    serializer = TotalInvestedSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.data
+
+
+@async_api_view(['GET'])
+async def stock_list(request):
+    return json_response(await list_stocks(request.GET))
+
+
+@async_api_view(['GET'])
+async def stock_detail(request, pk):
+    return json_response(await retrieve_stock(pk))
+
+
+@async_api_view(['GET'])
+async def order_list(request):
+    return json_response(await list_orders(request))
+
+
+@async_api_view(['GET'])
+async def order_detail(request, pk):
+    return json_response(await retrieve_order(request, pk))
+
+
+@async_api_view(['POST'])
+async def total_invested(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise exceptions.ParseError()
+    return json_response(await compute_total_invested(data))
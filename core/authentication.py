@@ -0,0 +1,158 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+SIGNED_TOKEN_SALT = 'core.authentication.SignedTokenAuthentication'
+
+
+class TokenCache:
+    """
+    Per-process LRU cache of token keys to cached users, with a TTL per entry
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(settings.TOKEN_AUTH_CACHE_SIZE, settings.TOKEN_AUTH_CACHE_TTL)
+
+
+def get_shared_cache():
+    if settings.TOKEN_AUTH_SHARED_CACHE:
+        return caches[settings.TOKEN_AUTH_SHARED_CACHE]
+    return None
+
+
+def get_shared_cache_key(key):
+    return f'auth:token:{key}'
+
+
+def get_auth_fields(user):
+    """
+    Returns the user fields used for authorization. They are cached and
+    signed in place of the user, so neither holds its password hash.
+    """
+    return {
+        'id': user.pk,
+        'username': user.username,
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+    }
+
+
+def load_auth_user(fields):
+    """
+    Returns an unsaved user rebuilt from the fields of `get_auth_fields`
+    """
+    return User(
+        pk=fields['id'],
+        username=fields['username'],
+        is_staff=fields['is_staff'],
+        is_superuser=fields['is_superuser'],
+        is_active=True,
+    )
+
+
+def invalidate_token(key):
+    """
+    Removes the token from the local and the shared cache. Other processes
+    only drop their local entry when its TTL expires.
+    """
+    token_cache.delete(key)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete(get_shared_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that caches the id and authorization fields of the
+    user of a token, first in a bounded per-process LRU and then in the
+    optional TOKEN_AUTH_SHARED_CACHE, so authenticated requests do not query
+    the token and user tables. Only active users are cached, and tokens of
+    deactivated users are invalidated.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        shared_cache = get_shared_cache()
+        if cached is None and shared_cache is not None:
+            cached = shared_cache.get(get_shared_cache_key(key))
+            if cached is not None:
+                token_cache.set(key, cached)
+
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            cached = get_auth_fields(user)
+            token_cache.set(key, cached)
+            if shared_cache is not None:
+                shared_cache.set(get_shared_cache_key(key), cached, settings.TOKEN_AUTH_CACHE_TTL)
+            return (user, token)
+
+        user = load_auth_user(cached)
+        return (user, Token(key=key, user=user))
+
+
+def issue_signed_token(user):
+    """
+    Returns a signed token carrying the user fields used for authorization
+    """
+    payload = get_auth_fields(user)
+    return signing.dumps(payload, salt=SIGNED_TOKEN_SALT, compress=True)
+
+
+class SignedTokenAuthentication(TokenAuthentication):
+    """
+    Authenticates the signed, expiring tokens issued in stateless mode
+    without any database access. The user is rebuilt from the token, so
+    deactivations and permission changes apply once the token expires.
+    """
+
+    def authenticate_credentials(self, key):
+        try:
+            payload = signing.loads(key, salt=SIGNED_TOKEN_SALT, max_age=settings.AUTH_STATELESS_TOKEN_MAX_AGE)
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+        return (load_auth_user(payload), key)
@@ -0,0 +1,310 @@
+"""
+Benchmark harness for the REST API and the matching engine.
+
+Seeds users, stocks and orders, then measures the latency percentiles and
+the number of queries per request of every router endpoint. Used by the
+`benchmark_api` management command. `benchmark_matching` measures the
+orders matched per second on one core, used by the command of the same name.
+"""
+import datetime
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.matching import BookOrder, MatchingEngine, OrderBook, from_cents
+from core.models import Order, Stock
+
+BENCHMARK_PASSWORD = 'benchpass123'
+
+BENCHMARK_STAFF = 'benchstaff'
+
+
+def seed(users, stocks, orders, batch_size=1000):
+    """
+    Creates the given number of users, stocks and orders in bulk, and a
+    staff user for the admin endpoints
+    """
+    password = make_password(BENCHMARK_PASSWORD)
+    User.objects.bulk_create(
+        [User(username=f'bench{x}', email=f'bench{x}@bench.com', password=password) for x in range(users)]
+        + [User(username=BENCHMARK_STAFF, email=f'{BENCHMARK_STAFF}@bench.com', password=password, is_staff=True)],
+        batch_size=batch_size
+    )
+    Stock.objects.bulk_create(
+        [Stock(name=f'BENCH{x}', price=f'{random.uniform(1, 1000):.2f}') for x in range(stocks)],
+        batch_size=batch_size
+    )
+
+    user_ids = list(User.objects.filter(username__startswith='bench').values_list('id', flat=True))
+    stock_ids = list(Stock.objects.filter(name__startswith='BENCH').values_list('id', flat=True))
+    for start in range(0, orders, batch_size):
+        Order.objects.bulk_create([
+            Order(
+                owner_id=random.choice(user_ids),
+                stock_id=random.choice(stock_ids),
+                type=random.choice([Order.BUY, Order.SELL]),
+                quantity=random.randint(1, 1000),
+            )
+            for x in range(start, min(start + batch_size, orders))
+        ])
+    return user_ids, stock_ids
+
+
+class Endpoint:
+    """
+    A benchmarked request. `setup` runs before each timed request and is not measured.
+    Staff endpoints authenticate as the staff user, and a `content_type` sends
+    the data as is instead of as JSON.
+    """
+
+    def __init__(
+        self, name, method, path, data=None, authenticated=False, staff=False, content_type=None, setup=None
+    ):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.authenticated = authenticated or staff
+        self.staff = staff
+        self.content_type = content_type
+        self.setup = setup
+
+    def get_path(self, context):
+        return self.path(context) if callable(self.path) else self.path
+
+    def request(self, client, context, iteration):
+        path = self.get_path(context)
+        data = self.data(context, iteration) if callable(self.data) else self.data
+        if self.content_type:
+            response = getattr(client, self.method)(path, data=data, content_type=self.content_type)
+        else:
+            response = getattr(client, self.method)(path, data=data, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+
+def get_endpoints():
+    return [
+        Endpoint(
+            'users-create', 'post', '/users/',
+            data=lambda context, iteration: {
+                'username': f'signup{iteration}',
+                'email': f'signup{iteration}@bench.com',
+                'password': BENCHMARK_PASSWORD,
+            }
+        ),
+        Endpoint(
+            'login', 'post', '/login/',
+            data=lambda context, iteration: {'username': context['user'].username, 'password': BENCHMARK_PASSWORD}
+        ),
+        Endpoint(
+            'logout', 'get', '/logout/',
+            setup=lambda client, context: client.login(username=context['user'].username, password=BENCHMARK_PASSWORD)
+        ),
+        Endpoint('stocks-list', 'get', '/stocks/'),
+        Endpoint('stocks-search', 'get', '/stocks/?search=BENCH1'),
+        Endpoint('stocks-retrieve', 'get', lambda context: f'/stocks/{context["stock_id"]}/'),
+        Endpoint('stocks-export', 'get', '/stocks/export/'),
+        Endpoint(
+            'stocks-history', 'get', lambda context: f'/stocks/{context["stock_id"]}/history/',
+            data=lambda context, iteration: {
+                'start': (timezone.now() - datetime.timedelta(days=30)).isoformat(),
+                'resolution': 'day',
+            }
+        ),
+        Endpoint(
+            'stocks-create', 'post', '/stocks/', staff=True,
+            data=lambda context, iteration: {'name': f'NEW{iteration}', 'price': '10.00'}
+        ),
+        Endpoint(
+            'stocks-prices', 'post', '/stocks/prices/', staff=True, content_type='text/csv',
+            data=lambda context, iteration: f'stock,price\n{context["stock_id"]},{iteration % 100 + 1}.00\n'
+        ),
+        Endpoint('orders-list', 'get', '/orders/', authenticated=True),
+        Endpoint(
+            'orders-create', 'post', '/orders/', authenticated=True,
+            data=lambda context, iteration: {
+                'owner': context['user'].id,
+                'stock': context['stock_id'],
+                'type': Order.BUY,
+                'quantity': 1,
+            }
+        ),
+        Endpoint(
+            'orders-bulk', 'post', '/orders/bulk/', authenticated=True,
+            data=lambda context, iteration: [
+                {'owner': context['user'].id, 'stock': context['stock_id'], 'type': Order.BUY, 'quantity': 1}
+                for x in range(100)
+            ]
+        ),
+        Endpoint('orders-retrieve', 'get', lambda context: f'/orders/{context["order_id"]}/', authenticated=True),
+        Endpoint('orders-export', 'get', '/orders/export/', authenticated=True),
+        Endpoint('portfolio', 'get', '/portfolio/', authenticated=True),
+        Endpoint(
+            'total-invested', 'post', '/total-invested/',
+            data=lambda context, iteration: {'owner': context['user'].id, 'stock': context['stock_id']}
+        ),
+    ]
+
+
+def percentile(values, percent):
+    """
+    Returns the percentile of the values using linear interpolation
+    """
+    values = sorted(values)
+    index = (len(values) - 1) * percent / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def summarize(latencies, queries, status_codes):
+    latencies_ms = [latency * 1000 for latency in latencies]
+    return {
+        'requests': len(latencies_ms),
+        'mean_ms': round(statistics.mean(latencies_ms), 3),
+        'p50_ms': round(percentile(latencies_ms, 50), 3),
+        'p90_ms': round(percentile(latencies_ms, 90), 3),
+        'p99_ms': round(percentile(latencies_ms, 99), 3),
+        'max_ms': round(max(latencies_ms), 3),
+        'queries_per_request': round(statistics.mean(queries), 2),
+        'status_codes': {str(code): status_codes.count(code) for code in sorted(set(status_codes))},
+    }
+
+
+def authenticate(client, user):
+    """
+    Logs in through the API and sends the issued token with every request
+    """
+    response = client.post('/login/', data={'username': user.username, 'password': BENCHMARK_PASSWORD}, format='json')
+    client.cookies.clear()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {response.data["token"]}')
+
+
+def run(requests, endpoints=None):
+    """
+    Sends `requests` requests to every endpoint and returns their measurements.
+    Login and signup throttling is disabled so that repeated requests measure
+    the endpoints themselves.
+    """
+    context = get_context()
+    rates = settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})
+    unthrottled = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {scope: None for scope in rates}}
+    with override_settings(REST_FRAMEWORK=unthrottled):
+        return measure(requests, endpoints or get_endpoints(), context)
+
+
+def get_context():
+    """
+    Returns the seeded user, staff user, stock and order the endpoints request
+    """
+    user = User.objects.filter(username__startswith='bench', is_staff=False).order_by('id').first()
+    order = Order.objects.filter(owner=user).order_by('id').first()
+    return {
+        'user': user,
+        'staff': User.objects.filter(username=BENCHMARK_STAFF).first(),
+        'stock_id': Stock.objects.order_by('id').values_list('id', flat=True).first(),
+        'order_id': order.id if order else None,
+    }
+
+
+def measure(requests, endpoints, context):
+    results = {}
+    for endpoint in endpoints:
+        client = APIClient()
+        if endpoint.authenticated:
+            authenticate(client, context['staff'] if endpoint.staff else context['user'])
+
+        latencies, queries, status_codes = [], [], []
+        for iteration in range(requests):
+            if endpoint.setup:
+                endpoint.setup(client, context)
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = endpoint.request(client, context, iteration)
+                latencies.append(time.perf_counter() - start)
+            queries.append(len(captured))
+            status_codes.append(response.status_code)
+
+        results[endpoint.name] = summarize(latencies, queries, status_codes)
+    return results
+
+
+def generate_limit_orders(count, stock_ids, owner_ids, mid_price=10000, spread=200):
+    """
+    Returns `count` random limit orders as `(stock_id, BookOrder)` pairs with
+    prices in cents around `mid_price`, so that about half of them cross.
+    """
+    return [
+        (
+            random.choice(stock_ids),
+            BookOrder(
+                x + 1,
+                random.choice(owner_ids),
+                random.choice([Order.BUY, Order.SELL]),
+                mid_price + random.randint(-spread, spread),
+                random.randint(1, 100),
+            ),
+        )
+        for x in range(count)
+    ]
+
+
+def summarize_matching(orders, fills, seconds):
+    return {
+        'orders': orders,
+        'fills': fills,
+        'seconds': round(seconds, 3),
+        'orders_per_second': round(orders / seconds) if seconds else None,
+    }
+
+
+def benchmark_matching(orders, stocks):
+    """
+    Matches random limit orders against in-memory books in one thread
+    """
+    limit_orders = generate_limit_orders(orders, list(range(stocks)), list(range(100)))
+    books = {}
+    fills = 0
+    start = time.perf_counter()
+    for stock_id, order in limit_orders:
+        book = books.get(stock_id)
+        if book is None:
+            book = books[stock_id] = OrderBook(stock_id)
+        fills += len(book.match(order))
+    result = summarize_matching(orders, fills, time.perf_counter() - start)
+    result['resting'] = sum(len(book) for book in books.values())
+    return result
+
+
+def benchmark_matching_persisted(orders):
+    """
+    Saves and matches random limit orders one transaction at a time, through
+    the matching engine and the database
+    """
+    user_ids = list(User.objects.filter(username__startswith='bench').values_list('id', flat=True))
+    stock_ids = list(Stock.objects.filter(name__startswith='BENCH').values_list('id', flat=True))
+    limit_orders = generate_limit_orders(orders, stock_ids, user_ids)
+    engine = MatchingEngine()
+    fills = 0
+    start = time.perf_counter()
+    for stock_id, book_order in limit_orders:
+        with transaction.atomic():
+            order = Order.objects.create(
+                owner_id=book_order.owner_id,
+                stock_id=stock_id,
+                type=book_order.type,
+                quantity=book_order.remaining,
+                limit_price=from_cents(book_order.price),
+            )
+            fills += len(engine.submit(order))
+    return summarize_matching(orders, fills, time.perf_counter() - start)
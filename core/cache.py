@@ -0,0 +1,82 @@
+import functools
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils import encoders
+
+from core.db.routers import primary_reads
+
+STOCK_VERSION_KEY = 'stocks:version'
+
+
+def get_stock_version():
+    """
+    Returns the current version of the stock catalog. A missing version is
+    seeded from the clock so that it never goes back to an earlier value.
+    """
+    version = cache.get(STOCK_VERSION_KEY)
+    if version is None:
+        cache.add(STOCK_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(STOCK_VERSION_KEY)
+    return version
+
+
+def bump_stock_version():
+    """
+    Invalidates every cached stock response
+    """
+    try:
+        cache.incr(STOCK_VERSION_KEY)
+    except ValueError:
+        cache.add(STOCK_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_etag(path, data):
+    """
+    Returns an ETag hashing the path and the data of a response, so that it
+    changes with the content whether or not this process saw the change
+    """
+    content = json.dumps(data, cls=encoders.JSONEncoder, sort_keys=True)
+    return '"' + hashlib.md5(f'{path}\n{content}'.encode()).hexdigest() + '"'
+
+
+def stock_cache(view_method):
+    """
+    Caches the data of a successful stock response under the catalog version
+    and answers `If-None-Match` requests matching its content with a 304.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        full_path = request.get_full_path()
+        key = f'stocks:{get_stock_version()}:{hashlib.md5(full_path.encode()).hexdigest()}'
+        cached = cache.get(key)
+        if cached is None:
+            # Read from the primary, a replica lagging behind a price update
+            # would be cached under the version bumped by the update
+            with primary_reads():
+                response = view_method(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            etag = get_etag(full_path, response.data)
+            cache.set(key, (etag, response.data), settings.STOCK_CACHE_TIMEOUT)
+        else:
+            etag, data = cached
+            response = None
+
+        # Weak comparison, compressed responses carry the ETag as weak
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in {tag[2:] if tag.startswith('W/') else tag for tag in etags}:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        if response is None:
+            response = Response(data, status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        return response
+
+    return wrapper
@@ -0,0 +1,59 @@
+"""
+PostgreSQL backend drawing its connections from an in-process pool.
+
+Closing a connection returns it to the pool instead of disconnecting, so
+CONN_MAX_AGE should be 0. The pool is configured with the POOL dictionary
+of the database settings.
+"""
+import functools
+
+from django.db.backends.postgresql import base
+from psycopg2 import InterfaceError, extensions
+
+from core.db.pool import ConnectionPool, get_pool
+
+
+def check_connection(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    if not connection.autocommit:
+        connection.rollback()
+    return True
+
+
+def reset_connection(connection):
+    if connection.closed:
+        raise InterfaceError('connection already closed')
+    if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+
+
+def close_connection(connection):
+    connection.close()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_pool(self, conn_params):
+        options = self.settings_dict.get('POOL', {})
+        return get_pool(self.alias, lambda: ConnectionPool(
+            connect=functools.partial(super(DatabaseWrapper, self).get_new_connection, conn_params),
+            check=check_connection,
+            reset=reset_connection,
+            close=close_connection,
+            max_size=options.get('MAX_SIZE', 10),
+            timeout=options.get('TIMEOUT', 30),
+            check_interval=options.get('CHECK_INTERVAL', 30),
+            max_lifetime=options.get('MAX_LIFETIME'),
+        ))
+
+    def get_new_connection(self, conn_params):
+        return self.get_pool(conn_params).acquire()
+
+    def _close(self):
+        if self.connection is not None:
+            pool = self.get_pool(self.get_connection_params())
+            if self.errors_occurred and not self.is_usable():
+                pool.discard(self.connection)
+            else:
+                pool.release(self.connection)
@@ -0,0 +1,173 @@
+"""
+In-process database connection pool.
+
+The pool is independent of the database driver: it is given callables to
+open, health check, reset and close connections. It is used by the
+`core.db.backends.postgresql` backend.
+"""
+import threading
+import time
+
+from collections import deque
+
+from core.instrumentation import registry
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of connections. `acquire` waits up to `timeout` seconds for
+    a free connection, and idle connections are health checked before reuse
+    once they have been idle for `check_interval` seconds.
+    """
+
+    def __init__(self, connect, check, reset, close, max_size, timeout=30, check_interval=30, max_lifetime=None):
+        self.connect = connect
+        self.check = check
+        self.reset = reset
+        self.close = close
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.max_lifetime = max_lifetime
+
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.created = {}
+        self.size = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_seconds = 0
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            connection = None
+            with self.condition:
+                while not self.idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f'No connection available within {self.timeout} seconds')
+                    self.waiting += 1
+                    try:
+                        self.condition.wait(remaining)
+                    finally:
+                        self.waiting -= 1
+                if self.idle:
+                    connection, last_used = self.idle.pop()
+                else:
+                    self.size += 1
+
+            if connection is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    self._forget(None)
+                    raise
+                self.created[connection] = time.monotonic()
+            elif not self._is_healthy(connection, last_used):
+                self.discard(connection)
+                continue
+
+            with self.condition:
+                self.checkouts += 1
+                self.wait_seconds += time.monotonic() - start
+            return connection
+
+    def release(self, connection):
+        try:
+            self.reset(connection)
+        except Exception:
+            self.discard(connection)
+            return
+        if self.max_lifetime is not None and time.monotonic() - self.created[connection] > self.max_lifetime:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        try:
+            self.close(connection)
+        except Exception:
+            pass
+        with self.condition:
+            self.discarded += 1
+        self._forget(connection)
+
+    def _forget(self, connection):
+        with self.condition:
+            self.created.pop(connection, None)
+            self.size -= 1
+            self.condition.notify()
+
+    def _is_healthy(self, connection, last_used):
+        now = time.monotonic()
+        if self.max_lifetime is not None and now - self.created[connection] > self.max_lifetime:
+            return False
+        if now - last_used < self.check_interval:
+            return True
+        try:
+            return self.check(connection)
+        except Exception:
+            return False
+
+    def stats(self):
+        with self.condition:
+            return {
+                'size': self.size,
+                'max_size': self.max_size,
+                'idle': len(self.idle),
+                'in_use': self.size - len(self.idle),
+                'waiting': self.waiting,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'discarded': self.discarded,
+                'wait_seconds': self.wait_seconds,
+            }
+
+
+pools = {}
+
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, factory):
+    """
+    Returns the pool of the database alias, creating it with `factory`
+    """
+    with pools_lock:
+        if alias not in pools:
+            pools[alias] = factory()
+        return pools[alias]
+
+
+POOL_METRICS = [
+    ('core_db_pool_size', 'gauge', 'Open connections', 'size'),
+    ('core_db_pool_max_size', 'gauge', 'Maximum open connections', 'max_size'),
+    ('core_db_pool_in_use', 'gauge', 'Connections checked out', 'in_use'),
+    ('core_db_pool_idle', 'gauge', 'Connections waiting in the pool', 'idle'),
+    ('core_db_pool_waiting', 'gauge', 'Threads waiting for a connection', 'waiting'),
+    ('core_db_pool_checkouts_total', 'counter', 'Connections handed out', 'checkouts'),
+    ('core_db_pool_timeouts_total', 'counter', 'Checkouts that timed out', 'timeouts'),
+    ('core_db_pool_discarded_total', 'counter', 'Connections closed as unhealthy or expired', 'discarded'),
+    ('core_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection', 'wait_seconds'),
+]
+
+
+def collect_pool_metrics():
+    with pools_lock:
+        stats = {alias: pool.stats() for alias, pool in pools.items()}
+    for name, kind, help_text, key in POOL_METRICS:
+        yield name, kind, help_text, {(('alias', alias),): values[key] for alias, values in stats.items()}
+
+
+registry.add_collector(collect_pool_metrics)
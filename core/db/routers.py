@@ -0,0 +1,66 @@
+"""
+Database router sending safe reads to read replicas.
+
+Reads are only routed to the aliases of the DATABASE_REPLICAS setting while
+`replica_reads` is active, which `core.middleware.ReplicaRoutingMiddleware`
+enables for safe requests of clients that have not written recently, and
+`primary_reads` disables again. Every other read, and every write, goes to
+the primary.
+"""
+import contextlib
+import random
+
+from contextvars import ContextVar
+
+from django.conf import settings
+
+replica_reads_allowed = ContextVar('replica_reads_allowed', default=False)
+
+
+@contextlib.contextmanager
+def replica_reads():
+    """
+    Allows the reads of the block to be served by a replica
+    """
+    token = replica_reads_allowed.set(True)
+    try:
+        yield
+    finally:
+        replica_reads_allowed.reset(token)
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """
+    Sends the reads of the block to the primary, for reads that fill a cache
+    which must not keep the stale rows of a lagging replica
+    """
+    token = replica_reads_allowed.set(False)
+    try:
+        yield
+    finally:
+        replica_reads_allowed.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Routes the reads of DATABASE_REPLICA_APPS models to a random replica
+    when allowed, and everything else to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS or not replica_reads_allowed.get():
+            return 'default'
+        if model._meta.app_label not in settings.DATABASE_REPLICA_APPS:
+            return 'default'
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
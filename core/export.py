@@ -0,0 +1,59 @@
+import csv
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """
+    File-like object for csv.writer that returns the written row
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_rows(queryset, serializer_class, export_format):
+    """
+    Yields the rows of the queryset as NDJSON or CSV, reading them from the
+    database with a server-side cursor and emitting them in chunks.
+    """
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    rows = serializer_class.values(queryset.order_by('id')).iterator(chunk_size=chunk_size)
+
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(serializer_class.fields)
+
+        def format_row(data):
+            return writer.writerow(data.values())
+    else:
+        def format_row(data):
+            return json.dumps(data) + '\n'
+
+    buffer = []
+    for row in rows:
+        buffer.append(format_row(serializer_class.to_representation(row)))
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def export_response(queryset, serializer_class, export_format, filename):
+    """
+    Returns a streaming response exporting the queryset in the given format
+    """
+    response = StreamingHttpResponse(
+        iter_rows(queryset, serializer_class, export_format),
+        content_type=EXPORT_CONTENT_TYPES[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -0,0 +1,13 @@
+import django_filters
+
+from core.models import Order
+
+
+class OrderFilter(django_filters.FilterSet):
+    """
+    Admin filters for the order list
+    """
+
+    class Meta:
+        model = Order
+        fields = ['owner', 'stock', 'type']
@@ -0,0 +1,55 @@
+"""
+ASGI handler serving streaming responses from the sync thread.
+
+Django 3.2 iterates the content of a streaming response in the event loop,
+so a generator reading the database, like the exports, raises
+SynchronousOnlyOperation once the headers have been sent and the client
+gets a truncated body. `ASGIHandler` pulls every part in the thread that
+runs the sync views instead, the one holding their database connection.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler as BaseASGIHandler
+
+END = object()
+
+
+class ASGIHandler(BaseASGIHandler):
+    """
+    Django's ASGI handler, iterating streaming responses outside the event loop
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': self.get_headers(response),
+        })
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        while True:
+            part = await next_part(parts, END)
+            if part is END:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+    @staticmethod
+    def get_headers(response):
+        """
+        Returns the headers and cookies of the response as ASGI headers
+        """
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        return headers
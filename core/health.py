@@ -0,0 +1,39 @@
+import random
+import time
+
+from django.db import connections
+from django.db.utils import OperationalError
+
+
+def check_database(alias='default'):
+    """
+    Opens a real connection to the database and runs a trivial query.
+    Raises OperationalError when the database is unavailable.
+    """
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+
+
+def wait_for_database(alias='default', timeout=60, initial_delay=0.5, max_delay=5, on_retry=None):
+    """
+    Waits until the database answers, retrying with exponential backoff and
+    full jitter. Raises the last OperationalError once `timeout` seconds
+    have passed. Returns the number of failed attempts.
+    """
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        try:
+            check_database(alias)
+            return attempt
+        except OperationalError as exc:
+            connections[alias].close()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise
+            delay = min(remaining, random.uniform(0, min(max_delay, initial_delay * 2 ** attempt)))
+            if on_retry is not None:
+                on_retry(attempt, delay, exc)
+            time.sleep(delay)
+            attempt += 1
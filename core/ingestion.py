@@ -0,0 +1,145 @@
+"""
+Write-behind ingestion of orders with group commit.
+
+Validated orders are put in a bounded in-process queue and a background
+thread saves them with `bulk_create`, in batches closed by size or by the
+time since their first order, so many orders share one commit. Orders still
+queued are lost if the process is killed, callers that need durability wait
+for the future of their order. Enabled with ORDER_INGESTION_ENABLED.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from core.instrumentation import registry
+from core.models import Order, Position
+
+logger = logging.getLogger(__name__)
+
+
+class OrderIngester:
+    """
+    Bounded queue of orders flushed by a background thread. `submit` raises
+    `queue.Full` when the queue is full.
+    """
+
+    def __init__(self, queue_size, batch_size, max_delay):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def submit(self, order):
+        """
+        Queues an unsaved order and returns a future resolved with the order
+        once it is committed
+        """
+        future = Future()
+        self.queue.put_nowait((order, future))
+        self.start()
+        return future
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self.run, name='order-ingester', daemon=True)
+                self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the flusher once the queued orders are saved
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        try:
+            while not (self.stopping.is_set() and self.queue.empty()):
+                batch = self.next_batch(timeout=0.1)
+                if batch:
+                    self.flush(batch)
+        finally:
+            close_old_connections()
+
+    def flush_pending(self):
+        """
+        Saves the queued orders in the calling thread
+        """
+        batch = self.next_batch(timeout=0)
+        while batch:
+            self.flush(batch)
+            batch = self.next_batch(timeout=0)
+
+    def next_batch(self, timeout):
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self, batch):
+        """
+        Saves the batch in one transaction. If it fails the orders are saved
+        one at a time, so that a bad order only fails its own future.
+        """
+        close_old_connections()
+        orders = [order for order, future in batch]
+        try:
+            with transaction.atomic():
+                Position.apply_orders(orders)
+                Order.objects.bulk_create(orders)
+        except Exception:
+            logger.exception('Unable to save a batch of %d orders, saving them one at a time', len(orders))
+            for order, future in batch:
+                self.flush_one(order, future)
+        else:
+            for order, future in batch:
+                future.set_result(order)
+        registry.observe('core_ingestion_batch_size', 'ingestion', len(batch))
+
+    def flush_one(self, order, future):
+        order.pk = None
+        try:
+            with transaction.atomic():
+                order.save()
+        except Exception as exc:
+            logger.warning('Unable to save an order of user %s: %s', order.owner_id, exc)
+            future.set_exception(exc)
+        else:
+            future.set_result(order)
+
+
+def collect_ingestion_metrics():
+    yield 'core_ingestion_queue_depth', 'gauge', 'Orders waiting to be saved', {(): ingester.queue.qsize()}
+
+
+registry.register(
+    'core_ingestion_batch_size', 'histogram', 'Orders saved per ingestion commit', [1, 5, 10, 50, 100, 500, 1000]
+)
+registry.add_collector(collect_ingestion_metrics)
+
+ingester = OrderIngester(
+    settings.ORDER_INGESTION_QUEUE_SIZE,
+    settings.ORDER_INGESTION_BATCH_SIZE,
+    settings.ORDER_INGESTION_MAX_DELAY,
+)
+atexit.register(ingester.stop)
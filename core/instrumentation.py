@@ -0,0 +1,112 @@
+"""
+In-process metrics for the API, rendered in the Prometheus text format.
+
+Metrics are recorded by `core.middleware.InstrumentationMiddleware` and are
+per process, so every worker has to be scraped.
+"""
+import bisect
+import threading
+
+DURATION_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+QUERY_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500]
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket upper bounds
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of histograms and counters labelled by view
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def clear(self):
+        with self.lock:
+            for metric in self.metrics.values():
+                metric['values'] = {}
+
+    def register(self, name, kind, help_text, buckets=None):
+        with self.lock:
+            self.metrics.setdefault(name, {'kind': kind, 'help': help_text, 'buckets': buckets, 'values': {}})
+
+    def observe(self, name, view, value):
+        with self.lock:
+            metric = self.metrics[name]
+            histogram = metric['values'].setdefault(view, Histogram(metric['buckets']))
+            histogram.observe(value)
+
+    def increment(self, name, view, value=1):
+        with self.lock:
+            values = self.metrics[name]['values']
+            values[view] = values.get(view, 0) + value
+
+    def add_collector(self, collector):
+        """
+        Adds a callable yielding `(name, kind, help, {labels: value})` samples
+        that are read at render time, for gauges owned by other modules.
+        """
+        with self.lock:
+            if collector not in self.collectors:
+                self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, metric in sorted(self.metrics.items()):
+                lines.append(f'# HELP {name} {metric["help"]}')
+                lines.append(f'# TYPE {name} {metric["kind"]}')
+                for view, value in sorted(metric['values'].items()):
+                    if metric['kind'] == 'histogram':
+                        lines.extend(render_histogram(name, view, value))
+                    else:
+                        lines.append(f'{name}{{view="{view}"}} {value}')
+            collectors = list(self.collectors)
+
+        for collector in collectors:
+            for name, kind, help_text, samples in collector():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in sorted(samples.items()):
+                    label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+                    lines.append(f'{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def render_histogram(name, view, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}'
+    yield f'{name}_bucket{{view="{view}",le="+Inf"}} {histogram.count}'
+    yield f'{name}_sum{{view="{view}"}} {histogram.sum}'
+    yield f'{name}_count{{view="{view}"}} {histogram.count}'
+
+
+registry = MetricsRegistry()
+
+registry.register('core_request_duration_seconds', 'histogram', 'Total time spent handling the request', DURATION_BUCKETS)
+registry.register('core_request_db_seconds', 'histogram', 'Time spent executing SQL queries', DURATION_BUCKETS)
+registry.register('core_request_render_seconds', 'histogram', 'Time spent serializing the response', DURATION_BUCKETS)
+registry.register('core_request_queries', 'histogram', 'Number of SQL queries per request', QUERY_BUCKETS)
+registry.register('core_request_n_plus_one_total', 'counter', 'Requests repeating the same query, a likely N+1')
@@ -0,0 +1,62 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core.archive import FileStore, TableStore, archive_orders
+
+
+class Command(BaseCommand):
+    """Django command to move old closed orders out of the order table"""
+
+    help = (
+        'Moves closed orders created before a cutoff to the archived order table, or to '
+        'compressed columnar files with --to files, in batched transactions, and reports '
+        'the throughput as JSON. Open limit orders are kept. Orders older than their '
+        'created column, which was set when it was added, are selected with --before-id.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Cutoff date or datetime, defaults to ORDER_ARCHIVE_AFTER_DAYS ago')
+        parser.add_argument('--older-than-days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS)
+        parser.add_argument(
+            '--before-id', type=int,
+            help='Only archive orders with a lower id, without a date cutoff unless --before is given'
+        )
+        parser.add_argument('--to', choices=['table', 'files'], default='table')
+        parser.add_argument('--path', default=settings.ORDER_ARCHIVE_PATH, help='Directory of the archive files')
+        parser.add_argument('--batch-size', type=int, help='Orders archived per transaction')
+        parser.add_argument('--max-batches', type=int)
+
+    def handle(self, *args, **options):
+        cutoff = self.get_cutoff(options)
+        store = FileStore(options['path']) if options['to'] == 'files' else TableStore()
+        try:
+            report = archive_orders(
+                cutoff, store, options['batch_size'], options['max_batches'], options['before_id']
+            )
+        except OSError as exc:
+            raise CommandError(exc)
+
+        report['before'] = cutoff.isoformat() if cutoff is not None else None
+        report['before_id'] = options['before_id']
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def get_cutoff(self, options):
+        if options['before'] is None:
+            if options['before_id'] is not None:
+                return None
+            return timezone.now() - datetime.timedelta(days=options['older_than_days'])
+
+        cutoff = parse_datetime(options['before'])
+        if cutoff is None:
+            day = parse_date(options['before'])
+            if day is None:
+                raise CommandError(f'Invalid --before: {options["before"]}')
+            cutoff = datetime.datetime.combine(day, datetime.time())
+        if timezone.is_naive(cutoff):
+            cutoff = timezone.make_aware(cutoff)
+        return cutoff
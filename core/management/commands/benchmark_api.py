@@ -0,0 +1,52 @@
+import json
+import sys
+
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchmark
+
+
+class Command(BaseCommand):
+    """Django command to benchmark the REST API against a throwaway test database"""
+
+    help = (
+        'Seeds a test database and reports latency percentiles and queries per request '
+        'for every API endpoint as JSON. Set DB_ENGINE=django.db.backends.sqlite3 to run locally.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--stocks', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--requests', type=int, default=50, help='Requests per endpoint')
+        parser.add_argument('--endpoint', action='append', help='Only benchmark the named endpoints')
+        parser.add_argument('--output', default='-', help='File to write the JSON results to')
+
+    def handle(self, *args, **options):
+        endpoints = benchmark.get_endpoints()
+        if options['endpoint']:
+            endpoints = [endpoint for endpoint in endpoints if endpoint.name in options['endpoint']]
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            benchmark.seed(options['users'], options['stocks'], options['orders'])
+            results = {
+                'database': connection.vendor,
+                'config': {key: options[key] for key in ['users', 'stocks', 'orders', 'requests']},
+                'endpoints': benchmark.run(options['requests'], endpoints),
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+        if options['output'] == '-':
+            sys.stdout.write(output + '\n')
+        else:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Wrote results to {options["output"]}'))
@@ -0,0 +1,40 @@
+import json
+import sys
+
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchmark
+
+
+class Command(BaseCommand):
+    """Django command to benchmark the matching engine"""
+
+    help = (
+        'Reports the limit orders matched per second on one core as JSON, against in-memory '
+        'order books and, with --persist, through the database on a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=100000)
+        parser.add_argument('--stocks', type=int, default=10)
+        parser.add_argument('--persist', action='store_true', help='Also benchmark saving orders and executions')
+        parser.add_argument('--persisted-orders', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        results = {'in_memory': benchmark.benchmark_matching(options['orders'], options['stocks'])}
+
+        if options['persist']:
+            setup_test_environment()
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                benchmark.seed(100, options['stocks'], 0)
+                results['database'] = connection.vendor
+                results['persisted'] = benchmark.benchmark_matching_persisted(options['persisted_orders'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        sys.stdout.write(json.dumps(results, indent=2) + '\n')
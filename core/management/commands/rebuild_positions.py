@@ -0,0 +1,76 @@
+from decimal import Decimal
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from core.models import Order, OrderSummary, Position
+
+
+class Command(BaseCommand):
+    """Django command to rebuild or verify positions from the order history"""
+
+    help = (
+        'Rebuilds the position table from the order history, or reports drift with --verify. '
+        'Quantities and costs are summed from the orders and the summaries of archived orders.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Report drift without writing')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expected = self.aggregate_orders()
+        if options['verify']:
+            self.verify(expected)
+        else:
+            self.rebuild(expected, options['batch_size'])
+
+    def aggregate_orders(self):
+        rows = (
+            Order.objects
+            .values('owner_id', 'stock_id')
+            .annotate(quantity=Sum(Order.signed_quantity()), cost=Sum('booked_cost'))
+            .values_list('owner_id', 'stock_id', 'quantity', 'cost')
+            .order_by()
+        )
+        # Orders moved out of the order table by `archive_orders`
+        archived = OrderSummary.objects.values_list('owner_id', 'stock_id', 'quantity', 'cost')
+
+        expected = {}
+        for owner_id, stock_id, quantity, cost in [*rows.iterator(), *archived.iterator()]:
+            current_quantity, current_cost = expected.get((owner_id, stock_id), (0, Decimal(0)))
+            expected[(owner_id, stock_id)] = (current_quantity + quantity, current_cost + cost)
+        return expected
+
+    def rebuild(self, expected, batch_size):
+        positions = [
+            Position(owner_id=owner_id, stock_id=stock_id, quantity=quantity, cost=cost)
+            for (owner_id, stock_id), (quantity, cost) in expected.items()
+        ]
+        with transaction.atomic():
+            Position.objects.all().delete()
+            Position.objects.bulk_create(positions, batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(positions)} positions'))
+
+    def verify(self, expected):
+        drift = 0
+        actual = {
+            (owner_id, stock_id): (quantity, cost)
+            for owner_id, stock_id, quantity, cost in (
+                Position.objects.values_list('owner_id', 'stock_id', 'quantity', 'cost').iterator()
+            )
+        }
+        for key in expected.keys() | actual.keys():
+            expected_quantity, expected_cost = expected.get(key, (0, Decimal(0)))
+            actual_quantity, actual_cost = actual.get(key, (0, Decimal(0)))
+            if (expected_quantity, expected_cost) != (actual_quantity, actual_cost):
+                drift += 1
+                self.stdout.write(
+                    f'owner={key[0]} stock={key[1]}: expected {expected_quantity} for {expected_cost}, '
+                    f'found {actual_quantity} for {actual_cost}'
+                )
+
+        if drift:
+            raise CommandError(f'{drift} positions drifted from the order history')
+        self.stdout.write(self.style.SUCCESS(f'Verified {len(expected)} positions'))
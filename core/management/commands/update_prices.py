@@ -0,0 +1,37 @@
+import json
+import sys
+
+from django.core.management import BaseCommand, CommandError
+
+from core.export import EXPORT_CONTENT_TYPES
+from core.prices import update_prices
+
+
+class Command(BaseCommand):
+    """Django command to bulk update stock prices from a market data file"""
+
+    help = (
+        'Updates stock prices from a CSV or NDJSON file of `stock` id and `price` records, '
+        'in batched transactions, and reports the throughput as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read the prices from, or - for stdin')
+        parser.add_argument('--format', choices=list(EXPORT_CONTENT_TYPES), help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, help='Stocks saved per transaction')
+
+    def handle(self, *args, **options):
+        price_format = options['format']
+        if price_format is None:
+            price_format = 'csv' if options['path'].endswith('.csv') else 'ndjson'
+
+        if options['path'] == '-':
+            report = update_prices(sys.stdin, price_format, options['batch_size'])
+        else:
+            try:
+                with open(options['path'], newline='') as price_file:
+                    report = update_prices(price_file, price_format, options['batch_size'])
+            except OSError as exc:
+                raise CommandError(exc)
+
+        self.stdout.write(json.dumps(report, indent=2))
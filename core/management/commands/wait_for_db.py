@@ -1,19 +1,33 @@
-import time
-from django.db import connections
+from django.core.management import BaseCommand, CommandError
 from django.db.utils import OperationalError
-from django.core.management import BaseCommand
- 
+
+from core.health import wait_for_database
+
+
 class Command(BaseCommand):
     """Django command to pause execution until db is available"""
- 
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait before giving up')
+        parser.add_argument('--initial-delay', type=float, default=0.5)
+        parser.add_argument('--max-delay', type=float, default=5)
+
     def handle(self, *args, **options):
         self.stdout.write('Waiting for database...')
-        db_conn = None
-        while not db_conn:
-            try:
-                db_conn = connections['default']
-            except OperationalError:
-                self.stdout.write('Database unavailable, waititng 1 second...')
-                time.sleep(1)
- 
+
+        def on_retry(attempt, delay, exc):
+            self.stdout.write(f'Database unavailable ({exc}), retrying in {delay:.2f} seconds...')
+
+        try:
+            wait_for_database(
+                options['database'],
+                timeout=options['timeout'],
+                initial_delay=options['initial_delay'],
+                max_delay=options['max_delay'],
+                on_retry=on_retry,
+            )
+        except OperationalError as exc:
+            raise CommandError(f'Database unavailable after {options["timeout"]} seconds: {exc}')
+
         self.stdout.write(self.style.SUCCESS('Database available!'))
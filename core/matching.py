@@ -0,0 +1,213 @@
+"""
+Price-time priority matching of limit orders.
+
+Every stock has an in-memory `OrderBook` of its open limit orders kept in two
+heaps, best price first and oldest order first within a price. The
+`MatchingEngine` matches a new limit order against the book of its stock and
+persists the executions in the transaction that saved the order.
+
+Books are replayed from the open orders in the database when first used. The
+row of `OrderBookVersion` serializes matching on a stock across processes and
+holds a random version written by every match, so a book changed by another
+process or by a rolled back transaction is replayed too. Orders edited or
+deleted outside the engine write a new version with `invalidate`.
+"""
+import heapq
+import random
+import threading
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import Case, DecimalField, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+
+from core.models import Execution, Order, OrderBookVersion, Position
+
+Fill = namedtuple('Fill', ['buy_order_id', 'sell_order_id', 'buyer_id', 'seller_id', 'price', 'quantity'])
+
+
+def to_cents(price):
+    return int(Decimal(price).scaleb(2))
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+class BookOrder:
+    """
+    Open limit order of a book, with its price in cents
+    """
+    __slots__ = ('id', 'owner_id', 'type', 'price', 'remaining')
+
+    def __init__(self, id, owner_id, type, price, remaining):
+        self.id = id
+        self.owner_id = owner_id
+        self.type = type
+        self.price = price
+        self.remaining = remaining
+
+    @classmethod
+    def from_order(cls, order):
+        return cls(order.id, order.owner_id, order.type, to_cents(order.limit_price), order.quantity - order.filled_quantity)
+
+
+class OrderBook:
+    """
+    Open limit orders of a stock. Bids are keyed by negated price so that
+    both heaps pop the best price, ties broken by the order id.
+    """
+
+    def __init__(self, stock_id, version=None):
+        self.stock_id = stock_id
+        self.version = version
+        self.bids = []
+        self.asks = []
+
+    def __len__(self):
+        return len(self.bids) + len(self.asks)
+
+    @property
+    def best_bid(self):
+        return from_cents(self.bids[0][2].price) if self.bids else None
+
+    @property
+    def best_ask(self):
+        return from_cents(self.asks[0][2].price) if self.asks else None
+
+    def add(self, order):
+        if order.type == Order.BUY:
+            heapq.heappush(self.bids, (-order.price, order.id, order))
+        else:
+            heapq.heappush(self.asks, (order.price, order.id, order))
+
+    def match(self, order):
+        """
+        Fills the order against the opposite side at the resting prices and
+        rests what remains of it. Returns the fills.
+        """
+        fills = []
+        is_buy = order.type == Order.BUY
+        opposite = self.asks if is_buy else self.bids
+        while order.remaining and opposite:
+            resting = opposite[0][2]
+            if (resting.price > order.price) if is_buy else (resting.price < order.price):
+                break
+            quantity = min(order.remaining, resting.remaining)
+            order.remaining -= quantity
+            resting.remaining -= quantity
+            if is_buy:
+                fills.append(Fill(order.id, resting.id, order.owner_id, resting.owner_id, resting.price, quantity))
+            else:
+                fills.append(Fill(resting.id, order.id, resting.owner_id, order.owner_id, resting.price, quantity))
+            if not resting.remaining:
+                heapq.heappop(opposite)
+
+        if order.remaining:
+            self.add(order)
+        return fills
+
+
+class MatchingEngine:
+    """
+    Order books of the process, matched under the database lock of the stock
+    """
+
+    def __init__(self):
+        self.books = {}
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.books.clear()
+
+    def invalidate(self, stock_id):
+        """
+        Writes a new version of the book of the stock, so every process
+        replays it from the database on its next match
+        """
+        with self.lock:
+            self.books.pop(stock_id, None)
+        OrderBookVersion.objects.filter(stock_id=stock_id).update(version=random.getrandbits(62))
+
+    def load_book(self, stock_id, version, exclude=None):
+        """
+        Replays the open limit orders of the stock from the database
+        """
+        book = OrderBook(stock_id, version)
+        open_orders = (
+            Order.objects
+            .filter(stock_id=stock_id, limit_price__isnull=False, filled_quantity__lt=F('quantity'))
+            .exclude(id=exclude)
+            .order_by('id')
+            .values_list('id', 'owner_id', 'type', 'limit_price', 'quantity', 'filled_quantity')
+        )
+        for order_id, owner_id, order_type, limit_price, quantity, filled_quantity in open_orders.iterator():
+            book.add(BookOrder(order_id, owner_id, order_type, to_cents(limit_price), quantity - filled_quantity))
+        return book
+
+    def submit(self, order):
+        """
+        Matches a saved limit order against the book of its stock and persists
+        the executions, the filled quantities and the positions. Must be called
+        in the transaction that saved the order. Returns the executions.
+        """
+        state, created = OrderBookVersion.objects.select_for_update().get_or_create(stock_id=order.stock_id)
+        with self.lock:
+            book = self.books.get(order.stock_id)
+            if book is None or book.version != state.version:
+                book = self.load_book(order.stock_id, state.version, exclude=order.id)
+                self.books[order.stock_id] = book
+            fills = book.match(BookOrder.from_order(order))
+            book.version = random.getrandbits(62)
+
+        OrderBookVersion.objects.filter(stock_id=order.stock_id).update(version=book.version)
+        return self.persist(order, fills)
+
+    def persist(self, order, fills):
+        if not fills:
+            return []
+
+        timestamp = timezone.now()
+        executions = Execution.objects.bulk_create([
+            Execution(
+                stock_id=order.stock_id,
+                buy_order_id=fill.buy_order_id,
+                sell_order_id=fill.sell_order_id,
+                buyer_id=fill.buyer_id,
+                seller_id=fill.seller_id,
+                price=from_cents(fill.price),
+                quantity=fill.quantity,
+                timestamp=timestamp,
+            )
+            for fill in fills
+        ])
+
+        # Resting orders are on the opposite side, so their cost has the opposite sign
+        sign = 1 if order.type == Order.BUY else -1
+        resting = {}
+        for fill in fills:
+            resting_id = fill.sell_order_id if order.type == Order.BUY else fill.buy_order_id
+            quantity, cost = resting.get(resting_id, (0, Decimal(0)))
+            resting[resting_id] = (quantity + fill.quantity, cost - sign * fill.quantity * from_cents(fill.price))
+        Order.objects.filter(id__in=resting).update(
+            filled_quantity=F('filled_quantity') + Case(
+                *[When(id=order_id, then=Value(quantity)) for order_id, (quantity, cost) in resting.items()],
+                output_field=PositiveIntegerField(),
+            ),
+            booked_cost=F('booked_cost') + Case(
+                *[When(id=order_id, then=Value(cost)) for order_id, (quantity, cost) in resting.items()],
+                output_field=DecimalField(max_digits=20, decimal_places=2),
+            ),
+        )
+        order.filled_quantity += sum(fill.quantity for fill in fills)
+        order.booked_cost += sign * sum(fill.quantity * from_cents(fill.price) for fill in fills)
+        Order.objects.filter(id=order.id).update(filled_quantity=order.filled_quantity, booked_cost=order.booked_cost)
+        # The executions book the fills, not a later save of the order
+        order._booked = order.get_booked()
+
+        Position.apply_executions(executions)
+        return executions
+
+
+engine = MatchingEngine()
@@ -0,0 +1,305 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import threading
+import time
+
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence
+
+from core.db.routers import replica_reads
+from core.instrumentation import registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncCapableMiddleware(MiddlewareMixin):
+    """
+    Base of the middleware that run natively in both request paths. Under
+    ASGI a sync-only middleware runs the rest of the request on the single
+    thread of `thread_sensitive` calls, serializing every request.
+
+    Subclasses implement the sync path in `call(request)` and the async path
+    in the coroutine `__acall__(request)`. Django's MiddlewareMixin marks the
+    instance as a coroutine function when the next handler is one.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.call(request)
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper that counts and times the queries of a request
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = Counter()
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            # Queries of async views run in worker threads
+            with self.lock:
+                self.duration += duration
+                self.statements[sql] += 1
+
+    @property
+    def count(self):
+        return sum(self.statements.values())
+
+
+request_recorder = ContextVar('request_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper of every connection passing the queries to the recorder
+    of the current request, including the worker threads of `sync_to_async`,
+    which run in a copy of the request context
+    """
+    recorder = request_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def get_view_name(request):
+    """
+    Returns `ViewSet.action` for viewsets, the view name otherwise
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return 'unmatched'
+    view_func = resolver_match.func
+    actions = getattr(view_func, 'actions', None)
+    if actions is not None:
+        action = actions.get(request.method.lower(), request.method.lower())
+        return f'{view_func.cls.__name__}.{action}'
+    return getattr(view_func, '__name__', view_func.__class__.__name__)
+
+
+class InstrumentationMiddleware(AsyncCapableMiddleware):
+    """
+    Records per-view query count, DB time, render time and total time, and
+    flags requests that repeat the same query, a likely N+1 pattern.
+    Enabled with the INSTRUMENTATION_ENABLED setting.
+    """
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def call(self, request):
+        recorder = QueryRecorder()
+        token = request_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            for connection in connections.all():
+                install_query_recorder(connection)
+            response = self.get_response(request)
+        finally:
+            request_recorder.reset(token)
+        self.record(request, recorder, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = request_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_recorder.reset(token)
+        self.record(request, recorder, time.perf_counter() - start)
+        return response
+
+    def record(self, request, recorder, duration):
+        view = get_view_name(request)
+        registry.observe('core_request_duration_seconds', view, duration)
+        registry.observe('core_request_db_seconds', view, recorder.duration)
+        registry.observe('core_request_queries', view, recorder.count)
+        if hasattr(request, 'instrumented_render_time'):
+            registry.observe('core_request_render_seconds', view, request.instrumented_render_time)
+
+        if recorder.statements:
+            sql, repeats = recorder.statements.most_common(1)[0]
+            if repeats >= settings.INSTRUMENTATION_N_PLUS_ONE_THRESHOLD:
+                registry.increment('core_request_n_plus_one_total', view)
+                logger.warning('Possible N+1 in %s: query repeated %d times: %s', view, repeats, sql)
+
+    def process_template_response(self, request, response):
+        start = time.perf_counter()
+
+        def record_render_time(response):
+            request.instrumented_render_time = time.perf_counter() - start
+
+        response.add_post_render_callback(record_render_time)
+        return response
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_client_key(request):
+    """
+    Returns a cache key identifying the client by its credentials, or None
+    """
+    credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return f'replica:sticky:{hashlib.sha256(credentials.encode()).hexdigest()}'
+
+
+class ReplicaRoutingMiddleware(AsyncCapableMiddleware):
+    """
+    Allows the reads of safe requests to be served by read replicas. A client
+    that made a successful write reads from the primary for the next
+    DB_REPLICA_STICKY_SECONDS, so it sees its own writes despite replication lag.
+    Enabled when DATABASE_REPLICAS is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def call(self, request):
+        client_key = get_client_key(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            self.stick(client_key, response)
+            return response
+        if client_key is not None and cache.get(client_key):
+            return self.get_response(request)
+        with replica_reads():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        client_key = get_client_key(request)
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            await sync_to_async(self.stick, thread_sensitive=False)(client_key, response)
+            return response
+        if client_key is not None and await sync_to_async(cache.get, thread_sensitive=False)(client_key):
+            return await self.get_response(request)
+        with replica_reads():
+            return await self.get_response(request)
+
+    def stick(self, client_key, response):
+        if client_key is not None and response.status_code < 400:
+            cache.set(client_key, True, settings.DB_REPLICA_STICKY_SECONDS)
+
+
+def get_accepted_encodings(header):
+    """
+    Returns the content codings accepted by an Accept-Encoding header
+    """
+    accepted = set()
+    for part in header.split(','):
+        coding, *params = [value.strip() for value in part.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+class CompressionMiddleware(AsyncCapableMiddleware):
+    """
+    Compresses responses of at least COMPRESSION_MIN_SIZE bytes with brotli,
+    when it is installed, or gzip, as accepted by the client. Streaming
+    responses are compressed with gzip as they are sent, except event streams.
+    """
+
+    def call(self, request):
+        response = self.get_response(request)
+        encoding = self.get_encoding(request, response)
+        if encoding is None:
+            return response
+        return self.compress(response, encoding)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        encoding = self.get_encoding(request, response)
+        if encoding is None:
+            return response
+        if response.streaming:
+            return self.compress(response, encoding)
+        # Keeps the event loop free while a large body is compressed
+        return await sync_to_async(self.compress, thread_sensitive=False)(response, encoding)
+
+    def compress(self, response, encoding):
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response['Content-Length']
+        else:
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+            else:
+                compressed = gzip.compress(response.content, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        # The compressed body differs from the one a strong ETag was computed for
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    def get_encoding(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return None
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return None
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return None
+
+        accepted = get_accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and not response.streaming and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted or '*' in accepted:
+            return 'gzip'
+        return None
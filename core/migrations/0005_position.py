@@ -0,0 +1,56 @@
+# Generated by Django 3.2.6 on 2026-10-18 06:30
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, F, Sum, When
+import django.db.models.deletion
+
+
+def build_positions(apps, schema_editor):
+    """
+    Builds the positions of the existing orders, valued at the current prices
+    """
+    Order = apps.get_model('core', 'Order')
+    Position = apps.get_model('core', 'Position')
+    signed_quantity = Case(When(type=2, then=-F('quantity')), default=F('quantity'), output_field=models.BigIntegerField())
+    rows = (
+        Order.objects
+        .values('owner_id', 'stock_id', 'stock__price')
+        .annotate(net_quantity=Sum(signed_quantity))
+        .order_by()
+    )
+    Position.objects.bulk_create([
+        Position(
+            owner_id=row['owner_id'],
+            stock_id=row['stock_id'],
+            quantity=row['net_quantity'],
+            cost=row['net_quantity'] * row['stock__price'],
+        )
+        for row in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0004_order_owner_stock_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Position',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.stock')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='position',
+            constraint=models.UniqueConstraint(fields=('owner', 'stock'), name='core_position_owner_stock_uniq'),
+        ),
+        migrations.RunPython(build_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_position'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['owner', 'id'], name='core_order_owner_id_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.6 on 2026-10-18 06:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_stock_name_trgm_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceTick',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('timestamp', models.DateTimeField()),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.stock')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pricetick',
+            index=models.Index(fields=['stock', 'timestamp'], name='core_pricetick_stock_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.2.6 on 2026-10-18 06:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.expressions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0008_pricetick'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Execution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('quantity', models.PositiveIntegerField()),
+                ('timestamp', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OrderBookVersion',
+            fields=[
+                ('stock', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='core.stock')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='filled_quantity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='limit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('limit_price__isnull', False), ('filled_quantity__lt', django.db.models.expressions.F('quantity'))), fields=['stock', 'id'], name='core_order_open_limit_idx'),
+        ),
+        migrations.AddField(
+            model_name='execution',
+            name='buy_order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buy_executions', to='core.order'),
+        ),
+        migrations.AddField(
+            model_name='execution',
+            name='buyer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='execution',
+            name='sell_order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sell_executions', to='core.order'),
+        ),
+        migrations.AddField(
+            model_name='execution',
+            name='seller',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='execution',
+            name='stock',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.stock'),
+        ),
+        migrations.AddIndex(
+            model_name='execution',
+            index=models.Index(fields=['stock', 'timestamp'], name='core_execution_stock_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0009_matching'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('type', models.IntegerField(choices=[(1, 'BUY'), (2, 'SELL')])),
+                ('quantity', models.PositiveIntegerField()),
+                ('limit_price', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('filled_quantity', models.PositiveIntegerField()),
+                ('created', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchiveFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('min_id', models.BigIntegerField()),
+                ('max_id', models.BigIntegerField()),
+                ('count', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='execution',
+            name='buy_order',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='buy_executions', to='core.order'),
+        ),
+        migrations.AlterField(
+            model_name='execution',
+            name='sell_order',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='sell_executions', to='core.order'),
+        ),
+        migrations.CreateModel(
+            name='OrderSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.stock')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivefile',
+            index=models.Index(fields=['min_id', 'max_id'], name='core_archivefile_ids_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='stock',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.stock'),
+        ),
+        migrations.AddConstraint(
+            model_name='ordersummary',
+            constraint=models.UniqueConstraint(fields=('owner', 'stock'), name='core_ordersummary_owner_stock_uniq'),
+        ),
+    ]
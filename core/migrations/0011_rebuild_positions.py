@@ -0,0 +1,43 @@
+from django.db import migrations, models
+from django.db.models import Case, F, Sum, When
+
+
+def rebuild_positions(apps, schema_editor):
+    """
+    Rebuilds the positions, which drifted from the orders saved or deleted
+    outside the API before orders kept them in sync, valued at the current
+    prices like the `rebuild_positions` command
+    """
+    Order = apps.get_model('core', 'Order')
+    OrderSummary = apps.get_model('core', 'OrderSummary')
+    Position = apps.get_model('core', 'Position')
+    signed_quantity = Case(
+        When(limit_price__isnull=False, type=2, then=-F('filled_quantity')),
+        When(limit_price__isnull=False, then=F('filled_quantity')),
+        When(type=2, then=-F('quantity')),
+        default=F('quantity'),
+        output_field=models.BigIntegerField(),
+    )
+    quantities = {}
+    rows = Order.objects.values('owner_id', 'stock_id', 'stock__price').annotate(net_quantity=Sum(signed_quantity))
+    archived = OrderSummary.objects.values('owner_id', 'stock_id', 'stock__price', net_quantity=F('quantity'))
+    for row in [*rows.order_by().iterator(), *archived.iterator()]:
+        key = (row['owner_id'], row['stock_id'])
+        quantities[key] = (quantities.get(key, (0, None))[0] + row['net_quantity'], row['stock__price'])
+
+    Position.objects.all().delete()
+    Position.objects.bulk_create([
+        Position(owner_id=owner_id, stock_id=stock_id, quantity=quantity, cost=quantity * price)
+        for (owner_id, stock_id), (quantity, price) in quantities.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_order_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:48
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, F, OuterRef, Subquery, Sum, When
+
+
+def book_costs(apps, schema_editor):
+    """
+    Books the existing orders and archived orders at the current prices, which
+    the positions were rebuilt at, and sets the costs of the positions to the
+    sum of their bookings
+    """
+    Order = apps.get_model('core', 'Order')
+    OrderSummary = apps.get_model('core', 'OrderSummary')
+    Position = apps.get_model('core', 'Position')
+    Stock = apps.get_model('core', 'Stock')
+    cost_field = models.DecimalField(max_digits=20, decimal_places=2)
+    price = Subquery(Stock.objects.filter(pk=OuterRef('stock_id')).values('price'))
+    signed_quantity = Case(
+        When(limit_price__isnull=False, type=2, then=-F('filled_quantity')),
+        When(limit_price__isnull=False, then=F('filled_quantity')),
+        When(type=2, then=-F('quantity')),
+        default=F('quantity'),
+        output_field=models.BigIntegerField(),
+    )
+    Order.objects.update(booked_cost=models.ExpressionWrapper(signed_quantity * price, output_field=cost_field))
+    OrderSummary.objects.update(cost=models.ExpressionWrapper(F('quantity') * price, output_field=cost_field))
+
+    costs = {}
+    rows = Order.objects.values('owner_id', 'stock_id').annotate(cost=Sum('booked_cost')).order_by()
+    archived = OrderSummary.objects.values('owner_id', 'stock_id', 'cost')
+    for row in [*rows.iterator(), *archived.iterator()]:
+        key = (row['owner_id'], row['stock_id'])
+        costs[key] = costs.get(key, Decimal(0)) + row['cost']
+
+    positions = list(Position.objects.only('owner_id', 'stock_id', 'cost'))
+    for position in positions:
+        position.cost = costs.get((position.owner_id, position.stock_id), Decimal(0))
+    Position.objects.bulk_update(positions, ['cost'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_rebuild_positions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='booked_cost',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=20),
+        ),
+        migrations.AddField(
+            model_name='ordersummary',
+            name='cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=20),
+        ),
+        migrations.RunPython(book_costs, migrations.RunPython.noop),
+    ]
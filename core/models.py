@@ -1,5 +1,39 @@
+import re
+
+from datetime import timedelta
+from decimal import Decimal
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import IntegrityError, connection, connections, models, transaction
+from django.db.models import Case, Count, F, Max, Min, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Trunc
+from django.utils import timezone
+
+
+class StockQuerySet(models.QuerySet):
+
+    def search(self, term, limit):
+        """
+        Returns at most `limit` stocks matching the term, prefix matches first.
+        On PostgreSQL both the prefix and the pg_trgm similarity match are
+        served by the trigram index, other databases only match prefixes.
+        """
+        if connection.vendor == 'postgresql':
+            prefix = Q(name__iregex=f'^{re.escape(term)}')
+            queryset = self.filter(prefix | Q(name__trigram_similar=term)).annotate(
+                similarity=TrigramSimilarity('name', term)
+            )
+            ordering = ['-prefix_match', '-similarity', 'name']
+        else:
+            prefix = Q(name__istartswith=term)
+            queryset = self.filter(prefix)
+            ordering = ['-prefix_match', 'name']
+
+        queryset = queryset.annotate(
+            prefix_match=Case(When(prefix, then=Value(True)), default=Value(False), output_field=models.BooleanField())
+        )
+        return queryset.order_by(*ordering)[:limit]
 
 
 class Stock(models.Model):
@@ -9,28 +43,444 @@ class Stock(models.Model):
     name = models.CharField(max_length=50, blank=False)
     price = models.DecimalField(max_digits=8, decimal_places=2)
 
+    objects = StockQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered to record a price tick only when the price changes
+        instance._original_price = instance.__dict__.get('price')
+        return instance
+
+    def price_changed(self):
+        """
+        Returns whether the price differs from the one loaded from the database
+        """
+        original = getattr(self, '_original_price', None)
+        return original is None or Decimal(str(self.price)) != original
+
     def get_total_invested(self, user):
-        
-        total_invested = 0
-        order_list = Order.objects.filter(owner=user, stock=self)
-        for order in order_list:
-            total_invested += (float(order.quantity)*float(self.price))
-        return total_invested
+        """
+        Returns the net quantity held by the user valued at the current price.
+        The net quantity of the orders and of the archived orders is summed in
+        the database so only one row is fetched.
+        """
+        archived = OrderSummary.objects.filter(owner=user, stock=self).values('quantity')
+        net_quantity = Order.objects.filter(owner=user, stock=self).aggregate(
+            net_quantity=Coalesce(Sum(Order.signed_quantity()), 0) + Coalesce(Subquery(archived), 0)
+        )['net_quantity'] or 0
+        return Decimal(net_quantity) * Decimal(self.price)
+
+
+class OrderQuerySet(models.QuerySet):
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Creates the orders and sets their primary keys, which databases such
+        as SQLite do not return from inserts. Their writers are serialized,
+        so in the transaction creating them the orders are the last inserted.
+        """
+        objs = super().bulk_create(objs, *args, **kwargs)
+        features = connections[self.db].features
+        if objs and objs[0].pk is None and not features.can_return_rows_from_bulk_insert:
+            ids = self.order_by('-id').values_list('id', flat=True)[:len(objs)]
+            for order, pk in zip(objs, reversed(list(ids))):
+                order.pk = pk
+        return objs
 
 
 class Order(models.Model):
     """
     Order model that summarizes information on user orders
     """
+    BUY = 1
+    SELL = 2
     TYPE_CHOICES = [
-        (1, 'BUY'),
-        (2, 'SELL'),
+        (BUY, 'BUY'),
+        (SELL, 'SELL'),
     ]
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
     type = models.IntegerField(choices=TYPE_CHOICES, blank=False) 
     quantity = models.PositiveIntegerField(default=0)
+    limit_price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    filled_quantity = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now, editable=False)
+    # Signed cost the order adds to the position of its owner
+    booked_cost = models.DecimalField(max_digits=20, decimal_places=2, default=0, editable=False)
+
+    BOOKED_FIELDS = ('owner_id', 'stock_id', 'type', 'quantity', 'limit_price', 'filled_quantity', 'booked_cost')
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'stock'], name='core_order_owner_stock_idx'),
+            models.Index(fields=['owner', 'id'], name='core_order_owner_id_idx'),
+            models.Index(
+                fields=['stock', 'id'],
+                name='core_order_open_limit_idx',
+                condition=Q(limit_price__isnull=False) & Q(filled_quantity__lt=F('quantity')),
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered to book only what changes when the order is saved again
+        instance._booked = instance.get_booked()
+        return instance
+
+    def get_booked(self):
+        """
+        Returns the `(owner_id, stock_id, quantity, cost)` the order adds to
+        the positions, or None when some of its fields are deferred
+        """
+        if any(name not in self.__dict__ for name in self.BOOKED_FIELDS):
+            return None
+        return self.owner_id, self.stock_id, self.signed_executed_quantity, self.booked_cost
+
+    def set_booked_cost(self, booked=None, price=None):
+        """
+        Sets the cost the order books. It keeps the cost of the previous
+        booking while the owner, stock and executed quantity are unchanged,
+        otherwise the executed quantity is valued at `price`, by default the
+        current price of the stock.
+        """
+        quantity = self.signed_executed_quantity
+        if booked is not None and booked[:3] == (self.owner_id, self.stock_id, quantity):
+            self.booked_cost = booked[3]
+            return
+        if quantity and price is None:
+            if Order.stock.is_cached(self):
+                price = self.stock.price
+            else:
+                price = Stock.objects.values_list('price', flat=True).get(pk=self.stock_id)
+        self.booked_cost = quantity * Decimal(str(price)) if quantity else Decimal(0)
+
+    @property
+    def signed_executed_quantity(self):
+        return -self.executed_quantity if self.type == self.SELL else self.executed_quantity
+
+    @property
+    def executed_quantity(self):
+        """
+        Quantity held through the order. Orders without a limit price are
+        booked as they are, limit orders only for what has been matched.
+        """
+        return self.quantity if self.limit_price is None else self.filled_quantity
+
+    @property
+    def is_open(self):
+        """
+        Whether the order is a limit order resting in the book of its stock
+        """
+        return self.limit_price is not None and self.filled_quantity < self.quantity
+
+    @classmethod
+    def signed_quantity(cls):
+        """
+        Expression for the executed quantity of an order, negative for SELL orders
+        """
+        return Case(
+            When(limit_price__isnull=False, type=cls.SELL, then=-F('filled_quantity')),
+            When(limit_price__isnull=False, then=F('filled_quantity')),
+            When(type=cls.SELL, then=-F('quantity')),
+            default=F('quantity'),
+            output_field=models.BigIntegerField(),
+        )
+
+
+
+class Position(models.Model):
+    """
+    Position model that holds the net quantity and cost of a stock for a user.
+    It is maintained incrementally on order writes: by signals for orders
+    saved or deleted one at a time, by `apply_orders` for bulk inserts.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    quantity = models.BigIntegerField(default=0)
+    cost = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'stock'], name='core_position_owner_stock_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.owner} {self.stock}: {self.quantity}'
+
+    @classmethod
+    def apply_orders(cls, orders):
+        """
+        Books the executed quantity of the given orders at the current price
+        of their stock and adds it to the positions of their owners. Must be
+        called before the orders are inserted, in the same transaction.
+        """
+        deltas = {}
+        for order in orders:
+            order.set_booked_cost(price=order.stock.price)
+            cls.add_delta(deltas, order.get_booked())
+        cls.apply_deltas(deltas)
+
+    @classmethod
+    def book_order(cls, old, new):
+        """
+        Moves the positions from what was booked for a saved or deleted order
+        to what it books now, both `(owner_id, stock_id, quantity, cost)` or
+        None, so an order is reverted at the cost it was booked at
+        """
+        if old == new:
+            return
+        deltas = {}
+        cls.add_delta(deltas, old, sign=-1)
+        cls.add_delta(deltas, new)
+        # A deleted order only reverts an existing position
+        cls.apply_deltas(deltas, create=new is not None)
+
+    @classmethod
+    def apply_executions(cls, executions):
+        """
+        Adds the given executions to the positions of the buyers and sellers,
+        valued at the execution price.
+        """
+        deltas = {}
+        for execution in executions:
+            cost = execution.quantity * execution.price
+            cls.add_delta(deltas, (execution.buyer_id, execution.stock_id, execution.quantity, cost))
+            cls.add_delta(deltas, (execution.seller_id, execution.stock_id, -execution.quantity, -cost))
+        cls.apply_deltas(deltas)
+
+    @staticmethod
+    def add_delta(deltas, booked, sign=1):
+        """
+        Adds a `(owner_id, stock_id, quantity, cost)` booking, or None, to the deltas
+        """
+        if booked is None or not (booked[2] or booked[3]):
+            return
+        owner_id, stock_id, quantity, cost = booked
+        delta_quantity, delta_cost = deltas.get((owner_id, stock_id), (0, Decimal(0)))
+        deltas[(owner_id, stock_id)] = (delta_quantity + sign * quantity, delta_cost + sign * cost)
+
+    @classmethod
+    def apply_deltas(cls, deltas, create=True):
+        """
+        Adds `{(owner_id, stock_id): (quantity, cost)}` deltas to the positions,
+        creating the missing ones unless `create` is False
+        """
+        for (owner_id, stock_id), (quantity, cost) in deltas.items():
+            updated = cls.objects.filter(owner_id=owner_id, stock_id=stock_id).update(
+                quantity=F('quantity') + quantity,
+                cost=F('cost') + cost,
+            )
+            if updated or not create:
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(owner_id=owner_id, stock_id=stock_id, quantity=quantity, cost=cost)
+            except IntegrityError:
+                # Another transaction created the position first
+                cls.objects.filter(owner_id=owner_id, stock_id=stock_id).update(
+                    quantity=F('quantity') + quantity,
+                    cost=F('cost') + cost,
+                )
+
+    @classmethod
+    def get_total_invested(cls, user, stock):
+        """
+        Returns the total invested from the materialized position, falling back
+        to aggregating the orders when the user has no position on the stock.
+        """
+        quantity = cls.objects.filter(owner=user, stock=stock).values_list('quantity', flat=True).first()
+        if quantity is None:
+            return stock.get_total_invested(user)
+        return Decimal(quantity) * Decimal(stock.price)
+
+
+class PriceTickQuerySet(models.QuerySet):
+
+    def ohlc(self, resolution):
+        """
+        Returns the open, high, low and close price and the number of ticks of
+        every `resolution` bucket (a Trunc kind such as 'hour' or 'day'),
+        oldest first. Buckets are aggregated in the database and the open and
+        close prices fetched with a second query on the bucket boundaries.
+        """
+        buckets = list(
+            self.annotate(time=Trunc('timestamp', resolution))
+            .values('time')
+            .annotate(
+                high=Max('price'),
+                low=Min('price'),
+                count=Count('id'),
+                first=Min('timestamp'),
+                last=Max('timestamp'),
+            )
+            .order_by('time')
+        )
+
+        boundaries = {bucket['first'] for bucket in buckets} | {bucket['last'] for bucket in buckets}
+        opening, closing = {}, {}
+        ticks = self.filter(timestamp__in=boundaries).order_by('timestamp', 'id').values_list('timestamp', 'price')
+        for timestamp, price in ticks:
+            opening.setdefault(timestamp, price)
+            closing[timestamp] = price
+
+        return [
+            {
+                'time': bucket['time'],
+                'open': opening[bucket['first']],
+                'high': bucket['high'],
+                'low': bucket['low'],
+                'close': closing[bucket['last']],
+                'count': bucket['count'],
+            }
+            for bucket in buckets
+        ]
+
+
+class PriceTick(models.Model):
+    """
+    PriceTick model that holds the history of the price of a stock.
+    A tick is recorded whenever the price of a stock changes.
+    """
+    RESOLUTIONS = {
+        'minute': timedelta(minutes=1),
+        'hour': timedelta(hours=1),
+        'day': timedelta(days=1),
+        'week': timedelta(weeks=1),
+        'month': timedelta(days=28),
+    }
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+    timestamp = models.DateTimeField()
+
+    objects = PriceTickQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock', 'timestamp'], name='core_pricetick_stock_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.stock} {self.timestamp}: {self.price}'
+
+
+class OrderBookVersion(models.Model):
+    """
+    Version of the limit order book of a stock, incremented by every match.
+    Its row lock serializes matching on the stock, and an in-memory book of
+    an older version is replayed from the database.
+    """
+    stock = models.OneToOneField(Stock, on_delete=models.CASCADE, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+
+class Execution(models.Model):
+    """
+    Execution model that holds a fill between a buy and a sell limit order,
+    produced by the matching engine in `core.matching`.
+    """
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    # Without constraints, executions keep the ids of orders moved to the archive
+    buy_order = models.ForeignKey(
+        Order, on_delete=models.DO_NOTHING, db_constraint=False, related_name='buy_executions'
+    )
+    sell_order = models.ForeignKey(
+        Order, on_delete=models.DO_NOTHING, db_constraint=False, related_name='sell_executions'
+    )
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock', 'timestamp'], name='core_execution_stock_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.stock} {self.quantity} @ {self.price}'
+
+
+class ArchivedOrder(models.Model):
+    """
+    ArchivedOrder model that holds the closed orders moved out of the Order
+    table by the `archive_orders` command, under their original ids.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='+')
+    type = models.IntegerField(choices=Order.TYPE_CHOICES)
+    quantity = models.PositiveIntegerField()
+    limit_price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    filled_quantity = models.PositiveIntegerField()
+    created = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.owner} {self.stock}: {self.quantity}'
+
+
+class ArchiveFile(models.Model):
+    """
+    ArchiveFile model that indexes a compressed columnar file of archived
+    orders by the range of order ids it holds.
+    """
+    path = models.CharField(max_length=255, unique=True)
+    min_id = models.BigIntegerField()
+    max_id = models.BigIntegerField()
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['min_id', 'max_id'], name='core_archivefile_ids_idx'),
+        ]
+
+
+class OrderSummary(models.Model):
+    """
+    OrderSummary model that holds the net executed quantity, the booked cost
+    and the number of the archived orders of a user on a stock, so that
+    aggregates over the order history stay correct after archiving.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    quantity = models.BigIntegerField(default=0)
+    cost = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'stock'], name='core_ordersummary_owner_stock_uniq'),
+        ]
 
+    @classmethod
+    def add(cls, rows):
+        """
+        Adds `{owner_id, stock_id, quantity, cost, orders}` rows to the
+        summaries. Must be called in the transaction that archives the orders.
+        """
+        for row in rows:
+            lookup = {'owner_id': row['owner_id'], 'stock_id': row['stock_id']}
+            updated = cls.objects.filter(**lookup).update(
+                quantity=F('quantity') + row['quantity'],
+                cost=F('cost') + row['cost'],
+                orders=F('orders') + row['orders'],
+            )
+            if updated:
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(**lookup, quantity=row['quantity'], cost=row['cost'], orders=row['orders'])
+            except IntegrityError:
+                # Another transaction created the summary first
+                cls.objects.filter(**lookup).update(
+                    quantity=F('quantity') + row['quantity'],
+                    cost=F('cost') + row['cost'],
+                    orders=F('orders') + row['orders'],
+                )
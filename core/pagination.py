@@ -0,0 +1,12 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Keyset pagination for orders on the primary key, newest first
+    """
+    ordering = '-id'
+    page_size = settings.ORDER_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.ORDER_MAX_PAGE_SIZE
@@ -0,0 +1,98 @@
+"""
+Portfolio valuation of every stock a user holds.
+
+Holdings come from a grouped aggregate over the user's orders joined to the
+stock price, merged with the summaries of their archived orders. Weights are
+computed with NumPy when it is installed, totals are kept as exact decimals.
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+
+from core.models import Order, OrderSummary, Position
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def get_holdings(user):
+    """
+    Returns the net quantity, cost and market value of every stock held by
+    the user, including the archived orders summarized in OrderSummary
+    """
+    market_value = ExpressionWrapper(
+        Order.signed_quantity() * F('stock__price'),
+        output_field=DecimalField(max_digits=20, decimal_places=2)
+    )
+    cost = Position.objects.filter(owner=user, stock=OuterRef('stock')).values('cost')[:1]
+    holdings = {
+        holding['stock']: holding
+        for holding in (
+            Order.objects
+            .filter(owner=user)
+            .values('stock', 'stock__name', 'stock__price')
+            .annotate(
+                net_quantity=Sum(Order.signed_quantity()),
+                market_value=Sum(market_value),
+                cost=Subquery(cost),
+            )
+        )
+    }
+    archived = (
+        OrderSummary.objects
+        .filter(owner=user)
+        .exclude(quantity=0)
+        .values('stock', 'stock__name', 'stock__price', 'quantity')
+        .annotate(cost=Subquery(cost))
+    )
+    for summary in archived:
+        holding = holdings.setdefault(summary['stock'], {
+            'stock': summary['stock'],
+            'stock__name': summary['stock__name'],
+            'stock__price': summary['stock__price'],
+            'net_quantity': 0,
+            'market_value': Decimal(0),
+            'cost': summary['cost'],
+        })
+        holding['net_quantity'] += summary['quantity']
+        holding['market_value'] += summary['quantity'] * summary['stock__price']
+
+    return [holding for stock, holding in sorted(holdings.items()) if holding['net_quantity']]
+
+
+def get_weights(values, total):
+    """
+    Returns the share of the total of every value
+    """
+    if not total:
+        return [0.0] * len(values)
+    if numpy is not None:
+        return (numpy.array(values, dtype=numpy.float64) / float(total)).tolist()
+    return [float(value) / float(total) for value in values]
+
+
+def get_portfolio(user):
+    holdings = get_holdings(user)
+    market_values = [holding['market_value'] for holding in holdings]
+    total_market_value = sum(market_values, Decimal(0))
+    weights = get_weights(market_values, total_market_value)
+
+    return {
+        'owner': user.pk,
+        'holdings': [
+            {
+                'stock': holding['stock'],
+                'name': holding['stock__name'],
+                'price': holding['stock__price'],
+                'quantity': holding['net_quantity'],
+                'cost': holding['cost'],
+                'market_value': holding['market_value'],
+                'weight': weight,
+            }
+            for holding, weight in zip(holdings, weights)
+        ],
+        'total_cost': sum((holding['cost'] for holding in holdings if holding['cost'] is not None), Decimal(0)),
+        'total_market_value': total_market_value,
+    }
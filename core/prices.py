@@ -0,0 +1,144 @@
+"""
+Bulk stock price updates for market data feeds.
+
+Rows of `stock` ids and prices are parsed lazily from CSV or NDJSON and
+applied with `bulk_update` in batches, each batch in its own transaction.
+`bulk_update` sends no signals, so the price ticks are recorded, the stock
+caches invalidated and the changes published to the price stream here.
+"""
+import codecs
+import csv
+import json
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from core.cache import bump_stock_version
+from core.models import PriceTick, Stock
+from core.streaming import publish_price_changes
+
+PRICE_FIELD = serializers.DecimalField(max_digits=8, decimal_places=2, min_value=0)
+
+STOCK_FIELD = serializers.IntegerField(min_value=1)
+
+
+def parse_rows(lines, price_format):
+    """
+    Yields a `(line, row)` pair for every record of the CSV or NDJSON lines
+    """
+    if price_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row
+
+
+def parse_prices(lines, price_format):
+    """
+    Yields a `(line, stock_id, price, errors)` tuple for every record, with
+    the validation errors of the record or None.
+    """
+    for line_number, row in parse_rows(lines, price_format):
+        if not isinstance(row, dict):
+            yield line_number, None, None, {'non_field_errors': ['Invalid record']}
+            continue
+
+        values = {}
+        errors = {}
+        for name, field in [('stock', STOCK_FIELD), ('price', PRICE_FIELD)]:
+            try:
+                values[name] = field.run_validation(row.get(name, serializers.empty))
+            except serializers.ValidationError as exc:
+                errors[name] = exc.detail
+        yield line_number, values.get('stock'), values.get('price'), errors or None
+
+
+def decode_lines(stream, encoding='utf-8'):
+    """
+    Returns the lines of a binary stream as text, decoded incrementally
+    """
+    return codecs.iterdecode(stream, encoding)
+
+
+def apply_batch(prices):
+    """
+    Saves the `{stock_id: price}` changes with a price tick for every changed
+    stock, and returns the number of updated stocks and the ids of unknown stocks.
+    """
+    timestamp = timezone.now()
+    with transaction.atomic():
+        stocks = Stock.objects.select_for_update().only('id', 'name', 'price').in_bulk(list(prices))
+        changed = []
+        for stock_id, stock in stocks.items():
+            if stock.price != prices[stock_id]:
+                stock.price = prices[stock_id]
+                changed.append(stock)
+        Stock.objects.bulk_update(changed, ['price'])
+        PriceTick.objects.bulk_create(
+            [PriceTick(stock=stock, price=stock.price, timestamp=timestamp) for stock in changed]
+        )
+        if changed:
+            # Like the stock signals, bump now and again on commit
+            bump_stock_version()
+            transaction.on_commit(bump_stock_version)
+            publish_price_changes([{'id': stock.id, 'name': stock.name, 'price': stock.price} for stock in changed])
+    return len(changed), [stock_id for stock_id in prices if stock_id not in stocks]
+
+
+def update_prices(lines, price_format, batch_size=None, max_errors=100):
+    """
+    Applies the prices of the CSV or NDJSON lines and returns a report of the
+    update. Invalid records and unknown stocks are skipped and reported, at
+    most `max_errors` of them. A stock repeated in the feed takes its last price.
+    """
+    batch_size = batch_size or settings.STOCK_PRICE_BATCH_SIZE
+    report = {
+        'received': 0, 'updated': 0, 'unchanged': 0, 'duplicates': 0, 'invalid': 0, 'unknown': 0,
+        'batches': 0, 'errors': [],
+    }
+
+    def add_error(line_number, errors):
+        if len(report['errors']) < max_errors:
+            report['errors'].append({'line': line_number, 'errors': errors})
+
+    def flush(batch):
+        updated, unknown = apply_batch({stock_id: price for stock_id, (price, line_number) in batch.items()})
+        report['batches'] += 1
+        report['updated'] += updated
+        report['unknown'] += len(unknown)
+        report['unchanged'] += len(batch) - updated - len(unknown)
+        for stock_id in unknown:
+            add_error(batch[stock_id][1], {'stock': [f'Invalid pk "{stock_id}" - object does not exist.']})
+
+    start = time.perf_counter()
+    batch = {}
+    for line_number, stock_id, price, errors in parse_prices(lines, price_format):
+        report['received'] += 1
+        if errors:
+            report['invalid'] += 1
+            add_error(line_number, errors)
+            continue
+        if stock_id in batch:
+            report['duplicates'] += 1
+        batch[stock_id] = (price, line_number)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = {}
+    if batch:
+        flush(batch)
+
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    report['rows_per_second'] = round(report['received'] / report['seconds']) if report['seconds'] else None
+    return report
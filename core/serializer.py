@@ -1,9 +1,13 @@
+from decimal import Decimal
+
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
-from core.models import Order, Stock
+from core.models import Order, Position, PriceTick, Stock
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -46,22 +50,127 @@ class StockSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'price']
 
 
+class StockSearchSerializer(serializers.Serializer):
+    search = serializers.CharField(source='term', max_length=50)
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.STOCK_SEARCH_MAX_LIMIT,
+        default=settings.STOCK_SEARCH_LIMIT
+    )
+
+
+class PriceHistorySerializer(serializers.Serializer):
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField(default=timezone.now)
+    resolution = serializers.ChoiceField(choices=list(PriceTick.RESOLUTIONS), default='day')
+
+    def validate(self, data):
+        if data['start'] >= data['end']:
+            raise serializers.ValidationError({'start': 'Must be before the end'})
+        points = (data['end'] - data['start']) / PriceTick.RESOLUTIONS[data['resolution']]
+        if points > settings.PRICE_HISTORY_MAX_POINTS:
+            raise serializers.ValidationError({
+                'resolution': f'Too fine for the range, at most {settings.PRICE_HISTORY_MAX_POINTS} points are returned'
+            })
+        return data
+
+
+class PriceBucketSerializer(serializers.Serializer):
+    time = serializers.DateTimeField()
+    open = serializers.DecimalField(max_digits=8, decimal_places=2)
+    high = serializers.DecimalField(max_digits=8, decimal_places=2)
+    low = serializers.DecimalField(max_digits=8, decimal_places=2)
+    close = serializers.DecimalField(max_digits=8, decimal_places=2)
+    count = serializers.IntegerField()
+
+
 class OrderSerializer(serializers.ModelSerializer):
     owner = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=True) 
     stock = serializers.PrimaryKeyRelatedField(queryset=Stock.objects.all(), required=True) 
     type = serializers.ChoiceField(
-            choices=[
-                (1, 'BUY'),
-                (2, 'SELL'),
-            ],
+            choices=Order.TYPE_CHOICES,
             allow_blank=False,
             allow_null=False
         )
     quantity = serializers.IntegerField(min_value=0)
+    limit_price = serializers.DecimalField(
+        max_digits=8,
+        decimal_places=2,
+        min_value=Decimal('0.01'),
+        required=False,
+        allow_null=True
+    )
+    filled_quantity = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Order 
-        fields = ['id', 'owner', 'stock', 'type', 'quantity']
+        fields = ['id', 'owner', 'stock', 'type', 'quantity', 'limit_price', 'filled_quantity']
+
+
+class OrderBulkSerializer(serializers.Serializer):
+    """
+    Serializer for an order of a bulk submission. Related objects are not
+    looked up per row, they are resolved in bulk by `OrderViewSet.bulk`.
+    """
+    owner = serializers.IntegerField()
+    stock = serializers.IntegerField()
+    type = serializers.ChoiceField(choices=Order.TYPE_CHOICES)
+    quantity = serializers.IntegerField(min_value=0)
+    limit_price = serializers.DecimalField(
+        max_digits=8,
+        decimal_places=2,
+        min_value=Decimal('0.01'),
+        required=False,
+        allow_null=True
+    )
+
+
+def nullable(representation):
+    return lambda value: None if value is None else representation(value)
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer for rows fetched with `QuerySet.values()`. It skips
+    model instantiation and per-field overhead, and its output is identical
+    to the ModelSerializer it mirrors.
+    """
+    fields = ()
+    representations = {}
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(*cls.fields)
+
+    @classmethod
+    def to_representation(cls, row):
+        representations = cls.representations
+        return {
+            field: representations[field](row[field]) if field in representations else row[field]
+            for field in cls.fields
+        }
+
+    @property
+    def data(self):
+        return [self.to_representation(row) for row in self.rows]
+
+
+class StockValuesSerializer(ValuesSerializer):
+    fields = ('id', 'name', 'price')
+    representations = {
+        'price': serializers.DecimalField(max_digits=8, decimal_places=2).to_representation,
+    }
+
+
+class OrderValuesSerializer(ValuesSerializer):
+    fields = ('id', 'owner', 'stock', 'type', 'quantity', 'limit_price', 'filled_quantity')
+    representations = {
+        'limit_price': nullable(serializers.DecimalField(max_digits=8, decimal_places=2).to_representation),
+    }
+
 
 class TotalInvestedSerializer(serializers.Serializer):
     owner = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=True) 
@@ -69,5 +178,22 @@ class TotalInvestedSerializer(serializers.Serializer):
     total_invested = serializers.SerializerMethodField()
 
     def get_total_invested(self, data):
-        total_stock = data['stock'].get_total_invested(data['owner'])
+        total_stock = Position.get_total_invested(data['owner'], data['stock'])
         return total_stock
+
+
+class PortfolioHoldingSerializer(serializers.Serializer):
+    stock = serializers.IntegerField()
+    name = serializers.CharField()
+    price = serializers.DecimalField(max_digits=8, decimal_places=2)
+    quantity = serializers.IntegerField()
+    cost = serializers.DecimalField(max_digits=20, decimal_places=2, allow_null=True)
+    market_value = serializers.DecimalField(max_digits=20, decimal_places=2)
+    weight = serializers.FloatField()
+
+
+class PortfolioSerializer(serializers.Serializer):
+    owner = serializers.IntegerField()
+    holdings = PortfolioHoldingSerializer(many=True)
+    total_cost = serializers.DecimalField(max_digits=20, decimal_places=2)
+    total_market_value = serializers.DecimalField(max_digits=20, decimal_places=2)
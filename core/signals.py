@@ -0,0 +1,118 @@
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from core.authentication import invalidate_token
+from core.cache import bump_stock_version
+from core.matching import engine
+from core.models import Order, Position, PriceTick, Stock
+from core.streaming import publish_price_changes
+
+# Users and stocks being deleted, with the orders and positions cascading
+# from them. A deletion that fails leaves its mark until the next request.
+cascading = ContextVar('cascading', default=frozenset())
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def invalidate_stock_cache(sender, **kwargs):
+    # Bump now and again on commit, so a response cached from a read
+    # made before the commit does not outlive it.
+    bump_stock_version()
+    transaction.on_commit(bump_stock_version)
+
+
+@receiver(post_save, sender=Stock)
+def record_price_tick(sender, instance, **kwargs):
+    if instance.price_changed():
+        PriceTick.objects.create(stock=instance, price=instance.price, timestamp=timezone.now())
+        instance._original_price = Decimal(str(instance.price))
+        publish_price_changes([{'id': instance.id, 'name': instance.name, 'price': instance._original_price}])
+
+
+@receiver(pre_save, sender=Order)
+def load_booked_order(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if not instance._state.adding and getattr(instance, '_booked', None) is None:
+        # Orders inserted by bulk_create or loaded with deferred fields do
+        # not know what they booked
+        original = Order.objects.filter(pk=instance.pk).first()
+        instance._booked = original.get_booked() if original is not None else None
+    instance.set_booked_cost(None if instance._state.adding else instance._booked)
+
+
+@receiver(pre_save, sender=Order)
+def invalidate_edited_order_book(sender, instance, raw=False, **kwargs):
+    # New orders are added to the books by the matching engine, which only
+    # updates orders in bulk, so any other save may change a resting order
+    if raw or instance._state.adding:
+        return
+    stock_ids = {instance.stock_id}
+    if getattr(instance, '_booked', None) is not None:
+        stock_ids.add(instance._booked[1])
+    for stock_id in stock_ids:
+        engine.invalidate(stock_id)
+
+
+@receiver(post_save, sender=Order)
+def book_saved_order(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    booked = instance.get_booked() or Order.objects.get(pk=instance.pk).get_booked()
+    Position.book_order(None if created else getattr(instance, '_booked', None), booked)
+    instance._booked = booked
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Stock)
+def start_cascade(sender, instance, **kwargs):
+    cascading.set(cascading.get() | {(sender, instance.pk)})
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Stock)
+def end_cascade(sender, instance, **kwargs):
+    cascading.set(cascading.get() - {(sender, instance.pk)})
+
+
+@receiver(request_started)
+def reset_cascade(sender, **kwargs):
+    cascading.set(frozenset())
+
+
+@receiver(post_delete, sender=Order)
+def unbook_deleted_order(sender, instance, **kwargs):
+    # The positions of a deleted user or stock are deleted with it
+    if {(User, instance.owner_id), (Stock, instance.stock_id)} & cascading.get():
+        return
+    Position.book_order(getattr(instance, '_booked', None) or instance.get_booked(), None)
+
+
+@receiver(post_delete, sender=Order)
+def invalidate_deleted_order_book(sender, instance, **kwargs):
+    if instance.is_open and (Stock, instance.stock_id) not in cascading.get():
+        engine.invalidate(instance.stock_id)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Logging in only updates last_login, which authentication does not use
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        invalidate_token(key)
@@ -0,0 +1,324 @@
+"""
+Server-sent event stream of stock price changes.
+
+Committed price changes are published with `publish_price_changes`. On
+PostgreSQL they are sent with NOTIFY, delivered at commit to every process,
+including the changes of management commands such as `update_prices`. The
+`PriceListener` thread of every process serving the stream LISTENs for them
+and publishes them to the in-process `price_feed`, which serializes every
+change once and fans the event out to the connected clients. Other databases
+have no shared channel, the feed then only sees the changes of its own
+process. The stream is a raw ASGI application mounted in front of Django by
+`macrovueexam.asgi`, so a client holds no worker thread while it waits.
+
+Event ids carry a random epoch of the feed, so a client resuming with an id
+the feed does not know, or whose following events are no longer buffered,
+is sent a snapshot of every stock instead of silently missing events.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import secrets
+import select
+import threading
+import time
+
+from collections import deque
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections, transaction
+
+from core.db.routers import primary_reads
+from core.models import Stock
+from core.serializer import StockValuesSerializer
+
+logger = logging.getLogger(__name__)
+
+PRICE_STREAM_PATH = '/stocks/stream/'
+
+PRICE_CHANNEL = 'core_price_changes'
+
+# Stock ids per notification, whose payload is limited to 8000 bytes
+NOTIFY_BATCH_SIZE = 500
+
+CLOSE = None
+
+
+class Subscriber:
+    """
+    Queue of events of a client, read on the event loop of its connection.
+    A client that falls behind is disconnected and resumes with Last-Event-ID.
+    """
+
+    def __init__(self, loop, queue_size):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Id of the snapshot to send first when the client missed events
+        self.snapshot_id = None
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(CLOSE)
+
+
+class PriceFeed:
+    """
+    Thread-safe fan-out of price change events with a buffer of recent events
+    """
+
+    def __init__(self, replay_size):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.epoch = secrets.token_hex(4)
+        self.ids = itertools.count(1)
+        self.last_sequence = 0
+        self.recent = deque(maxlen=replay_size)
+
+    def get_event_id(self, sequence):
+        return f'{self.epoch}-{sequence}'
+
+    def get_sequence(self, event_id):
+        """
+        Returns the sequence of an event id of this feed, or None
+        """
+        epoch, _, sequence = event_id.partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def subscribe(self, queue_size, last_event_id=None):
+        """
+        Registers a subscriber on the running loop, with the buffered events
+        after `last_event_id` already queued. When they are not all buffered
+        the subscriber gets the `snapshot_id` of a snapshot to send first.
+        """
+        subscriber = Subscriber(asyncio.get_running_loop(), queue_size)
+        with self.lock:
+            if last_event_id is not None:
+                sequence = self.get_sequence(last_event_id)
+                if sequence is None or not self.last_sequence - len(self.recent) <= sequence <= self.last_sequence:
+                    subscriber.snapshot_id = self.get_event_id(self.last_sequence)
+                else:
+                    for event_sequence, event in self.recent:
+                        if event_sequence > sequence:
+                            subscriber.deliver(event)
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def restart(self):
+        """
+        Starts a new epoch after events may have been missed, so every client
+        reconnects and resumes from a snapshot
+        """
+        with self.lock:
+            self.epoch = secrets.token_hex(4)
+            self.recent.clear()
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, CLOSE)
+            except RuntimeError:
+                self.unsubscribe(subscriber)
+
+    def publish(self, rows):
+        """
+        Sends the changed stock rows, from `StockValuesSerializer.values`, to
+        every subscriber as one event
+        """
+        if not rows:
+            return
+        data = serialize_rows(rows)
+        with self.lock:
+            self.last_sequence = next(self.ids)
+            event = format_event(self.get_event_id(self.last_sequence), 'prices', data)
+            self.recent.append((self.last_sequence, event))
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+            except RuntimeError:
+                # The loop of the connection is closed
+                self.unsubscribe(subscriber)
+
+
+price_feed = PriceFeed(settings.PRICE_STREAM_REPLAY_SIZE)
+
+
+def publish_price_changes(rows):
+    """
+    Publishes the changed stock rows, from `StockValuesSerializer.values`,
+    when the transaction commits
+    """
+    if connection.vendor != 'postgresql':
+        transaction.on_commit(lambda: price_feed.publish(rows))
+        return
+
+    stock_ids = [row['id'] for row in rows]
+    with connection.cursor() as cursor:
+        for start in range(0, len(stock_ids), NOTIFY_BATCH_SIZE):
+            payload = json.dumps(stock_ids[start:start + NOTIFY_BATCH_SIZE])
+            cursor.execute('SELECT pg_notify(%s, %s)', [PRICE_CHANNEL, payload])
+
+
+class PriceListener:
+    """
+    Thread publishing the price changes notified on PostgreSQL to the feed.
+    After losing its connection it starts a new epoch of the feed, since the
+    changes notified meanwhile are lost.
+    """
+
+    def __init__(self, feed, reconnect_delay=1):
+        self.feed = feed
+        self.reconnect_delay = reconnect_delay
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        if connection.vendor != 'postgresql':
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='price-listener', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        connected = False
+        while True:
+            try:
+                self.listen(restart=connected)
+            except Exception:
+                logger.exception('Price listener disconnected, reconnecting')
+            connected = True
+            time.sleep(self.reconnect_delay)
+
+    def listen(self, restart=False):
+        # A dedicated connection, outside of any pool, since it keeps listening
+        params = connections.create_connection(DEFAULT_DB_ALIAS).get_connection_params()
+        listener = psycopg2.connect(**params)
+        try:
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN {PRICE_CHANNEL}')
+            if restart:
+                self.feed.restart()
+            while True:
+                if not select.select([listener], [], [], settings.PRICE_STREAM_HEARTBEAT)[0]:
+                    continue
+                listener.poll()
+                payloads = [notify.payload for notify in listener.notifies]
+                listener.notifies.clear()
+                self.publish(payloads)
+        finally:
+            listener.close()
+
+    def publish(self, payloads):
+        """
+        Publishes the current rows of the stocks of the notification payloads
+        """
+        stock_ids = {stock_id for payload in payloads for stock_id in json.loads(payload)}
+        if not stock_ids:
+            return
+        close_old_connections()
+        try:
+            # A replica may not have replayed the notified change yet
+            with primary_reads():
+                rows = list(StockValuesSerializer.values(Stock.objects.filter(id__in=stock_ids).order_by('id')))
+        finally:
+            close_old_connections()
+        self.feed.publish(rows)
+
+
+price_listener = PriceListener(price_feed)
+
+
+def serialize_rows(rows):
+    return json.dumps([StockValuesSerializer.to_representation(row) for row in rows])
+
+
+def format_event(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {data}\n\n'.encode()
+
+
+def load_snapshot():
+    close_old_connections()
+    try:
+        return list(StockValuesSerializer.values(Stock.objects.all()))
+    finally:
+        close_old_connections()
+
+
+def get_last_event_id(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'last-event-id':
+            return value.decode('latin-1')
+    return None
+
+
+async def price_stream(scope, receive, send):
+    """
+    ASGI application streaming the price change events until the client disconnects
+    """
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    price_listener.start()
+    subscriber = price_feed.subscribe(settings.PRICE_STREAM_QUEUE_SIZE, get_last_event_id(scope))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 1000\n\n', 'more_body': True})
+        if subscriber.snapshot_id is not None:
+            rows = await sync_to_async(load_snapshot, thread_sensitive=False)()
+            snapshot = format_event(subscriber.snapshot_id, 'snapshot', serialize_rows(rows))
+            await send({'type': 'http.response.body', 'body': snapshot, 'more_body': True})
+        while not disconnected.done():
+            next_event = asyncio.ensure_future(subscriber.queue.get())
+            done, pending = await asyncio.wait(
+                {next_event, disconnected},
+                timeout=settings.PRICE_STREAM_HEARTBEAT,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if next_event not in done:
+                next_event.cancel()
+                if not disconnected.done():
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                continue
+            event = next_event.result()
+            if event is CLOSE:
+                break
+            await send({'type': 'http.response.body', 'body': event, 'more_body': True})
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        price_feed.unsubscribe(subscriber)
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
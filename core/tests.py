@@ -1,13 +1,66 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, RequestFactory, TransactionTestCase, override_settings
 from rest_framework.test import APITestCase
 from rest_framework import status
-from unittest import expectedFailure
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from unittest import TestCase, expectedFailure, mock
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db.utils import IntegrityError, OperationalError
+from django.http import HttpResponse
+from django.urls import ResolverMatch, resolve
 
-from core.models import Order, Stock
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+
+from core import benchmark, portfolio
+from core.archive import FileStore, TableStore, archive_orders, find_archived_order
+from core.async_views import database_sync_to_async
+from core.authentication import SignedTokenAuthentication, TokenCache, get_shared_cache_key, token_cache
+from core.cache import stock_cache
+from core.db.pool import ConnectionPool, PoolTimeout, collect_pool_metrics, pools
+from core.db.routers import ReplicaRouter, replica_reads
+from core.ingestion import OrderIngester
+from core.instrumentation import registry
+from core.middleware import InstrumentationMiddleware, ReplicaRoutingMiddleware
+from core.matching import BookOrder, OrderBook, engine
+from core.models import (
+    ArchivedOrder, ArchiveFile, Execution, Order, OrderBookVersion, OrderSummary, Position, PriceTick, Stock
+)
+from core.parsers import FastJSONParser
+from core.prices import update_prices
+from core.renderers import FastJSONRenderer
+from core.serializer import OrderSerializer, OrderValuesSerializer, StockSerializer, StockValuesSerializer
+from core.streaming import (
+    CLOSE, PRICE_CHANNEL, PRICE_STREAM_PATH, PriceFeed, PriceListener, price_stream, publish_price_changes
+)
+from macrovueexam.urls import router
 
 
 class BaseTest(APITestCase):
     def setUp(self):
+        cache.clear()
+        token_cache.clear()
 
         self.base_user = User.objects.create_user(
             'macrovue',
@@ -150,6 +203,223 @@ class AuthenticationTests(BaseTest):
         self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+class PasswordHashingTests(BaseTest):
+    """
+    Tests for password hashing and login throttling
+    """
+    def test_new_password_uses_preferred_hasher(self):
+        """
+        Test that new passwords are hashed with the preferred hasher
+        """
+        self.assertTrue(self.base_user.password.startswith(f'{settings.PASSWORD_HASHER}'))
+
+    def test_login_rehashes_legacy_password(self):
+        """
+        Test that a successful login upgrades a hash made by another hasher
+        """
+        User.objects.filter(pk=self.base_user.pk).update(
+            password=make_password('pass123', hasher='pbkdf2_sha1')
+        )
+        data = {
+            'username': 'macrovue',
+            'password': 'pass123'
+        }
+        res = self.client.post('/login/', data=data, format='json')
+        self.base_user.refresh_from_db()
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(self.base_user.password.startswith(settings.PASSWORD_HASHER))
+
+    @override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'login_username': '2/min'},
+    })
+    def test_login_throttled_per_username(self):
+        """
+        Test that repeated logins for one username are throttled
+        """
+        data = {
+            'username': 'macrovue',
+            'password': 'wrongpass'
+        }
+        responses = [self.client.post('/login/', data=data, format='json') for x in range(3)]
+        other = self.client.post('/login/', data={'username': 'supermacrovue', 'password': 'wrong'}, format='json')
+
+        self.assertEqual([res.status_code for res in responses], [400, 400, 429])
+        self.assertEqual(other.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'signup_ip': '1/min'},
+    })
+    def test_signup_throttled_per_ip(self):
+        """
+        Test that repeated signups from one IP are throttled
+        """
+        first = self.client.post('/users/', data={}, format='json')
+        second = self.client.post('/users/', data={}, format='json')
+
+        self.assertEqual(first.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(second.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'signup_ip': '1/min'},
+    })
+    def test_signup_throttle_ignores_forwarded_for(self):
+        """
+        Test that rotating the X-Forwarded-For header does not reset the per-IP throttle
+        """
+        first = self.client.post('/users/', data={}, format='json', HTTP_X_FORWARDED_FOR='10.0.0.1')
+        second = self.client.post('/users/', data={}, format='json', HTTP_X_FORWARDED_FOR='10.0.0.2')
+
+        self.assertEqual(first.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(second.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class TokenAuthenticationTests(BaseTest):
+    """
+    Tests for the cached token authentication
+    """
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.base_user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_lookup_cached(self):
+        """
+        Test that repeated requests do not query the token again
+        """
+        self.client.get(f'/orders/{self.base_order.id}/')
+        with self.assertNumQueries(1):
+            res = self.client.get(f'/orders/{self.base_order.id}/')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_logout_revokes_cached_token(self):
+        """
+        Test that logging out revokes the token and drops it from the cache
+        """
+        self.client.get('/orders/')
+        res = self.client.get('/logout/')
+        after = self.client.get('/orders/')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+        self.assertEqual(after.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_invalidates_cache(self):
+        """
+        Test that deactivating a user drops their cached tokens
+        """
+        self.client.get('/orders/')
+        self.base_user.is_active = False
+        self.base_user.save()
+        res = self.client.get('/orders/')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(TOKEN_AUTH_SHARED_CACHE='default')
+    def test_token_cache_excludes_password(self):
+        """
+        Test that the cached user holds only the fields used for authorization
+        """
+        self.client.get('/orders/')
+        token_cache.clear()
+        with self.assertNumQueries(1):
+            res = self.client.get('/orders/')
+
+        shared = cache.get(get_shared_cache_key(self.token.key))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(token_cache.get(self.token.key), shared)
+        self.assertEqual(
+            shared,
+            {'id': self.base_user.id, 'username': self.base_user.username, 'is_staff': False, 'is_superuser': False}
+        )
+
+    def test_token_cache_bounded(self):
+        """
+        Test that the token cache evicts the least recently used entries
+        """
+        cache = TokenCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+
+@override_settings(AUTH_STATELESS=True)
+class StatelessAuthenticationTests(BaseTest):
+    """
+    Tests for the stateless signed token mode
+    """
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(APIView, 'authentication_classes', [SignedTokenAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self):
+        data = {
+            'username': 'macrovue',
+            'password': 'pass123'
+        }
+        return self.client.post('/login/', data=data, format='json')
+
+    def test_login_issues_signed_token(self):
+        """
+        Test that login issues a signed token without writing a session or token row
+        """
+        res = self.login()
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Token.objects.exists())
+
+    def test_signed_token_authenticates_without_queries(self):
+        """
+        Test that a signed token authenticates without database access
+        """
+        token = self.login().data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        with self.assertNumQueries(1):
+            res = self.client.get(f'/orders/{self.base_order.id}/')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_signed_token_order_owner_check(self):
+        """
+        Test that the user rebuilt from the token passes the owner check
+        """
+        token = self.login().data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        data = {
+            'owner': self.base_user.id,
+            'stock': self.base_stock.id,
+            'type': 1,
+            'quantity': 100
+        }
+        res = self.client.post('/orders/', data=data, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_signed_token_expired(self):
+        """
+        Test that expired and tampered tokens are rejected
+        """
+        token = self.login().data['token']
+        with self.settings(AUTH_STATELESS_TOKEN_MAX_AGE=-1):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+            expired = self.client.get('/orders/')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}x')
+        tampered = self.client.get('/orders/')
+
+        self.assertEqual(expired.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(tampered.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
 class StockTests(BaseTest):
     """
     Tests for Stock Functionalities
@@ -222,6 +492,27 @@ class StockTests(BaseTest):
         self.assertContains(res, test_stock.name)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
 
+    def test_stock_list_search_ranking(self):
+        """
+        Test that the stock search returns prefix matches and honours the limit
+        """
+        for name in ['Xavier Two', 'Xavier One', 'Not Xavier']:
+            Stock.objects.create(name=name, price='1.00')
+
+        res = self.client.get('/stocks/?search=xav&limit=1', format='json')
+        all_res = self.client.get('/stocks/?search=xav', format='json')
+
+        self.assertEqual([stock['name'] for stock in res.data], ['Xavier One'])
+        self.assertEqual([stock['name'] for stock in all_res.data], ['Xavier One', 'Xavier Two'])
+
+    def test_stock_list_search_invalid_limit(self):
+        """
+        Test that an invalid search limit is rejected
+        """
+        res = self.client.get('/stocks/?search=xav&limit=0', format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_stock_retrieve_success(self):
         """
         Test for successful stock list
@@ -247,72 +538,1793 @@ class StockTests(BaseTest):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data['total_invested'], self.base_stock.get_total_invested(self.base_user))
 
-class OrderTests(BaseTest):
+    def test_total_invested_signed_quantities(self):
+        """
+        Test that SELL orders are subtracted from the total invested
+        """
+        stock = Stock.objects.create(name='Decimal Stock', price='0.10')
+        Order.objects.create(owner=self.base_user, stock=stock, type=Order.BUY, quantity=30)
+        Order.objects.create(owner=self.base_user, stock=stock, type=Order.SELL, quantity=10)
+
+        with self.assertNumQueries(1):
+            total_invested = stock.get_total_invested(self.base_user)
+
+        self.assertEqual(total_invested, Decimal('2.00'))
+
+    def test_total_invested_no_orders(self):
+        """
+        Test total invested for a user without orders
+        """
+        self.assertEqual(self.base_stock.get_total_invested(self.super_user), Decimal('0'))
+
+class StockCacheTests(BaseTest):
     """
-    Tests for Order functionalities
+    Tests for the stock response cache
     """
-    def test_order_authentication(self):
+    def test_stock_list_cached(self):
         """
-        Test for order authentication
+        Test that a repeated stock list is served from the cache
         """
-        data = {
-            'owner': self.base_user.id,
-            'stock': self.base_stock.id,
-            'type': 1,
-            'quantity': 100
-        }
-        res = self.client.post('/orders/')
+        self.client.get('/stocks/', format='json')
+        with self.assertNumQueries(0):
+            res = self.client.get('/stocks/', format='json')
 
-        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
-    
-    def test_order_create_success(self):
+        self.assertEqual(res.data[0]['name'], self.base_stock.name)
+
+    def test_stock_cache_invalidated_on_save(self):
         """
-        Test for order creation
+        Test that saving a stock invalidates the cached responses
         """
-        data = {
-            'owner': self.base_user.id,
-            'stock': self.base_stock.id,
-            'type': 1,
-            'quantity': 100
-        }
-        self.client.login(username=self.base_user.username, password='pass123')
-        res = self.client.post('/orders/', data=data, format='json' )
+        first = self.client.get(f'/stocks/{self.base_stock.id}/', format='json')
+        self.base_stock.price = '2.50'
+        self.base_stock.save()
+        second = self.client.get(f'/stocks/{self.base_stock.id}/', format='json')
 
-        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertEqual(second.data['price'], '2.50')
 
-    def test_order_create_forbidden(self):
+    def test_stock_not_modified(self):
         """
-        Test for order creation
+        Test that a matching If-None-Match gets a 304
         """
-        data = {
-            'owner': self.super_user.id,
-            'stock': self.base_stock.id,
-            'type': 1,
-            'quantity': 100
-        }
-        self.client.login(username=self.base_user.username, password='pass123')
-        res = self.client.post('/orders/', data=data, format='json')
-        self.client.logout()
+        res = self.client.get('/stocks/', format='json')
+        not_modified = self.client.get('/stocks/', format='json', HTTP_IF_NONE_MATCH=res['ETag'])
 
-        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
 
-    def test_order_list_success(self):
+    @override_settings(STOCK_CACHE_TIMEOUT=0)
+    def test_stock_etag_follows_content(self):
         """
-        Test for successful order list
+        Test that a change not seen by the cache version still changes the ETag once the cache expires
         """
-        self.client.login(username=self.base_user.username, password='pass123')
-        res = self.client.get('/orders/', format='json')
-        self.client.logout()
+        res = self.client.get(f'/stocks/{self.base_stock.id}/', format='json')
+        Stock.objects.filter(pk=self.base_stock.pk).update(price='3.00')
+        changed = self.client.get(f'/stocks/{self.base_stock.id}/', format='json', HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(changed.status_code, status.HTTP_200_OK)
+        self.assertEqual(changed.data['price'], '3.00')
+
+    def test_stock_etag_per_path(self):
+        """
+        Test that the ETag of a stock does not match another or a missing stock
+        """
+        res = self.client.get(f'/stocks/{self.base_stock.id}/', format='json')
+        missing = self.client.get('/stocks/99999/', format='json', HTTP_IF_NONE_MATCH=res['ETag'])
+        listed = self.client.get('/stocks/', format='json', HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(listed.status_code, status.HTTP_200_OK)
+
+
+class StockPriceTests(BaseTest):
+    """
+    Tests for the bulk stock price update
+    """
+    def setUp(self):
+        super().setUp()
+        self.other_stock = Stock.objects.create(name='Other Stock', price='3.00')
+
+    def test_prices_csv(self):
+        """
+        Test a CSV price update with an invalid record and an unknown stock
+        """
+        body = f'stock,price\n{self.base_stock.id},2.50\n{self.other_stock.id},abc\n999999,1.00\n'
+
+        self.client.login(username=self.super_user.username, password='superpass123')
+        res = self.client.post('/stocks/prices/', data=body, content_type='text/csv')
 
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [res.data[key] for key in ['received', 'updated', 'invalid', 'unknown']],
+            [3, 1, 1, 1]
+        )
+        self.assertEqual([error['line'] for error in res.data['errors']], [3, 4])
+        self.assertEqual(Stock.objects.get(id=self.base_stock.id).price, Decimal('2.50'))
+        self.assertEqual(Stock.objects.get(id=self.other_stock.id).price, Decimal('3.00'))
 
-    def test_order_retrieve_success(self):
+    def test_prices_ndjson_batches(self):
         """
-        Test for successful order retrieve
+        Test that an NDJSON price update is applied in batches, the last price of a stock winning
+        """
+        body = '\n'.join(json.dumps(row) for row in [
+            {'stock': self.base_stock.id, 'price': '2.00'},
+            {'stock': self.other_stock.id, 'price': '3.00'},
+            {'stock': self.base_stock.id, 'price': '4.00'},
+        ])
+
+        self.client.login(username=self.super_user.username, password='superpass123')
+        with override_settings(STOCK_PRICE_BATCH_SIZE=1):
+            res = self.client.post('/stocks/prices/', data=body, content_type='application/x-ndjson')
+
+        self.assertEqual(res.data['batches'], 3)
+        self.assertEqual(res.data['updated'], 2)
+        self.assertEqual(res.data['unchanged'], 1)
+        self.assertEqual(Stock.objects.get(id=self.base_stock.id).price, Decimal('4.00'))
+
+    def test_prices_invalidate_cache(self):
+        """
+        Test that a price update invalidates the cached stock responses
+        """
+        first = self.client.get(f'/stocks/{self.base_stock.id}/', format='json')
+        self.client.login(username=self.super_user.username, password='superpass123')
+        self.client.post('/stocks/prices/', data=f'stock,price\n{self.base_stock.id},2.50\n', content_type='text/csv')
+        second = self.client.get(f'/stocks/{self.base_stock.id}/', format='json')
+
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertEqual(second.data['price'], '2.50')
+
+    def test_prices_admin_only(self):
+        """
+        Test that only admins can update prices
         """
         self.client.login(username=self.base_user.username, password='pass123')
-        res = self.client.get(f'/orders/{self.base_order.id}/', format='json')
-        self.client.logout()
+        res = self.client.post('/stocks/prices/', data='stock,price\n', content_type='text/csv')
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_prices_unsupported_format(self):
+        """
+        Test that an unsupported content type gets a 415
+        """
+        self.client.login(username=self.super_user.username, password='superpass123')
+        res = self.client.post('/stocks/prices/', data={'stock': 1}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_update_prices_command(self):
+        """
+        Test the update_prices command reading from stdin
+        """
+        out = StringIO()
+        stdin = StringIO(f'stock,price\n{self.other_stock.id},5.25\n')
+        with mock.patch('sys.stdin', stdin):
+            call_command('update_prices', '-', '--format', 'csv', stdout=out)
+
+        self.assertEqual(json.loads(out.getvalue())['updated'], 1)
+        self.assertEqual(Stock.objects.get(id=self.other_stock.id).price, Decimal('5.25'))
+
+
+class PriceHistoryTests(BaseTest):
+    """
+    Tests for the stock price history
+    """
+    def setUp(self):
+        super().setUp()
+        self.day = datetime(2021, 3, 1, tzinfo=timezone.utc)
+        prices = [
+            (self.day + timedelta(hours=1), '10.00'),
+            (self.day + timedelta(hours=2), '12.00'),
+            (self.day + timedelta(hours=3), '9.00'),
+            (self.day + timedelta(hours=4), '11.00'),
+            (self.day + timedelta(days=1, hours=1), '11.50'),
+        ]
+        PriceTick.objects.bulk_create(
+            [PriceTick(stock=self.base_stock, price=price, timestamp=timestamp) for timestamp, price in prices]
+        )
+
+    def test_price_tick_recorded_on_change(self):
+        """
+        Test that saving a stock records a tick only when its price changes
+        """
+        stock = Stock.objects.create(name='Tick Stock', price='1.00')
+        stock = Stock.objects.get(id=stock.id)
+        stock.save()
+        stock.price = '2.00'
+        stock.save()
+
+        self.assertEqual(
+            list(PriceTick.objects.filter(stock=stock).order_by('id').values_list('price', flat=True)),
+            [Decimal('1.00'), Decimal('2.00')]
+        )
+
+    def test_price_tick_recorded_on_bulk_update(self):
+        """
+        Test that the bulk price update records ticks
+        """
+        update_prices([f'{{"stock": {self.base_stock.id}, "price": "3.00"}}'], 'ndjson')
+
+        self.assertEqual(PriceTick.objects.filter(stock=self.base_stock).latest('timestamp').price, Decimal('3.00'))
+
+    def test_ohlc(self):
+        """
+        Test the OHLC buckets of the ticks
+        """
+        ticks = PriceTick.objects.filter(stock=self.base_stock, timestamp__lt=self.day + timedelta(days=2))
+        with self.assertNumQueries(2):
+            buckets = ticks.ohlc('day')
+
+        self.assertEqual(
+            [(bucket['open'], bucket['high'], bucket['low'], bucket['close'], bucket['count']) for bucket in buckets],
+            [
+                (Decimal('10.00'), Decimal('12.00'), Decimal('9.00'), Decimal('11.00'), 4),
+                (Decimal('11.50'), Decimal('11.50'), Decimal('11.50'), Decimal('11.50'), 1),
+            ]
+        )
+
+    def test_history_success(self):
+        """
+        Test the downsampled price history of a stock
+        """
+        res = self.client.get(
+            f'/stocks/{self.base_stock.id}/history/',
+            {'start': '2021-03-01T00:00:00Z', 'end': '2021-03-02T00:00:00Z', 'resolution': 'hour'}
+        )
 
-        self.assertEqual(res.data['id'], self.base_order.id)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([point['close'] for point in res.data['points']], ['10.00', '12.00', '9.00', '11.00'])
+
+    def test_history_too_many_points(self):
+        """
+        Test that a resolution too fine for the range gets a 400
+        """
+        res = self.client.get(
+            f'/stocks/{self.base_stock.id}/history/',
+            {'start': '2020-03-01T00:00:00Z', 'end': '2021-03-01T00:00:00Z', 'resolution': 'minute'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PriceStreamTests(BaseTest):
+    """
+    Tests for the server-sent event stream of price changes
+    """
+    def setUp(self):
+        super().setUp()
+        self.feed = PriceFeed(replay_size=10)
+        self.rows = [{'id': self.base_stock.id, 'name': 'Sample Stock', 'price': Decimal('2.5')}]
+
+    def test_feed_fan_out(self):
+        """
+        Test that an event published from another thread is serialized once for every subscriber
+        """
+        async def receive_events():
+            first = self.feed.subscribe(queue_size=10)
+            second = self.feed.subscribe(queue_size=10)
+            publisher = threading.Thread(target=self.feed.publish, args=(self.rows,))
+            publisher.start()
+            events = await asyncio.gather(first.queue.get(), second.queue.get())
+            publisher.join()
+            return events
+
+        first, second = asyncio.run(receive_events())
+
+        self.assertIs(first, second)
+        self.assertEqual(first, (
+            f'id: {self.feed.epoch}-1\nevent: prices\n'
+            f'data: [{{"id": {self.base_stock.id}, "name": "Sample Stock", "price": "2.50"}}]\n\n'
+        ).encode())
+
+    def test_feed_replay(self):
+        """
+        Test that a client resuming with Last-Event-ID receives the events it missed
+        """
+        self.feed.publish(self.rows)
+        self.feed.publish(self.rows)
+
+        async def subscribe():
+            return self.feed.subscribe(queue_size=10, last_event_id=f'{self.feed.epoch}-1')
+
+        subscriber = asyncio.run(subscribe())
+
+        self.assertEqual(subscriber.queue.qsize(), 1)
+        self.assertTrue(subscriber.queue.get_nowait().startswith(f'id: {self.feed.epoch}-2\n'.encode()))
+        self.assertIsNone(subscriber.snapshot_id)
+
+    def test_feed_unknown_event_id_snapshot(self):
+        """
+        Test that a client resuming with an id of another process, or of evicted events, needs a snapshot
+        """
+        feed = PriceFeed(replay_size=1)
+        for x in range(3):
+            feed.publish(self.rows)
+
+        async def subscribe(last_event_id):
+            return feed.subscribe(queue_size=10, last_event_id=last_event_id)
+
+        for last_event_id in ['1', f'{self.feed.epoch}-2', f'{feed.epoch}-1', f'{feed.epoch}-9']:
+            subscriber = asyncio.run(subscribe(last_event_id))
+            self.assertEqual(subscriber.snapshot_id, f'{feed.epoch}-3')
+            self.assertTrue(subscriber.queue.empty())
+        self.assertEqual(asyncio.run(subscribe(f'{feed.epoch}-2')).queue.qsize(), 1)
+
+    def test_feed_slow_subscriber_closed(self):
+        """
+        Test that a subscriber falling behind is closed
+        """
+        async def overflow():
+            subscriber = self.feed.subscribe(queue_size=1)
+            self.feed.publish(self.rows)
+            self.feed.publish(self.rows)
+            await asyncio.sleep(0)
+            return await subscriber.queue.get()
+
+        self.assertIsNone(asyncio.run(overflow()))
+
+    def test_stream(self):
+        """
+        Test that the ASGI stream sends the published events until the client disconnects
+        """
+        messages = []
+
+        async def stream():
+            disconnect = asyncio.Event()
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                if message.get('body', b'').startswith(b'retry'):
+                    self.feed.publish(self.rows)
+                elif message.get('body', b'').startswith(b'id'):
+                    disconnect.set()
+
+            scope = {'type': 'http', 'method': 'GET', 'path': PRICE_STREAM_PATH, 'headers': []}
+            with mock.patch('core.streaming.price_feed', self.feed):
+                await price_stream(scope, receive, send)
+
+        asyncio.run(stream())
+
+        self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+        self.assertIn((b'content-type', b'text/event-stream'), messages[0]['headers'])
+        self.assertTrue(messages[2]['body'].startswith(f'id: {self.feed.epoch}-1\nevent: prices\n'.encode()))
+        self.assertEqual(self.feed.subscribers, set())
+
+    def test_stream_snapshot(self):
+        """
+        Test that the ASGI stream sends a snapshot to a client resuming with an unknown id
+        """
+        messages = []
+
+        async def stream():
+            async def receive():
+                await asyncio.sleep(0.01)
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': PRICE_STREAM_PATH, 'headers': [(b'last-event-id', b'0-5')]}
+            with mock.patch('core.streaming.price_feed', self.feed), \
+                    mock.patch('core.streaming.load_snapshot', return_value=self.rows):
+                await price_stream(scope, receive, send)
+
+        asyncio.run(stream())
+
+        self.assertEqual(messages[2]['body'], (
+            f'id: {self.feed.epoch}-0\nevent: snapshot\n'
+            f'data: [{{"id": {self.base_stock.id}, "name": "Sample Stock", "price": "2.50"}}]\n\n'
+        ).encode())
+
+    def test_price_changes_published(self):
+        """
+        Test that committed price changes are published, from saves and bulk updates
+        """
+        with mock.patch('core.streaming.price_feed') as feed:
+            with self.captureOnCommitCallbacks(execute=True):
+                stock = Stock.objects.get(id=self.base_stock.id)
+                stock.name = 'Renamed Stock'
+                stock.save()
+                stock.price = '2.00'
+                stock.save()
+            with self.captureOnCommitCallbacks(execute=True):
+                update_prices([f'{{"stock": {self.base_stock.id}, "price": "3.00"}}'], 'ndjson')
+
+        self.assertEqual(feed.publish.call_args_list, [
+            mock.call([{'id': self.base_stock.id, 'name': 'Renamed Stock', 'price': Decimal('2.00')}]),
+            mock.call([{'id': self.base_stock.id, 'name': 'Renamed Stock', 'price': Decimal('3.00')}]),
+        ])
+
+    def test_price_changes_notified(self):
+        """
+        Test that price changes are notified on PostgreSQL, for the streams of every process
+        """
+        notifier = mock.MagicMock(vendor='postgresql')
+        stock_ids = list(range(1, 602))
+        with mock.patch('core.streaming.connection', notifier), mock.patch('core.streaming.price_feed') as feed:
+            publish_price_changes([{'id': stock_id, 'name': 'Stock', 'price': Decimal('1.00')} for stock_id in stock_ids])
+
+        cursor = notifier.cursor.return_value.__enter__.return_value
+        self.assertEqual(cursor.execute.call_args_list, [
+            mock.call('SELECT pg_notify(%s, %s)', [PRICE_CHANNEL, json.dumps(stock_ids[:500])]),
+            mock.call('SELECT pg_notify(%s, %s)', [PRICE_CHANNEL, json.dumps(stock_ids[500:])]),
+        ])
+        feed.publish.assert_not_called()
+
+    def test_listener_publishes_notified_stocks(self):
+        """
+        Test that the notified stocks are published once with their current rows
+        """
+        listener = PriceListener(self.feed)
+        listener.publish([json.dumps([self.base_stock.id]), json.dumps([self.base_stock.id])])
+
+        self.assertEqual(len(self.feed.recent), 1)
+        self.assertIn(b'"price": "1.00"', self.feed.recent[0][1])
+
+    def test_feed_restart(self):
+        """
+        Test that restarting the feed closes the subscribers and forgets the event ids
+        """
+        async def restart():
+            subscriber = self.feed.subscribe(10)
+            event_id = self.feed.get_event_id(self.feed.last_sequence)
+            self.feed.restart()
+            return await subscriber.queue.get(), self.feed.subscribe(10, event_id).snapshot_id
+
+        event, snapshot_id = asyncio.run(restart())
+
+        self.assertIs(event, CLOSE)
+        self.assertIsNotNone(snapshot_id)
+
+    def test_stream_not_served_by_wsgi(self):
+        """
+        Test that the stream path is not taken for a stock id outside the ASGI application
+        """
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.get(PRICE_STREAM_PATH)
+
+        self.assertEqual(res.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+
+class RenderingTests(BaseTest):
+    """
+    Tests for the fast JSON renderer and parser
+    """
+    data = {
+        'price': Decimal('12.50'),
+        'timestamp': datetime(2021, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+        'name': 'Unicode \u00e9 \u2028 \u2029',
+        'ids': [1, 2, 3],
+        1: None,
+    }
+
+    def test_renderer_matches_json_renderer(self):
+        """
+        Test that the fast renderer renders the same bytes as JSONRenderer
+        """
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_renderer_floats(self):
+        """
+        Test that floats, which orjson may write in another exponent notation, parse to the same values
+        """
+        data = {'weights': [0.1, 1 / 3, 1e16, 1e-7, -2.5e-12]}
+
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+    def test_renderer_fallback(self):
+        """
+        Test that the renderer falls back to the stdlib without orjson and for indented output
+        """
+        with mock.patch('core.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        self.assertEqual(
+            FastJSONRenderer().render(self.data, 'application/json; indent=2'),
+            JSONRenderer().render(self.data, 'application/json; indent=2')
+        )
+
+    def test_parser(self):
+        """
+        Test that the fast parser parses JSON and rejects invalid JSON
+        """
+        self.assertEqual(FastJSONParser().parse(BytesIO(b'{"quantity": 1}')), {'quantity': 1})
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"quantity":'))
+
+    def test_stock_list_rendered(self):
+        """
+        Test that the API renders its responses with the fast renderer
+        """
+        res = self.client.get('/stocks/', format='json')
+
+        self.assertEqual(res.content, JSONRenderer().render(res.data))
+        self.assertIsInstance(res.accepted_renderer, FastJSONRenderer)
+
+
+@override_settings(COMPRESSION_MIN_SIZE=100)
+class CompressionTests(BaseTest):
+    """
+    Tests for the response compression middleware
+    """
+    def setUp(self):
+        super().setUp()
+        Stock.objects.bulk_create([Stock(name=f'Stock {x}', price='1.00') for x in range(20)])
+
+    def test_gzip(self):
+        """
+        Test that a large response is compressed with gzip when accepted
+        """
+        uncompressed = self.client.get('/stocks/')
+        res = self.client.get('/stocks/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res['Vary'])
+        self.assertEqual(gzip.decompress(res.content), uncompressed.content)
+        self.assertEqual(res['ETag'], 'W/' + uncompressed['ETag'])
+
+    def test_weak_etag_not_modified(self):
+        """
+        Test that the weak ETag of a compressed response still gets a 304
+        """
+        res = self.client.get('/stocks/', HTTP_ACCEPT_ENCODING='gzip')
+        not_modified = self.client.get('/stocks/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=res['ETag'])
+
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_brotli_preferred(self):
+        """
+        Test that brotli is preferred when installed and accepted
+        """
+        fake_brotli = mock.Mock()
+        fake_brotli.compress.return_value = b'compressed'
+        with mock.patch('core.middleware.brotli', fake_brotli):
+            res = self.client.get('/stocks/', HTTP_ACCEPT_ENCODING='gzip, br')
+
+        self.assertEqual(res['Content-Encoding'], 'br')
+        self.assertEqual(res.content, b'compressed')
+
+    def test_not_compressed(self):
+        """
+        Test that small responses and refused encodings are not compressed
+        """
+        refused = self.client.get('/stocks/', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        small = self.client.get(f'/stocks/{self.base_stock.id}/', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertFalse(refused.has_header('Content-Encoding'))
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+    def test_streaming_gzip(self):
+        """
+        Test that streaming exports are compressed with gzip as they are sent
+        """
+        res = self.client.get('/stocks/export/', HTTP_ACCEPT_ENCODING='br, gzip')
+        content = gzip.decompress(b''.join(res.streaming_content))
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(len(content.splitlines()), 21)
+
+
+class OrderTests(BaseTest):
+    """
+    Tests for Order functionalities
+    """
+    def test_order_authentication(self):
+        """
+        Test for order authentication
+        """
+        data = {
+            'owner': self.base_user.id,
+            'stock': self.base_stock.id,
+            'type': 1,
+            'quantity': 100
+        }
+        res = self.client.post('/orders/')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    def test_order_create_success(self):
+        """
+        Test for order creation
+        """
+        data = {
+            'owner': self.base_user.id,
+            'stock': self.base_stock.id,
+            'type': 1,
+            'quantity': 100
+        }
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.post('/orders/', data=data, format='json' )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_order_create_forbidden(self):
+        """
+        Test for order creation
+        """
+        data = {
+            'owner': self.super_user.id,
+            'stock': self.base_stock.id,
+            'type': 1,
+            'quantity': 100
+        }
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.post('/orders/', data=data, format='json')
+        self.client.logout()
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_order_list_success(self):
+        """
+        Test for successful order list
+        """
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.get('/orders/', format='json')
+        self.client.logout()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_order_list_scoped_to_user(self):
+        """
+        Test that users only list their own orders
+        """
+        Order.objects.create(owner=self.super_user, stock=self.base_stock, type=1, quantity=5)
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.get(f'/orders/?owner={self.super_user.id}', format='json')
+        self.client.logout()
+
+        self.assertEqual([order['id'] for order in res.data['results']], [self.base_order.id])
+
+    def test_order_list_cursor_pagination(self):
+        """
+        Test that the order list is paginated with a cursor
+        """
+        orders = [
+            Order.objects.create(owner=self.base_user, stock=self.base_stock, type=1, quantity=x)
+            for x in range(3)
+        ]
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.get('/orders/?page_size=2', format='json')
+        next_res = self.client.get(res.data['next'], format='json')
+        self.client.logout()
+
+        self.assertEqual([order['id'] for order in res.data['results']], [orders[2].id, orders[1].id])
+        self.assertEqual([order['id'] for order in next_res.data['results']], [orders[0].id, self.base_order.id])
+        self.assertIsNone(next_res.data['next'])
+
+    def test_order_list_admin_filters(self):
+        """
+        Test that admins can filter orders by owner and type
+        """
+        admin_order = Order.objects.create(owner=self.super_user, stock=self.base_stock, type=2, quantity=5)
+        self.client.login(username=self.super_user.username, password='superpass123')
+        res = self.client.get(f'/orders/?owner={self.super_user.id}&type=2', format='json')
+        invalid_res = self.client.get('/orders/?type=abc', format='json')
+        self.client.logout()
+
+        self.assertEqual([order['id'] for order in res.data['results']], [admin_order.id])
+        self.assertEqual(invalid_res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_order_retrieve_success(self):
+        """
+        Test for successful order retrieve
+        """
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.get(f'/orders/{self.base_order.id}/', format='json')
+        self.client.logout()
+
+        self.assertEqual(res.data['id'], self.base_order.id)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_order_bulk_create_success(self):
+        """
+        Test for bulk order creation
+        """
+        data = [
+            {'owner': self.base_user.id, 'stock': self.base_stock.id, 'type': 1, 'quantity': 10},
+            {'owner': self.base_user.id, 'stock': self.base_stock.id, 'type': 2, 'quantity': 4},
+        ]
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.post('/orders/bulk/', data=data, format='json')
+        self.client.logout()
+
+        created = Order.objects.filter(owner=self.base_user).exclude(id=self.base_order.id).order_by('id')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data, OrderSerializer(created, many=True).data)
+        self.assertEqual([order['quantity'] for order in res.data], [10, 4])
+        self.assertEqual(Order.objects.filter(owner=self.base_user).count(), 3)
+        self.assertEqual(Position.objects.get(owner=self.base_user, stock=self.base_stock).quantity, 106)
+
+    def test_order_bulk_create_errors(self):
+        """
+        Test that bulk order creation reports errors per order and creates nothing
+        """
+        data = [
+            {'owner': self.base_user.id, 'stock': self.base_stock.id, 'type': 1, 'quantity': 10},
+            {'owner': self.base_user.id, 'stock': 0, 'type': 1, 'quantity': 10},
+            {'owner': self.base_user.id, 'stock': self.base_stock.id, 'type': 3, 'quantity': 10},
+        ]
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.post('/orders/bulk/', data=data, format='json')
+        self.client.logout()
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data[0], {})
+        self.assertIn('stock', res.data[1])
+        self.assertIn('type', res.data[2])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_order_bulk_create_forbidden(self):
+        """
+        Test that bulk orders for other users are forbidden
+        """
+        data = [{'owner': self.super_user.id, 'stock': self.base_stock.id, 'type': 1, 'quantity': 10}]
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.post('/orders/bulk/', data=data, format='json')
+        self.client.logout()
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class MatchingTests(BaseTest):
+    """
+    Tests for the limit order matching engine
+    """
+    def setUp(self):
+        super().setUp()
+        engine.clear()
+        self.seller = User.objects.create_user('seller', 'seller@test.com', 'pass123')
+
+    def submit(self, user, password, order_type, quantity, limit_price):
+        self.client.login(username=user.username, password=password)
+        res = self.client.post('/orders/', data={
+            'owner': user.id,
+            'stock': self.base_stock.id,
+            'type': order_type,
+            'quantity': quantity,
+            'limit_price': limit_price,
+        }, format='json')
+        self.client.logout()
+        return res
+
+    def test_order_book_price_time_priority(self):
+        """
+        Test that the best price fills first, then the oldest order at a price
+        """
+        book = OrderBook(self.base_stock.id)
+        book.add(BookOrder(1, 1, Order.SELL, 510, 5))
+        book.add(BookOrder(2, 1, Order.SELL, 500, 5))
+        book.add(BookOrder(3, 2, Order.SELL, 500, 5))
+        fills = book.match(BookOrder(4, 3, Order.BUY, 510, 12))
+
+        self.assertEqual(
+            [(fill.sell_order_id, fill.price, fill.quantity) for fill in fills],
+            [(2, 500, 5), (3, 500, 5), (1, 510, 2)]
+        )
+        self.assertEqual(book.best_ask, Decimal('5.10'))
+        self.assertIsNone(book.best_bid)
+
+    def test_order_book_rests_uncrossed(self):
+        """
+        Test that an order not crossing the spread rests in the book
+        """
+        book = OrderBook(self.base_stock.id)
+        book.add(BookOrder(1, 1, Order.SELL, 510, 5))
+        fills = book.match(BookOrder(2, 2, Order.BUY, 500, 5))
+
+        self.assertEqual(fills, [])
+        self.assertEqual(book.best_bid, Decimal('5.00'))
+        self.assertEqual(len(book), 2)
+
+    def test_limit_orders_matched(self):
+        """
+        Test that crossing limit orders produce an execution at the resting price
+        """
+        sell = self.submit(self.seller, 'pass123', Order.SELL, 10, '5.00')
+        buy = self.submit(self.base_user, 'pass123', Order.BUY, 4, '6.00')
+
+        self.assertEqual(buy.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(buy.data['filled_quantity'], 4)
+        self.assertEqual(Order.objects.get(id=sell.data['id']).filled_quantity, 4)
+        execution = Execution.objects.get()
+        self.assertEqual((execution.price, execution.quantity), (Decimal('5.00'), 4))
+        self.assertEqual(execution.buyer, self.base_user)
+        self.assertEqual(Position.objects.get(owner=self.seller).quantity, -4)
+        self.assertEqual(Position.objects.get(owner=self.base_user).cost, Decimal('120.00'))
+
+    def test_bulk_limit_orders_matched(self):
+        """
+        Test that limit orders of a bulk submission are matched, including against each other
+        """
+        data = [
+            {'owner': self.base_user.id, 'stock': self.base_stock.id, 'type': Order.SELL, 'quantity': 10,
+             'limit_price': '5.00'},
+            {'owner': self.base_user.id, 'stock': self.base_stock.id, 'type': Order.BUY, 'quantity': 4,
+             'limit_price': '6.00'},
+        ]
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.post('/orders/bulk/', data=data, format='json')
+        self.client.logout()
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([order['limit_price'] for order in res.data], ['5.00', '6.00'])
+        self.assertEqual([order['filled_quantity'] for order in res.data], [4, 4])
+        self.assertEqual(Execution.objects.get().quantity, 4)
+        self.assertEqual(Position.objects.get(owner=self.base_user).quantity, 100)
+
+    def test_unfilled_limit_order_not_invested(self):
+        """
+        Test that only the filled quantity of a limit order counts as invested
+        """
+        self.submit(self.base_user, 'pass123', Order.BUY, 10, '0.50')
+
+        self.assertEqual(self.base_stock.get_total_invested(self.base_user), Decimal('100'))
+
+    def test_book_replayed_from_database(self):
+        """
+        Test that open orders are replayed when the book is not in memory or is stale
+        """
+        sell = self.submit(self.seller, 'pass123', Order.SELL, 10, '5.00')
+        engine.clear()
+        replayed = self.submit(self.base_user, 'pass123', Order.BUY, 3, '5.00')
+        # Another process fills the rest of the sell order
+        Order.objects.filter(id=sell.data['id']).update(filled_quantity=10)
+        OrderBookVersion.objects.update(version=0)
+        stale = self.submit(self.base_user, 'pass123', Order.BUY, 3, '5.00')
+
+        self.assertEqual(replayed.data['filled_quantity'], 3)
+        self.assertEqual(stale.data['filled_quantity'], 0)
+        self.assertIsNone(engine.books[self.base_stock.id].best_ask)
+        self.assertEqual(engine.books[self.base_stock.id].best_bid, Decimal('5.00'))
+
+    def test_book_invalidated_on_delete(self):
+        """
+        Test that a resting order deleted outside the engine leaves the book
+        """
+        self.submit(self.seller, 'pass123', Order.SELL, 10, '5.00')
+        self.seller.delete()
+        res = self.submit(self.base_user, 'pass123', Order.BUY, 3, '5.00')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['filled_quantity'], 0)
+        self.assertFalse(Execution.objects.exists())
+        self.assertIsNone(engine.books[self.base_stock.id].best_ask)
+
+    def test_book_invalidated_on_edit(self):
+        """
+        Test that a resting order edited outside the engine is replayed
+        """
+        sell = self.submit(self.seller, 'pass123', Order.SELL, 10, '5.00')
+        order = Order.objects.get(id=sell.data['id'])
+        order.limit_price = Decimal('7.00')
+        order.save()
+        res = self.submit(self.base_user, 'pass123', Order.BUY, 3, '5.00')
+
+        self.assertEqual(res.data['filled_quantity'], 0)
+        self.assertEqual(engine.books[self.base_stock.id].best_ask, Decimal('7.00'))
+
+    def test_benchmark_matching(self):
+        """
+        Test the in-memory matching benchmark
+        """
+        result = benchmark.benchmark_matching(orders=1000, stocks=2)
+
+        self.assertEqual(result['orders'], 1000)
+        self.assertGreater(result['fills'], 0)
+
+
+@override_settings(ORDER_INGESTION_ENABLED=True)
+class IngestionTests(BaseTest):
+    """
+    Tests for the write-behind order ingestion
+    """
+    def setUp(self):
+        super().setUp()
+        self.ingester = OrderIngester(queue_size=2, batch_size=10, max_delay=0)
+        for patcher in [mock.patch('core.views.ingester', self.ingester), mock.patch.object(OrderIngester, 'start')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client.login(username=self.base_user.username, password='pass123')
+        self.data = {'owner': self.base_user.id, 'stock': self.base_stock.id, 'type': Order.BUY, 'quantity': 50}
+
+    def test_order_accepted_pending(self):
+        """
+        Test that a queued order is accepted and saved with its position by the flusher
+        """
+        res = self.client.post('/orders/', data=self.data, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Order.objects.count(), 1)
+
+        self.ingester.flush_pending()
+
+        self.assertEqual(Order.objects.filter(owner=self.base_user, quantity=50).count(), 1)
+        self.assertEqual(Position.objects.get(owner=self.base_user, stock=self.base_stock).quantity, 150)
+
+    def test_order_wait_failed(self):
+        """
+        Test that waiting on an order the flusher failed to save answers with the error
+        """
+        responses = []
+        for exc in [IntegrityError('stock deleted'), OperationalError('database down')]:
+            future = Future()
+            future.set_exception(exc)
+            with mock.patch.object(self.ingester, 'submit', return_value=future):
+                responses.append(self.client.post('/orders/?wait=true', data=self.data, format='json'))
+
+        self.assertEqual(
+            [res.status_code for res in responses],
+            [status.HTTP_400_BAD_REQUEST, status.HTTP_503_SERVICE_UNAVAILABLE]
+        )
+        self.assertEqual(responses[1]['Retry-After'], '1')
+        self.assertIn('detail', responses[0].data)
+
+    def test_queue_full(self):
+        """
+        Test that orders are refused with a 503 while the queue is full
+        """
+        for x in range(2):
+            self.client.post('/orders/', data=self.data, format='json')
+        res = self.client.post('/orders/', data=self.data, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '1')
+
+    def test_limit_orders_not_queued(self):
+        """
+        Test that limit orders are matched synchronously
+        """
+        res = self.client.post('/orders/', data={**self.data, 'limit_price': '1.00'}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(self.ingester.queue.empty())
+
+    def test_failed_order_isolated(self):
+        """
+        Test that an order failing to save does not fail the rest of its batch
+        """
+        apply_orders = Position.apply_orders
+        book_order = Position.book_order
+
+        def fail_rejected_orders(orders):
+            if any(order.quantity == 13 for order in orders):
+                raise OperationalError('rejected')
+            return apply_orders(orders)
+
+        def fail_rejected_order(old, new):
+            if new is not None and new[2] == 13:
+                raise OperationalError('rejected')
+            return book_order(old, new)
+
+        good = self.ingester.submit(Order(owner=self.base_user, stock=self.base_stock, type=Order.BUY, quantity=1))
+        bad = self.ingester.submit(Order(owner=self.base_user, stock=self.base_stock, type=Order.BUY, quantity=13))
+        with mock.patch.object(Position, 'apply_orders', side_effect=fail_rejected_orders), \
+                mock.patch.object(Position, 'book_order', side_effect=fail_rejected_order), \
+                self.assertLogs('core.ingestion', level='ERROR'):
+            self.ingester.flush_pending()
+
+        self.assertEqual(good.result(timeout=0).quantity, 1)
+        self.assertEqual(list(Order.objects.filter(quantity__in=[1, 13]).values_list('quantity', flat=True)), [1])
+        self.assertIsNotNone(bad.exception(timeout=0))
+
+
+@override_settings(ORDER_INGESTION_ENABLED=True)
+class IngestionWaitTests(TransactionTestCase):
+    """
+    Tests for waiting on the write-behind order ingestion
+    """
+    def test_order_wait_committed(self):
+        """
+        Test that waiting answers with the committed order
+        """
+        user = User.objects.create_user('macrovue', 'test@test.com', 'pass123')
+        stock = Stock.objects.create(name='Sample Stock', price='1.0')
+        ingester = OrderIngester(queue_size=10, batch_size=10, max_delay=0)
+        self.addCleanup(ingester.stop)
+        self.client.login(username=user.username, password='pass123')
+        with mock.patch('core.views.ingester', ingester):
+            res = self.client.post(
+                '/orders/?wait=true',
+                data={'owner': user.id, 'stock': stock.id, 'type': Order.BUY, 'quantity': 5},
+                content_type='application/json'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['id'], Order.objects.get(owner=user, quantity=5).id)
+
+
+class PositionTests(BaseTest):
+    """
+    Tests for materialized positions
+    """
+    def test_order_create_updates_position(self):
+        """
+        Test that creating orders through the API maintains the position
+        """
+        self.client.login(username=self.base_user.username, password='pass123')
+        for order_type, quantity in [(Order.BUY, 50), (Order.SELL, 20)]:
+            data = {
+                'owner': self.base_user.id,
+                'stock': self.base_stock.id,
+                'type': order_type,
+                'quantity': quantity
+            }
+            self.client.post('/orders/', data=data, format='json')
+        self.client.logout()
+
+        position = Position.objects.get(owner=self.base_user, stock=self.base_stock)
+        self.assertEqual(position.quantity, 130)
+        self.assertEqual(position.cost, Decimal('130.00'))
+        self.assertEqual(self.base_stock.get_total_invested(self.base_user), Decimal('130.00'))
+
+    def test_order_save_and_delete_update_position(self):
+        """
+        Test that orders saved or deleted outside the API maintain the position
+        """
+        order = Order.objects.create(owner=self.base_user, stock=self.base_stock, type=Order.SELL, quantity=40)
+        order.quantity = 30
+        order.save()
+        Order.objects.get(pk=self.base_order.pk).delete()
+
+        self.assertEqual(Position.objects.get(owner=self.base_user, stock=self.base_stock).quantity, -30)
+        call_command('rebuild_positions', verify=True, stdout=StringIO())
+
+    def test_order_reverted_at_booked_cost(self):
+        """
+        Test that an order deleted or edited after a price change is reverted at the cost it was booked at
+        """
+        user = User.objects.create_user('investor', 'investor@test.com', 'pass123')
+        stock = Stock.objects.create(name='Other Stock', price='2.00')
+        large = Order.objects.create(owner=user, stock=stock, type=Order.BUY, quantity=10)
+        small = Order.objects.create(owner=user, stock=stock, type=Order.BUY, quantity=1)
+        stock.price = Decimal('5.00')
+        stock.save()
+        Order.objects.get(pk=large.pk).delete()
+        position = Position.objects.get(owner=user, stock=stock)
+        self.assertEqual((position.quantity, position.cost), (1, Decimal('2.00')))
+
+        small = Order.objects.get(pk=small.pk)
+        with self.assertNumQueries(2):
+            small.save()
+        self.assertEqual(Position.objects.get(owner=user, stock=stock).cost, Decimal('2.00'))
+        small.quantity = 3
+        small.save()
+        position = Position.objects.get(owner=user, stock=stock)
+        self.assertEqual((position.quantity, position.cost), (3, Decimal('15.00')))
+        call_command('rebuild_positions', verify=True, stdout=StringIO())
+
+    def test_cascaded_orders_not_unbooked(self):
+        """
+        Test that deleting a user does not revert its orders one at a time
+        """
+        user = User.objects.create_user('investor', 'investor@test.com', 'pass123')
+        for quantity in range(1, 6):
+            Order.objects.create(owner=user, stock=self.base_stock, type=Order.BUY, quantity=quantity)
+
+        with self.assertNumQueries(12):
+            User.objects.get(pk=user.pk).delete()
+        self.assertFalse(Position.objects.filter(owner_id=user.pk).exists())
+        self.assertEqual(Position.objects.get(owner=self.base_user).quantity, 100)
+
+    def test_total_invested_reads_position(self):
+        """
+        Test that total invested is served from the position when it exists
+        """
+        Position.objects.filter(owner=self.base_user, stock=self.base_stock).update(quantity=7, cost='7.00')
+        data = {
+            'owner': self.base_user.id,
+            'stock': self.base_stock.id,
+        }
+        res = self.client.post('/total-invested/', data=data, format='json')
+
+        self.assertEqual(res.data['total_invested'], Decimal('7.00'))
+
+    def test_rebuild_and_verify_positions(self):
+        """
+        Test that the management command rebuilds positions and detects drift
+        """
+        Order.objects.create(owner=self.base_user, stock=self.base_stock, type=Order.SELL, quantity=40)
+        call_command('rebuild_positions', stdout=StringIO())
+
+        position = Position.objects.get(owner=self.base_user, stock=self.base_stock)
+        self.assertEqual(position.quantity, 60)
+        call_command('rebuild_positions', verify=True, stdout=StringIO())
+
+        Position.objects.filter(pk=position.pk).update(quantity=1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_positions', verify=True, stdout=StringIO())
+
+
+class ExportTests(BaseTest):
+    """
+    Tests for the streaming exports
+    """
+    def test_stock_export_ndjson(self):
+        """
+        Test that stocks are exported as NDJSON matching the serializer output
+        """
+        res = self.client.get('/stocks/export/', format='json')
+        rows = [json.loads(line) for line in b''.join(res.streaming_content).decode().splitlines()]
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(rows, [{'id': self.base_stock.id, 'name': 'Sample Stock', 'price': '1.00'}])
+
+    def test_order_export_csv(self):
+        """
+        Test that orders are exported as CSV scoped to the user
+        """
+        Order.objects.create(owner=self.super_user, stock=self.base_stock, type=1, quantity=5)
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.get('/orders/export/?fmt=csv')
+        self.client.logout()
+        lines = b''.join(res.streaming_content).decode().splitlines()
+
+        self.assertEqual(res['Content-Type'], 'text/csv')
+        self.assertEqual(lines, [
+            'id,owner,stock,type,quantity,limit_price,filled_quantity',
+            f'{self.base_order.id},{self.base_user.id},{self.base_stock.id},1,100,,0',
+        ])
+
+    def test_export_invalid_format(self):
+        """
+        Test that an unknown export format is rejected
+        """
+        res = self.client.get('/stocks/export/?fmt=xml')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BenchmarkTests(APITestCase):
+    """
+    Tests for the benchmark harness
+    """
+    def test_benchmark_every_endpoint(self):
+        """
+        Test that every benchmarked endpoint succeeds on seeded data
+        """
+        benchmark.seed(users=2, stocks=3, orders=20)
+        results = benchmark.run(requests=2)
+
+        self.assertEqual(set(results), {endpoint.name for endpoint in benchmark.get_endpoints()})
+        for name, result in results.items():
+            self.assertEqual(result['requests'], 2)
+            self.assertTrue(all(code.startswith('2') for code in result['status_codes']), name)
+
+    def test_benchmark_covers_router(self):
+        """
+        Test that every route of the API router is benchmarked
+        """
+        benchmark.seed(users=1, stocks=1, orders=1)
+        context = benchmark.get_context()
+        paths = [endpoint.get_path(context).split('?')[0] for endpoint in benchmark.get_endpoints()]
+        benchmarked = {resolve(path).url_name for path in paths}
+        routes = {pattern.name for pattern in router.urls if pattern.name != 'api-root'}
+
+        self.assertEqual(routes - benchmarked, set())
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True, INSTRUMENTATION_N_PLUS_ONE_THRESHOLD=5)
+class InstrumentationTests(BaseTest):
+    """
+    Tests for the instrumentation middleware and metrics endpoint
+    """
+    def setUp(self):
+        super().setUp()
+        registry.clear()
+
+    def test_metrics_recorded_per_view(self):
+        """
+        Test that requests are recorded per viewset action
+        """
+        self.client.get('/stocks/', format='json')
+        res = self.client.get('/metrics/')
+        content = res.content.decode()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('core_request_duration_seconds_count{view="StockViewSet.list"} 1', content)
+        self.assertIn('core_request_queries_count{view="StockViewSet.list"} 1', content)
+        self.assertIn('core_request_render_seconds_count{view="StockViewSet.list"} 1', content)
+
+    def test_n_plus_one_flagged(self):
+        """
+        Test that a view repeating the same query is flagged
+        """
+        def view(request):
+            for stock in Stock.objects.all():
+                for x in range(5):
+                    Order.objects.filter(stock=stock).count()
+            return None
+
+        request = RequestFactory().get('/')
+        request.resolver_match = ResolverMatch(view, (), {})
+        with self.assertLogs('core.middleware', level='WARNING'):
+            InstrumentationMiddleware(view)(request)
+
+        self.assertIn('core_request_n_plus_one_total{view="view"} 1', registry.render())
+
+    @override_settings(INSTRUMENTATION_ENABLED=False)
+    def test_instrumentation_disabled(self):
+        """
+        Test that the middleware and endpoint are off unless enabled
+        """
+        with self.assertRaises(MiddlewareNotUsed):
+            InstrumentationMiddleware(lambda request: None)
+        res = self.client.get('/metrics/')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ValuesSerializerTests(BaseTest):
+    """
+    Tests for the read-only values serializers
+    """
+    def test_stock_values_serializer_identical(self):
+        """
+        Test that the stock values serializer renders the same bytes as StockSerializer
+        """
+        Stock.objects.create(name='Precise', price='12.5')
+        Stock.objects.create(name='Unicode \u00e9', price='99999.99')
+        queryset = Stock.objects.order_by('id')
+
+        expected = JSONRenderer().render(StockSerializer(queryset, many=True).data)
+        actual = JSONRenderer().render(StockValuesSerializer(StockValuesSerializer.values(queryset)).data)
+
+        self.assertEqual(actual, expected)
+
+    def test_order_values_serializer_identical(self):
+        """
+        Test that the order values serializer renders the same bytes as OrderSerializer
+        """
+        Order.objects.create(owner=self.super_user, stock=self.base_stock, type=Order.SELL, quantity=3)
+        queryset = Order.objects.order_by('id')
+
+        expected = JSONRenderer().render(OrderSerializer(queryset, many=True).data)
+        actual = JSONRenderer().render(OrderValuesSerializer(OrderValuesSerializer.values(queryset)).data)
+
+        self.assertEqual(actual, expected)
+
+
+class AsyncViewTests(TransactionTestCase):
+    """
+    Tests for the async read endpoints
+    """
+    def setUp(self):
+        cache.clear()
+        self.base_user = User.objects.create_user('macrovue', 'test@test.com', 'pass123')
+        self.token = Token.objects.create(user=self.base_user)
+        self.base_stock = Stock.objects.create(name='Sample Stock', price='1.0')
+        self.base_order = Order.objects.create(owner=self.base_user, stock=self.base_stock, type=1, quantity=100)
+        self.async_client = AsyncClient()
+
+    async def test_async_stock_list(self):
+        """
+        Test that the async stock list matches the viewset response
+        """
+        res = await self.async_client.get('/async/stocks/')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(res.content), [{'id': self.base_stock.id, 'name': 'Sample Stock', 'price': '1.00'}])
+
+    async def test_async_stock_detail_not_found(self):
+        """
+        Test that a missing stock is a 404
+        """
+        res = await self.async_client.get('/async/stocks/0/')
+        viewset_res = await sync_to_async(self.client.get)('/stocks/0/')
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(res['Content-Type'], 'application/json')
+        self.assertEqual(res.content, viewset_res.content)
+
+    async def test_async_order_list(self):
+        """
+        Test that the async order list requires authentication and is paginated
+        """
+        unauthorized = await self.async_client.get('/async/orders/')
+        res = await self.async_client.get('/async/orders/', AUTHORIZATION=f'Token {self.token.key}')
+
+        self.assertEqual(unauthorized.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual([order['id'] for order in json.loads(res.content)['results']], [self.base_order.id])
+
+    async def test_async_total_invested(self):
+        """
+        Test the async total invested endpoint
+        """
+        data = {'owner': self.base_user.id, 'stock': self.base_stock.id}
+        res = await self.async_client.post('/async/total-invested/', data=data, content_type='application/json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(res.content)['total_invested'], 100.0)
+
+    async def test_async_requests_concurrent(self):
+        """
+        Test that the middleware do not serialize concurrent async requests
+        """
+        @database_sync_to_async
+        def slow_list_stocks(params):
+            time.sleep(0.3)
+            return []
+
+        with mock.patch('core.async_views.list_stocks', slow_list_stocks):
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                AsyncClient().get('/async/stocks/', HTTP_ACCEPT_ENCODING='gzip') for x in range(5)
+            ])
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual([res.status_code for res in responses], [status.HTTP_200_OK] * 5)
+        self.assertLess(elapsed, 1.0)
+
+    async def asgi_get(self, path, query_string=b'', headers=()):
+        """
+        Sends a GET request through the ASGI application and returns the response messages
+        """
+        from macrovueexam.asgi import application
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string, 'headers': list(headers)}
+        await application(scope, receive, send)
+        return messages
+
+    async def test_asgi_stock_export(self):
+        """
+        Test that the stock export streams its rows under ASGI
+        """
+        messages = await self.asgi_get('/stocks/export/')
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+
+        self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+        self.assertEqual(
+            [json.loads(line) for line in body.decode().splitlines()],
+            [{'id': self.base_stock.id, 'name': 'Sample Stock', 'price': '1.00'}]
+        )
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    async def test_asgi_order_export(self):
+        """
+        Test that the order export streams every chunk under ASGI
+        """
+        await database_sync_to_async(Order.objects.create)(
+            owner=self.base_user, stock=self.base_stock, type=Order.SELL, quantity=5
+        )
+        messages = await self.asgi_get(
+            '/orders/export/', b'fmt=csv', [(b'authorization', f'Token {self.token.key}'.encode())]
+        )
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+
+        self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+        self.assertEqual(len(body.decode().splitlines()), 3)
+        self.assertEqual(messages[-1], {'type': 'http.response.body'})
+
+    @override_settings(INSTRUMENTATION_ENABLED=True)
+    async def test_async_requests_instrumented(self):
+        """
+        Test that the queries run in worker threads by async views are recorded
+        """
+        registry.clear()
+        await AsyncClient().get('/async/stocks/')
+        content = registry.render()
+
+        self.assertIn('core_request_duration_seconds_count{view="stock_list"} 1', content)
+        self.assertIn('core_request_queries_sum{view="stock_list"} 1', content)
+        self.assertNotIn('core_request_db_seconds_sum{view="stock_list"} 0\n', content)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.healthy = True
+        self.closed = False
+
+
+class ConnectionPoolTests(TestCase):
+    """
+    Tests for the in-process connection pool
+    """
+    def create_pool(self, **kwargs):
+        options = {'max_size': 2, 'timeout': 0.01, 'check_interval': 0}
+        options.update(kwargs)
+        return ConnectionPool(
+            connect=FakeConnection,
+            check=lambda connection: connection.healthy,
+            reset=lambda connection: None,
+            close=lambda connection: setattr(connection, 'closed', True),
+            **options
+        )
+
+    def test_pool_reuses_released_connections(self):
+        """
+        Test that a released connection is handed out again
+        """
+        pool = self.create_pool()
+        connection = pool.acquire()
+        pool.release(connection)
+
+        self.assertIs(pool.acquire(), connection)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_pool_times_out_when_saturated(self):
+        """
+        Test that acquiring from a saturated pool times out
+        """
+        pool = self.create_pool()
+        pool.acquire()
+        pool.acquire()
+
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        self.assertEqual(pool.stats()['in_use'], 2)
+
+    def test_pool_discards_unhealthy_connections(self):
+        """
+        Test that a connection failing its health check is replaced
+        """
+        pool = self.create_pool()
+        connection = pool.acquire()
+        pool.release(connection)
+        connection.healthy = False
+
+        replacement = pool.acquire()
+
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['discarded'], 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_pool_metrics(self):
+        """
+        Test that pool saturation is exposed as metrics
+        """
+        pools['test'] = self.create_pool()
+        self.addCleanup(pools.pop, 'test')
+        pools['test'].acquire()
+
+        metrics = {name: samples for name, kind, help_text, samples in collect_pool_metrics()}
+
+        self.assertEqual(metrics['core_db_pool_in_use'][(('alias', 'test'),)], 1)
+        self.assertIn('core_db_pool_in_use{alias="test"} 1', registry.render())
+
+
+class HealthTests(BaseTest):
+    """
+    Tests for the database readiness checks
+    """
+    def test_liveness(self):
+        """
+        Test that the liveness probe answers without the database
+        """
+        with self.assertNumQueries(0):
+            res = self.client.get('/healthz/')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_readiness(self):
+        """
+        Test that the readiness probe queries the database
+        """
+        with self.assertNumQueries(1):
+            res = self.client.get('/readyz/')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_readiness_database_unavailable(self):
+        """
+        Test that the readiness probe fails while the database is unavailable
+        """
+        with mock.patch('core.views.check_database', side_effect=OperationalError('down')):
+            res = self.client.get('/readyz/')
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_wait_for_db_retries_until_available(self):
+        """
+        Test that wait_for_db retries with backoff until the database answers
+        """
+        side_effect = [OperationalError('down'), OperationalError('down'), None]
+        with mock.patch('core.health.check_database', side_effect=side_effect), \
+                mock.patch('core.health.time.sleep') as sleep:
+            call_command('wait_for_db', stdout=StringIO())
+
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_wait_for_db_timeout(self):
+        """
+        Test that wait_for_db gives up after the timeout
+        """
+        with mock.patch('core.health.check_database', side_effect=OperationalError('down')):
+            with self.assertRaises(CommandError):
+                call_command('wait_for_db', timeout=0, stdout=StringIO())
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRoutingTests(BaseTest):
+    """
+    Tests for the read replica router and middleware
+    """
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+
+    def get_read_alias(self, request):
+        aliases = []
+
+        def get_response(request):
+            aliases.append(self.router.db_for_read(Order))
+            return HttpResponse(status=201 if request.method == 'POST' else 200)
+
+        ReplicaRoutingMiddleware(get_response)(request)
+        return aliases[0]
+
+    def test_router(self):
+        """
+        Test that only allowed reads of the replicated apps go to a replica
+        """
+        self.assertEqual(self.router.db_for_read(Stock), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Stock), 'replica_0')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(self.router.db_for_write(Stock), 'default')
+        self.assertFalse(self.router.allow_migrate('replica_0', 'core'))
+
+    def test_safe_requests_read_replica(self):
+        """
+        Test that safe requests read from a replica and writes from the primary
+        """
+        self.assertEqual(self.get_read_alias(self.factory.get('/orders/')), 'replica_0')
+        self.assertEqual(self.get_read_alias(self.factory.post('/orders/')), 'default')
+
+    def test_read_your_writes(self):
+        """
+        Test that a client reads from the primary after its own write
+        """
+        self.get_read_alias(self.factory.post('/orders/', HTTP_AUTHORIZATION='Token writer'))
+        writer = self.get_read_alias(self.factory.get('/orders/', HTTP_AUTHORIZATION='Token writer'))
+        other = self.get_read_alias(self.factory.get('/orders/', HTTP_AUTHORIZATION='Token other'))
+
+        self.assertEqual(writer, 'default')
+        self.assertEqual(other, 'replica_0')
+
+    def test_stock_cache_filled_from_primary(self):
+        """
+        Test that stock responses are cached from the primary, not a lagging replica
+        """
+        aliases = []
+
+        @stock_cache
+        def view(viewset, request):
+            aliases.append(self.router.db_for_read(Stock))
+            return Response([], status=status.HTTP_200_OK)
+
+        with replica_reads():
+            view(None, self.factory.get('/stocks/'))
+            aliases.append(self.router.db_for_read(Stock))
+
+        self.assertEqual(aliases, ['default', 'replica_0'])
+
+    def test_async_requests_read_replica(self):
+        """
+        Test that the middleware routes async requests too
+        """
+        aliases = []
+
+        async def get_response(request):
+            aliases.append(self.router.db_for_read(Order))
+            return HttpResponse(status=201 if request.method == 'POST' else 200)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        asyncio.run(middleware(self.factory.get('/orders/')))
+        asyncio.run(middleware(self.factory.post('/orders/')))
+
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        self.assertEqual(aliases, ['replica_0', 'default'])
+
+    def test_middleware_unused_without_replicas(self):
+        """
+        Test that the middleware is disabled without replicas
+        """
+        with override_settings(DATABASE_REPLICAS=[]):
+            with self.assertRaises(MiddlewareNotUsed):
+                ReplicaRoutingMiddleware(lambda request: None)
+
+
+class PortfolioTests(BaseTest):
+    """
+    Tests for the portfolio valuation endpoint
+    """
+    def setUp(self):
+        super().setUp()
+        self.other_stock = Stock.objects.create(name='Other Stock', price='3.00')
+        Order.objects.create(owner=self.base_user, stock=self.other_stock, type=Order.BUY, quantity=50)
+        Order.objects.create(owner=self.base_user, stock=self.other_stock, type=Order.SELL, quantity=20)
+        Order.objects.create(owner=self.super_user, stock=self.other_stock, type=Order.BUY, quantity=999)
+        call_command('rebuild_positions', stdout=StringIO())
+
+    def test_portfolio_two_queries(self):
+        """
+        Test that all holdings are valued with one query for the orders and one for the archived orders
+        """
+        with self.assertNumQueries(2):
+            holdings = portfolio.get_holdings(self.base_user)
+
+        self.assertEqual([(holding['stock'], holding['net_quantity']) for holding in holdings], [
+            (self.base_stock.id, 100),
+            (self.other_stock.id, 30),
+        ])
+
+    def test_portfolio_list(self):
+        """
+        Test the portfolio of the authenticated user
+        """
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.get('/portfolio/', format='json')
+        self.client.logout()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['total_market_value'], '190.00')
+        self.assertEqual(res.data['total_cost'], '190.00')
+        self.assertEqual(res.data['holdings'][1]['market_value'], '90.00')
+        self.assertAlmostEqual(res.data['holdings'][1]['weight'], 90 / 190)
+
+    def test_portfolio_weights_without_numpy(self):
+        """
+        Test that the weights are the same without NumPy
+        """
+        values = [Decimal('100.00'), Decimal('90.00'), Decimal('-10.00')]
+        weights = portfolio.get_weights(values, sum(values))
+        with mock.patch.object(portfolio, 'numpy', None):
+            fallback_weights = portfolio.get_weights(values, sum(values))
+
+        self.assertEqual(weights, fallback_weights)
+        self.assertEqual(portfolio.get_weights(values[:1], Decimal(0)), [0.0])
+
+    def test_portfolio_owner_admin_only(self):
+        """
+        Test that only admins can view the portfolio of other users
+        """
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.get(f'/portfolio/?owner={self.super_user.id}', format='json')
+        self.client.logout()
+        self.client.login(username=self.super_user.username, password='superpass123')
+        admin_res = self.client.get(f'/portfolio/?owner={self.base_user.id}', format='json')
+        self.client.logout()
+
+        self.assertEqual(res.data['owner'], self.base_user.id)
+        self.assertEqual(admin_res.data['owner'], self.base_user.id)
+
+
+class ArchiveTests(BaseTest):
+    """
+    Tests for the archival of old orders
+    """
+    def setUp(self):
+        super().setUp()
+        engine.clear()
+        self.sell_order = Order.objects.create(
+            owner=self.base_user, stock=self.base_stock, type=Order.SELL, quantity=30
+        )
+        self.open_order = Order.objects.create(
+            owner=self.base_user, stock=self.base_stock, type=Order.BUY, quantity=10, limit_price='0.50'
+        )
+        Order.objects.update(created=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        self.recent_order = Order.objects.create(
+            owner=self.base_user, stock=self.base_stock, type=Order.BUY, quantity=5
+        )
+        self.cutoff = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+    def test_archive_to_table(self):
+        """
+        Test that old closed orders move to the archived order table in batches
+        """
+        report = archive_orders(self.cutoff, TableStore(), batch_size=1)
+
+        self.assertEqual((report['archived'], report['batches']), (2, 2))
+        self.assertEqual(
+            set(ArchivedOrder.objects.values_list('id', flat=True)),
+            {self.base_order.id, self.sell_order.id},
+        )
+        self.assertEqual(
+            set(Order.objects.values_list('id', flat=True)),
+            {self.open_order.id, self.recent_order.id},
+        )
+        summary = OrderSummary.objects.get(owner=self.base_user, stock=self.base_stock)
+        self.assertEqual((summary.quantity, summary.orders), (70, 2))
+
+    def test_archive_to_files(self):
+        """
+        Test that archived orders are written to indexed compressed files and still retrievable
+        """
+        with tempfile.TemporaryDirectory() as path:
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command(
+                    'archive_orders', '--before', '2021-01-01', '--to', 'files', '--path', path, stdout=StringIO()
+                )
+            archive_file = ArchiveFile.objects.get()
+            archived = find_archived_order(self.sell_order.id)
+
+            self.assertEqual(os.listdir(path), [os.path.basename(archive_file.path)])
+            self.assertEqual(FileStore.find(self.recent_order.id), None)
+
+        self.assertEqual((archive_file.min_id, archive_file.max_id, archive_file.count), (
+            self.base_order.id, self.sell_order.id, 2
+        ))
+        self.assertEqual(OrderValuesSerializer.to_representation(archived), OrderSerializer(self.sell_order).data)
+        self.assertFalse(ArchivedOrder.objects.exists())
+
+    def test_archive_rollback_discards_file(self):
+        """
+        Test that a batch rolled back after writing its file leaves no file behind
+        """
+        with tempfile.TemporaryDirectory() as path:
+            with mock.patch.object(OrderSummary, 'add', side_effect=OperationalError('rejected')), \
+                    self.assertRaises(OperationalError):
+                archive_orders(self.cutoff, FileStore(path))
+
+            self.assertEqual(os.listdir(path), [])
+        self.assertEqual(Order.objects.count(), 4)
+
+    def test_archive_before_id(self):
+        """
+        Test that orders older than their created column are archived by id
+        """
+        out = StringIO()
+        call_command('archive_orders', '--before-id', self.sell_order.id, stdout=out)
+
+        self.assertEqual(json.loads(out.getvalue())['archived'], 1)
+        self.assertEqual(list(ArchivedOrder.objects.values_list('id', flat=True)), [self.base_order.id])
+
+    def test_archive_retrieve(self):
+        """
+        Test that an archived order is still served by the order endpoint
+        """
+        expected = OrderSerializer(self.base_order).data
+        archive_orders(self.cutoff, TableStore())
+
+        self.client.login(username=self.base_user.username, password='pass123')
+        res = self.client.get(f'/orders/{self.base_order.id}/')
+        missing = self.client.get('/orders/0/')
+        self.client.logout()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, expected)
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_archive_keeps_aggregates(self):
+        """
+        Test that the total invested, the portfolio and rebuilt positions include archived orders
+        """
+        call_command('rebuild_positions', stdout=StringIO())
+        total_invested = self.base_stock.get_total_invested(self.base_user)
+        holdings = portfolio.get_holdings(self.base_user)
+        archive_orders(self.cutoff, TableStore())
+        call_command('rebuild_positions', stdout=StringIO())
+
+        self.assertEqual(self.base_stock.get_total_invested(self.base_user), total_invested)
+        self.assertEqual(portfolio.get_holdings(self.base_user), holdings)
+        self.assertEqual(Position.objects.get(owner=self.base_user, stock=self.base_stock).quantity, 75)
+
+    def test_archive_keeps_executions(self):
+        """
+        Test that executions of archived orders are kept
+        """
+        seller = User.objects.create_user('seller', 'seller@test.com', 'pass123')
+        sell_order = Order.objects.create(
+            owner=seller, stock=self.base_stock, type=Order.SELL, quantity=10, limit_price='0.50'
+        )
+        engine.submit(sell_order)
+        Order.objects.update(created=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        archive_orders(self.cutoff, TableStore())
+
+        execution = Execution.objects.get()
+        self.assertEqual((execution.buy_order_id, execution.sell_order_id), (self.open_order.id, sell_order.id))
+        self.assertFalse(Order.objects.filter(id__in=[self.open_order.id, sell_order.id]).exists())
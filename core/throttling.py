@@ -0,0 +1,49 @@
+import hashlib
+
+from rest_framework.settings import api_settings
+from rest_framework.throttling import ScopedRateThrottle, SimpleRateThrottle
+
+
+class ScopedIPRateThrottle(ScopedRateThrottle):
+    """
+    Throttles the views with a `throttle_scope` per client IP, at the
+    `<throttle_scope>_ip` rate of DEFAULT_THROTTLE_RATES.
+    """
+    scope_suffix = 'ip'
+
+    @property
+    def THROTTLE_RATES(self):
+        return api_settings.DEFAULT_THROTTLE_RATES
+
+    def allow_request(self, request, view):
+        scope = getattr(view, self.scope_attr, None)
+        if not scope:
+            return True
+
+        self.scope = f'{scope}_{self.scope_suffix}'
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return SimpleRateThrottle.allow_request(self, request, view)
+
+    def get_ident_for_scope(self, request):
+        return self.get_ident(request)
+
+    def get_cache_key(self, request, view):
+        ident = self.get_ident_for_scope(request)
+        if ident is None:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+
+class ScopedUsernameRateThrottle(ScopedIPRateThrottle):
+    """
+    Throttles the views with a `throttle_scope` per submitted username, at
+    the `<throttle_scope>_username` rate of DEFAULT_THROTTLE_RATES.
+    """
+    scope_suffix = 'username'
+
+    def get_ident_for_scope(self, request):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not isinstance(username, str) or not username:
+            return None
+        return hashlib.sha256(username.lower().encode()).hexdigest()
@@ -1,13 +1,49 @@
+import queue
+
+from concurrent import futures
+
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.utils import IntegrityError, OperationalError
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404
 
-from rest_framework import permissions, status, viewsets
+from rest_framework import exceptions, permissions, serializers, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 
-from core.models import Order, Stock
-from core.serializer import LoginSerializer, OrderSerializer, StockSerializer, TotalInvestedSerializer, UserSerializer
+from core.archive import find_archived_order
+from core.authentication import issue_signed_token
+from core.cache import stock_cache
+from core.export import EXPORT_CONTENT_TYPES, export_response
+from core.filters import OrderFilter
+from core.health import check_database
+from core.ingestion import ingester
+from core.instrumentation import registry
+from core.matching import engine
+from core.models import Order, Position, PriceTick, Stock
+from core.pagination import OrderCursorPagination
+from core.portfolio import get_portfolio
+from core.prices import decode_lines, update_prices
+from core.serializer import (
+    LoginSerializer, OrderBulkSerializer, OrderSerializer, OrderValuesSerializer, PortfolioSerializer,
+    PriceBucketSerializer, PriceHistorySerializer, StockSearchSerializer, StockSerializer, StockValuesSerializer,
+    TotalInvestedSerializer, UserSerializer
+)
+from core.throttling import ScopedIPRateThrottle, ScopedUsernameRateThrottle
+
+
+def get_export_format(request):
+    """
+    Returns the export format requested with the `fmt` query parameter
+    """
+    export_format = request.GET.get('fmt', 'ndjson')
+    if export_format not in EXPORT_CONTENT_TYPES:
+        raise serializers.ValidationError({'fmt': f'Must be one of: {", ".join(EXPORT_CONTENT_TYPES)}'})
+    return export_format
 
 
 class SignUpViewSet(viewsets.ViewSet):
@@ -15,6 +51,8 @@ class SignUpViewSet(viewsets.ViewSet):
     ViewSet for creating a user
     """
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [ScopedIPRateThrottle, ScopedUsernameRateThrottle]
+    throttle_scope = 'signup'
 
     def create(self, request):
         serializer = UserSerializer(data=request.data)
@@ -30,11 +68,17 @@ class LoginViewSet(viewsets.ViewSet):
     ViewSet for logging in
     """
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [ScopedIPRateThrottle, ScopedUsernameRateThrottle]
+    throttle_scope = 'login'
 
     def create(self, request):
         serializer = LoginSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.validated_data
+            if settings.AUTH_STATELESS:
+                json = serializer.data
+                json['token'] = issue_signed_token(user)
+                return Response(json, status=status.HTTP_202_ACCEPTED)
             login(request, user)
             if user:
                 token, created = Token.objects.get_or_create(user=user)
@@ -52,7 +96,11 @@ class LogoutViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def list(self, request):
-        logout(request)
+        if isinstance(request.auth, Token):
+            # Revoking the token also drops it from the authentication cache
+            request.auth.delete()
+        if not settings.AUTH_STATELESS:
+            logout(request)
         return Response({'detail': 'Logout successful'}, status=status.HTTP_200_OK)
 
 
@@ -65,7 +113,7 @@ class StockViewSet(viewsets.ViewSet):
         """
         Instantiates and returns the list of permissions that this view requires.
         """
-        if self.action == 'create':
+        if self.action in ('create', 'prices'):
             permission_classes = [permissions.IsAdminUser]
         else:
             permission_classes = [permissions.AllowAny]
@@ -79,21 +127,61 @@ class StockViewSet(viewsets.ViewSet):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @stock_cache
     def list(self, request):
         if request.GET.get('search'):
-            search_param = request.GET.get('search')
-            queryset = Stock.objects.filter(name__contains=search_param)
+            search_serializer = StockSearchSerializer(data=request.GET)
+            search_serializer.is_valid(raise_exception=True)
+            queryset = Stock.objects.search(**search_serializer.validated_data)
         else:
             queryset = Stock.objects.all()
-        serializer = StockSerializer(queryset, many=True)
+        serializer = StockValuesSerializer(StockValuesSerializer.values(queryset))
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @stock_cache
     def retrieve(self, request, pk=None):
         queryset = Stock.objects.all()
         stock = get_object_or_404(queryset, pk=pk)
         serializer = StockSerializer(stock)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        export_format = get_export_format(request)
+        return export_response(Stock.objects.all(), StockValuesSerializer, export_format, 'stocks')
+
+    @action(detail=True, methods=['get'])
+    def history(self, request, pk=None):
+        """
+        Returns the price history of the stock downsampled to OHLC buckets
+        """
+        stock = get_object_or_404(Stock.objects.all(), pk=pk)
+        history_serializer = PriceHistorySerializer(data=request.GET)
+        history_serializer.is_valid(raise_exception=True)
+        data = history_serializer.validated_data
+        ticks = PriceTick.objects.filter(stock=stock, timestamp__range=(data['start'], data['end']))
+        serializer = PriceBucketSerializer(ticks.ohlc(data['resolution']), many=True)
+        return Response(
+            {'stock': stock.id, 'resolution': data['resolution'], 'points': serializer.data},
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['post'])
+    def prices(self, request):
+        """
+        Updates stock prices from a CSV or NDJSON body of `stock` and `price`
+        records, read as a stream without parsing the whole body at once.
+        """
+        price_formats = {content_type: name for name, content_type in EXPORT_CONTENT_TYPES.items()}
+        price_format = price_formats.get(request.content_type.split(';')[0].strip())
+        if price_format is None:
+            raise exceptions.UnsupportedMediaType(request.content_type)
+        if request.stream is None:
+            return Response({'detail': 'Expected a list of prices'}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = update_prices(decode_lines(request.stream), price_format)
+        return Response(report, status=status.HTTP_200_OK)
+
 
 class OrderViewSet(viewsets.ViewSet):
     """
@@ -106,21 +194,153 @@ class OrderViewSet(viewsets.ViewSet):
         if serializer.is_valid():
             if serializer.validated_data['owner'] != request.user:
                 return Response({'detail': 'Unable to create orders for other users'}, status=status.HTTP_403_FORBIDDEN)
-            serializer.save()
+            if settings.ORDER_INGESTION_ENABLED and serializer.validated_data.get('limit_price') is None:
+                return self.ingest(request, Order(**serializer.validated_data))
+            with transaction.atomic():
+                # Saving the order books it in the position of its owner
+                order = serializer.save()
+                if order.limit_price is not None:
+                    engine.submit(order)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    def list(self, request):
+    def ingest(self, request, order):
+        """
+        Queues the order for write-behind ingestion. It is answered with a 202
+        while pending, or with a 201 once committed when `wait=true` is passed.
+        """
+        try:
+            future = ingester.submit(order)
+        except queue.Full:
+            return Response(
+                {'detail': 'Too many pending orders, retry later'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '1'}
+            )
+
+        if request.GET.get('wait', '').lower() == 'true':
+            try:
+                order = future.result(timeout=settings.ORDER_INGESTION_WAIT_TIMEOUT)
+            except futures.TimeoutError:
+                pass
+            except IntegrityError:
+                return Response(
+                    {'detail': 'Unable to save the order, its owner or stock no longer exists'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            except Exception:
+                # The flusher logged the failure
+                return Response(
+                    {'detail': 'Unable to save the order, retry later'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': '1'}
+                )
+            else:
+                return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
+        return Response(OrderSerializer(order).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Creates a list of orders in one transaction. Nothing is created if any
+        order is invalid, and the errors are reported per order. Limit orders
+        are matched like orders created one at a time.
+        """
+        if not isinstance(request.data, list) or not request.data:
+            return Response({'detail': 'Expected a list of orders'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > settings.ORDER_BULK_MAX_SIZE:
+            return Response(
+                {'detail': f'Unable to create more than {settings.ORDER_BULK_MAX_SIZE} orders at once'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        errors = []
+        validated = []
+        for item in request.data:
+            serializer = OrderBulkSerializer(data=item)
+            if serializer.is_valid():
+                errors.append({})
+                validated.append(serializer.validated_data)
+            else:
+                errors.append(serializer.errors)
+                validated.append(None)
+
+        stocks = Stock.objects.in_bulk({data['stock'] for data in validated if data})
+        forbidden = False
+        orders = []
+        for item_errors, data in zip(errors, validated):
+            if data is None:
+                continue
+            if data['owner'] != request.user.id:
+                item_errors['owner'] = ['Unable to create orders for other users']
+                forbidden = True
+            stock = stocks.get(data['stock'])
+            if stock is None:
+                item_errors['stock'] = [f'Invalid pk "{data["stock"]}" - object does not exist.']
+            orders.append(Order(
+                owner=request.user,
+                stock=stock,
+                type=data['type'],
+                quantity=data['quantity'],
+                limit_price=data.get('limit_price'),
+            ))
+
+        if any(errors):
+            return Response(errors, status=status.HTTP_403_FORBIDDEN if forbidden else status.HTTP_400_BAD_REQUEST)
+
+        limit_orders = [order for order in orders if order.limit_price is not None]
+        with transaction.atomic():
+            Position.apply_orders([order for order in orders if order.limit_price is None])
+            Order.objects.bulk_create([order for order in orders if order.limit_price is None])
+            # Matched in the order of the basket within a stock, with the
+            # stocks locked in id order so concurrent baskets do not deadlock
+            for order in sorted(limit_orders, key=lambda order: order.stock_id):
+                order.save()
+                engine.submit(order)
+        if limit_orders:
+            # Limit orders of the basket may have been filled by later ones
+            filled = Order.objects.in_bulk([order.id for order in limit_orders])
+            for order in limit_orders:
+                order.filled_quantity = filled[order.id].filled_quantity
+        serializer = OrderSerializer(orders, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def filter_queryset(self, request):
+        """
+        Returns the orders visible to the user, applying the admin filters.
+        """
         queryset = Order.objects.all()
-        serializer = OrderSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        if request.user.is_staff:
+            filterset = OrderFilter(request.GET, queryset=queryset)
+            if not filterset.is_valid():
+                raise serializers.ValidationError(filterset.errors)
+            return filterset.qs
+        return queryset.filter(owner=request.user)
+
+    def list(self, request):
+        queryset = self.filter_queryset(request)
+        paginator = OrderCursorPagination()
+        page = paginator.paginate_queryset(OrderValuesSerializer.values(queryset), request, view=self)
+        serializer = OrderValuesSerializer(page)
+        return paginator.get_paginated_response(serializer.data)
 
     def retrieve(self, request, pk=None):
-        queryset = Order.objects.all()
-        order = get_object_or_404(queryset, pk=pk)
+        order = Order.objects.filter(pk=pk).first()
+        if order is None:
+            # Old closed orders are moved out of the order table by `archive_orders`
+            archived = find_archived_order(pk)
+            if archived is None:
+                raise Http404
+            return Response(OrderValuesSerializer.to_representation(archived), status=status.HTTP_200_OK)
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        export_format = get_export_format(request)
+        queryset = self.filter_queryset(request)
+        return export_response(queryset, OrderValuesSerializer, export_format, 'orders')
+
 class TotalInvestedViewSet(viewsets.ViewSet):
     """
     ViewSet for total invested on a Stock by a User
@@ -133,3 +353,54 @@ class TotalInvestedViewSet(viewsets.ViewSet):
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+class PortfolioViewSet(viewsets.ViewSet):
+    """
+    ViewSet for the valuation of every stock held by a User
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request):
+        owner = request.user
+        if request.user.is_staff and request.GET.get('owner'):
+            owner = get_object_or_404(User.objects.all(), pk=request.GET.get('owner'))
+        serializer = PortfolioSerializer(get_portfolio(owner))
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+def metrics(request):
+    """
+    Exposes the instrumentation metrics in the Prometheus text format
+    """
+    if not settings.INSTRUMENTATION_ENABLED:
+        raise Http404()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
+
+
+def price_stream_unavailable(request):
+    """
+    The price stream is served by the ASGI application in front of Django,
+    its path is routed here so WSGI servers do not take it for a stock id
+    """
+    return JsonResponse(
+        {'detail': 'The price stream is only served by the ASGI application.'},
+        status=status.HTTP_501_NOT_IMPLEMENTED,
+    )
+
+
+def liveness(request):
+    """
+    Liveness probe, answers as long as the process serves requests
+    """
+    return JsonResponse({'status': 'ok'})
+
+
+def readiness(request):
+    """
+    Readiness probe, answers 503 until the database can be queried
+    """
+    try:
+        check_database()
+    except OperationalError:
+        return JsonResponse({'status': 'unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return JsonResponse({'status': 'ok'})
@@ -2,6 +2,8 @@
 ASGI config for macrovueexam project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The price stream is served by a raw ASGI application in front of Django, whose
+streaming responses are iterated outside the event loop by `core.handlers`.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
@@ -9,8 +11,19 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'macrovueexam.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+from core.handlers import ASGIHandler  # noqa: E402 needs the apps loaded
+from core.streaming import PRICE_STREAM_PATH, price_stream  # noqa: E402
+
+django_application = ASGIHandler()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == PRICE_STREAM_PATH:
+        return await price_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import importlib.util
 import os
 
 from pathlib import Path
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -48,6 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.InstrumentationMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,14 +88,88 @@ WSGI_APPLICATION = 'macrovueexam.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.environ.get('DB_ENGINE', 'django.db.backends.postgresql'),
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        # Seconds a connection is kept open between requests, 0 closes it after each request
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# Optional in-process connection pool. Connections are returned to the pool
+# instead of being closed, so they are released at the end of each request.
+if os.environ.get('DB_POOL_ENABLED', 'false').lower() == 'true':
+    DATABASES['default'].update({
+        'ENGINE': 'core.db.backends.postgresql',
+        'CONN_MAX_AGE': 0,
+        'POOL': {
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'CHECK_INTERVAL': float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30)),
+            'MAX_LIFETIME': float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+        },
+    })
+
+# Optional read replicas of the primary, one alias per host. Safe requests
+# read the models of DATABASE_REPLICA_APPS from a replica, except for clients
+# that wrote within DB_REPLICA_STICKY_SECONDS. Stickiness is kept in the
+# default cache, which must be shared by all workers when using replicas.
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_REPLICA_APPS = ['core']
+
+DATABASE_ROUTERS = ['core.db.routers.ReplicaRouter']
+
+DB_REPLICA_STICKY_SECONDS = int(os.environ.get('DB_REPLICA_STICKY_SECONDS', 10))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Seconds a cached stock response is kept. The local-memory cache is per
+# process, so this also bounds staleness across workers. ETags hash the
+# response content, so a worker stops answering outdated ones with a 304
+# once its cached response expires.
+STOCK_CACHE_TIMEOUT = int(os.environ.get('STOCK_CACHE_TIMEOUT', 300))
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/3.2/topics/auth/passwords/
+# The first hasher hashes new passwords, and hashes made by the others are
+# upgraded on the next successful login. Argon2 needs argon2-cffi.
+
+PASSWORD_HASHER = os.environ.get(
+    'PASSWORD_HASHER', 'argon2' if importlib.util.find_spec('argon2') else 'pbkdf2'
+)
+
+PASSWORD_HASHERS = {
+    'argon2': ['core.hashers.ConfigurableArgon2PasswordHasher', 'core.hashers.ConfigurablePBKDF2PasswordHasher'],
+    'pbkdf2': ['core.hashers.ConfigurablePBKDF2PasswordHasher', 'core.hashers.ConfigurableArgon2PasswordHasher'],
+}[PASSWORD_HASHER] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get('PASSWORD_ARGON2_TIME_COST', 2))
+
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 19456))
+
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get('PASSWORD_ARGON2_PARALLELISM', 1))
+
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 260000))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -135,14 +214,136 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Stateless mode: login issues signed, expiring tokens verified without
+# database access, and no session is written.
+
+AUTH_STATELESS = os.environ.get('AUTH_STATELESS', 'false').lower() == 'true'
+
+AUTH_STATELESS_TOKEN_MAX_AGE = int(os.environ.get('AUTH_STATELESS_TOKEN_MAX_AGE', 60 * 60 * 24))
+
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.SignedTokenAuthentication',
+    ] if AUTH_STATELESS else [
+        'core.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated'
     ],
+    # JSON is rendered and parsed with orjson when it is installed, it is an
+    # opt-in dependency left out of requirements.txt
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Number of proxies in front of the application whose X-Forwarded-For
+    # entries are trusted to find the client IP of the per-IP throttles.
+    # With 0 the header is ignored and REMOTE_ADDR is used.
+    'NUM_PROXIES': int(os.environ.get('THROTTLE_NUM_PROXIES', 0)),
+    # Rates of the per-IP and per-username throttles on /login/ and /users/.
+    # Their counters are kept in the default cache, with the local-memory
+    # cache every process throttles on its own.
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': os.environ.get('THROTTLE_LOGIN_IP', '30/min'),
+        'login_username': os.environ.get('THROTTLE_LOGIN_USERNAME', '10/min'),
+        'signup_ip': os.environ.get('THROTTLE_SIGNUP_IP', '10/min'),
+        'signup_username': os.environ.get('THROTTLE_SIGNUP_USERNAME', '5/min'),
+    },
 }
+
+# Pagination for the /orders/ list
+
+ORDER_PAGE_SIZE = int(os.environ.get('ORDER_PAGE_SIZE', 100))
+
+ORDER_MAX_PAGE_SIZE = int(os.environ.get('ORDER_MAX_PAGE_SIZE', 1000))
+
+# Rows fetched per server-side cursor round trip by the streaming exports
+
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+# Maximum number of orders accepted by the bulk order endpoint
+
+ORDER_BULK_MAX_SIZE = int(os.environ.get('ORDER_BULK_MAX_SIZE', 1000))
+
+# Optional write-behind ingestion of orders without a limit price. Orders are
+# queued and saved in batches of up to ORDER_INGESTION_BATCH_SIZE, at most
+# ORDER_INGESTION_MAX_DELAY seconds after the first order of the batch.
+
+ORDER_INGESTION_ENABLED = os.environ.get('ORDER_INGESTION_ENABLED', 'false').lower() == 'true'
+
+ORDER_INGESTION_QUEUE_SIZE = int(os.environ.get('ORDER_INGESTION_QUEUE_SIZE', 10000))
+
+ORDER_INGESTION_BATCH_SIZE = int(os.environ.get('ORDER_INGESTION_BATCH_SIZE', 500))
+
+ORDER_INGESTION_MAX_DELAY = float(os.environ.get('ORDER_INGESTION_MAX_DELAY', 0.01))
+
+# Seconds `POST /orders/?wait=true` waits for its order to be committed
+
+ORDER_INGESTION_WAIT_TIMEOUT = float(os.environ.get('ORDER_INGESTION_WAIT_TIMEOUT', 5))
+
+# Closed orders older than ORDER_ARCHIVE_AFTER_DAYS are moved out of the order
+# table by `archive_orders`, files of the file archive go to ORDER_ARCHIVE_PATH
+
+ORDER_ARCHIVE_AFTER_DAYS = int(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', 365))
+
+ORDER_ARCHIVE_BATCH_SIZE = int(os.environ.get('ORDER_ARCHIVE_BATCH_SIZE', 5000))
+
+ORDER_ARCHIVE_PATH = os.environ.get('ORDER_ARCHIVE_PATH', str(BASE_DIR / 'archive'))
+
+# Default and maximum number of results of the stock search
+
+STOCK_SEARCH_LIMIT = int(os.environ.get('STOCK_SEARCH_LIMIT', 20))
+
+STOCK_SEARCH_MAX_LIMIT = int(os.environ.get('STOCK_SEARCH_MAX_LIMIT', 100))
+
+# Stocks saved per transaction by the bulk price update
+
+STOCK_PRICE_BATCH_SIZE = int(os.environ.get('STOCK_PRICE_BATCH_SIZE', 1000))
+
+# Maximum number of buckets returned by the stock price history
+
+PRICE_HISTORY_MAX_POINTS = int(os.environ.get('PRICE_HISTORY_MAX_POINTS', 1000))
+
+# Server-sent event stream of price changes, served by the ASGI application
+# only: events queued per client before it is disconnected, events kept for
+# clients resuming with Last-Event-ID and seconds between keepalive comments.
+# Changes reach the streams of every process through PostgreSQL NOTIFY, with
+# other databases only the streams of the process that made them.
+
+PRICE_STREAM_QUEUE_SIZE = int(os.environ.get('PRICE_STREAM_QUEUE_SIZE', 100))
+
+PRICE_STREAM_REPLAY_SIZE = int(os.environ.get('PRICE_STREAM_REPLAY_SIZE', 1000))
+
+PRICE_STREAM_HEARTBEAT = float(os.environ.get('PRICE_STREAM_HEARTBEAT', 15))
+
+# Responses of at least COMPRESSION_MIN_SIZE bytes are compressed with
+# brotli, when the brotli package is installed, or gzip
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))
+
+# Per-view query and latency instrumentation, exposed on /metrics/
+
+INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', 'false').lower() == 'true'
+
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = int(os.environ.get('INSTRUMENTATION_N_PLUS_ONE_THRESHOLD', 10))
+
+# Per-process cache of authenticated tokens, and an optional shared cache
+# alias from CACHES. Deactivations reach other processes within the TTL.
+
+TOKEN_AUTH_CACHE_SIZE = int(os.environ.get('TOKEN_AUTH_CACHE_SIZE', 10000))
+
+TOKEN_AUTH_CACHE_TTL = int(os.environ.get('TOKEN_AUTH_CACHE_TTL', 60))
+
+TOKEN_AUTH_SHARED_CACHE = os.environ.get('TOKEN_AUTH_SHARED_CACHE') or None
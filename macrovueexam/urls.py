@@ -19,7 +19,11 @@ from django.urls import include, path
 
 from rest_framework.routers import DefaultRouter
 
-from core.views import SignUpViewSet, LoginViewSet, LogoutViewSet, OrderViewSet, StockViewSet, TotalInvestedViewSet
+from core import async_views
+from core.views import (
+    SignUpViewSet, LoginViewSet, LogoutViewSet, OrderViewSet, PortfolioViewSet, StockViewSet, TotalInvestedViewSet,
+    liveness, metrics, price_stream_unavailable, readiness
+)
 
 router = DefaultRouter()
 router.register(r'users', SignUpViewSet, basename='user')
@@ -28,9 +32,19 @@ router.register(r'logout', LogoutViewSet, basename='logout')
 router.register(r'stocks', StockViewSet, basename='stock')
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'total-invested', TotalInvestedViewSet, basename='total_invested')
+router.register(r'portfolio', PortfolioViewSet, basename='portfolio')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics, name='metrics'),
+    path('healthz/', liveness, name='liveness'),
+    path('readyz/', readiness, name='readiness'),
+    path('stocks/stream/', price_stream_unavailable, name='price_stream'),
+    path('async/stocks/', async_views.stock_list, name='async_stock_list'),
+    path('async/stocks/<int:pk>/', async_views.stock_detail, name='async_stock_detail'),
+    path('async/orders/', async_views.order_list, name='async_order_list'),
+    path('async/orders/<int:pk>/', async_views.order_detail, name='async_order_detail'),
+    path('async/total-invested/', async_views.total_invested, name='async_total_invested'),
 ]
 
 urlpatterns += router.urls